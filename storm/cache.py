@@ -1,4 +1,21 @@
 import itertools
+import threading
+import sys
+
+from storm.info import get_cls_info
+
+
+def _link(root, entry):
+    """Make C{entry} the newest entry of the queue starting at C{root}."""
+    entry[0] = root
+    entry[1] = root[1]
+    root[1][0] = entry
+    root[1] = entry
+
+
+def _unlink(entry):
+    entry[0][1] = entry[1]
+    entry[1][0] = entry[0]
 
 
 class Cache(object):
@@ -8,17 +25,33 @@ class Cache(object):
     even if the user isn't holding any strong references to it.  It does
     that by holding strong references to the objects referenced by the
     last C{N} C{obj_info}s added to it (where C{N} is the cache size).
+
+    All operations but L{get_cached} and L{set_size} take constant time,
+    whatever the size of the cache.
     """
 
     def __init__(self, size=1000):
         self._size = size
-        self._cache = {} # {obj_info: obj, ...}
-        self._order = [] # [obj_info, ...]
+        # Entries are [previous, next, obj_info, obj] lists, linked in
+        # order of use, with the most recently used one after the root.
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self._cache = {} # {obj_info: entry, ...}
+        self._promotions = 0
+        self._insertions = 0
+        self._evictions = 0
 
     def clear(self):
         """Clear the entire cache at once."""
+        root = self._root
+        # Break the cycles, so that the entries are freed at once.
+        entry = root[1]
+        while entry is not root:
+            next_entry = entry[1]
+            del entry[:]
+            entry = next_entry
+        root[:] = [root, root, None, None]
         self._cache.clear()
-        del self._order[:]
 
     def add(self, obj_info):
         """Add C{obj_info} as the most recent entry in the cache.
@@ -28,25 +61,38 @@ class Cache(object):
         (IOW, will be the last to leave).
         """
         if self._size != 0:
-            if obj_info in self._cache:
-                self._order.remove(obj_info)
+            root = self._root
+            entry = self._cache.get(obj_info)
+            if entry is not None:
+                self._promotions += 1
+                if entry is root[1]:
+                    return
+                _unlink(entry)
             else:
-                self._cache[obj_info] = obj_info.get_obj()
-            self._order.insert(0, obj_info)
+                self._insertions += 1
+                entry = [None, None, obj_info, obj_info.get_obj()]
+                self._cache[obj_info] = entry
+            _link(root, entry)
             if len(self._cache) > self._size:
-                del self._cache[self._order.pop()]
+                self._evictions += 1
+                self._remove(root[0])
 
     def remove(self, obj_info):
         """Remove C{obj_info} from the cache, if present.
 
         @return: True if C{obj_info} was cached, False otherwise.
         """
-        if obj_info in self._cache:
-            self._order.remove(obj_info)
-            del self._cache[obj_info]
+        entry = self._cache.get(obj_info)
+        if entry is not None:
+            self._remove(entry)
             return True
         return False
 
+    def _remove(self, entry):
+        _unlink(entry)
+        del self._cache[entry[2]]
+        del entry[:]
+
     def set_size(self, size):
         """Set the maximum number of objects that may be held in this cache.
 
@@ -54,11 +100,14 @@ class Cache(object):
         the cache to respect the new size.
         """
         if size == 0:
+            self._evictions += len(self._cache)
             self.clear()
         else:
             # Remove all entries above the new size.
+            root = self._root
             while len(self._cache) > size:
-                del self._cache[self._order.pop()]
+                self._evictions += 1
+                self._remove(root[0])
         self._size = size
 
     def get_cached(self):
@@ -66,7 +115,27 @@ class Cache(object):
 
         The most recently added objects come first in the list.
         """
-        return list(self._order)
+        cached = []
+        root = self._root
+        entry = root[1]
+        while entry is not root:
+            cached.append(entry[2])
+            entry = entry[1]
+        return cached
+
+    def get_stats(self):
+        """Return a dict of statistics about the cache.
+
+        The number of objects in the cache is under "size".  Since the
+        cache was created, the number of objects added while already in
+        it are under "promotions", those added while not in it under
+        "insertions", and those dropped to respect the size of the cache
+        under "evictions".
+        """
+        return {"size": len(self._cache),
+                "promotions": self._promotions,
+                "insertions": self._insertions,
+                "evictions": self._evictions}
 
 
 class GenerationalCache(object):
@@ -97,6 +166,10 @@ class GenerationalCache(object):
         self._size = size
         self._new_cache = {}
         self._old_cache = {}
+        self._overlap = 0 # Number of objects in both generations.
+        self._promotions = 0
+        self._insertions = 0
+        self._evictions = 0
 
     def clear(self):
         """See `storm.store.Cache.clear`.
@@ -105,6 +178,7 @@ class GenerationalCache(object):
         """
         self._new_cache.clear()
         self._old_cache.clear()
+        self._overlap = 0
 
     def _bump_generation(self):
         """Start a new generation of the cache.
@@ -117,20 +191,32 @@ class GenerationalCache(object):
         would not be an appropriate way of treating older generations
         of actual people.
         """
+        self._evictions += len(self._old_cache) - self._overlap
         self._old_cache, self._new_cache = self._new_cache, self._old_cache
         self._new_cache.clear()
+        self._overlap = 0
 
     def add(self, obj_info):
         """See `storm.store.Cache.add`."""
-        if self._size != 0 and obj_info not in self._new_cache:
+        if self._size != 0:
+            if obj_info in self._new_cache:
+                self._promotions += 1
+                return
             if len(self._new_cache) >= self._size:
                 self._bump_generation()
+            if obj_info in self._old_cache:
+                self._promotions += 1
+                self._overlap += 1
+            else:
+                self._insertions += 1
             self._new_cache[obj_info] = obj_info.get_obj()
 
     def remove(self, obj_info):
         """See `storm.store.Cache.remove`."""
         in_new_cache = self._new_cache.pop(obj_info, None) is not None
         in_old_cache = self._old_cache.pop(obj_info, None) is not None
+        if in_new_cache and in_old_cache:
+            self._overlap -= 1
         return in_new_cache or in_old_cache
 
     def set_size(self, size):
@@ -139,12 +225,15 @@ class GenerationalCache(object):
         After calling this, the cache may still contain more than `size`
         objects, but no more than twice that number.
         """
+        old_size = self._get_size()
         self._size = size
         cache = itertools.islice(itertools.chain(self._new_cache.iteritems(),
                                                  self._old_cache.iteritems()),
                                  0, size)
         self._new_cache = dict(cache)
         self._old_cache.clear()
+        self._overlap = 0
+        self._evictions += old_size - len(self._new_cache)
 
     def get_cached(self):
         """See `storm.store.Cache.get_cached`.
@@ -160,3 +249,569 @@ class GenerationalCache(object):
         cached = self._new_cache.copy()
         cached.update(self._old_cache)
         return list(cached)
+
+    def _get_size(self):
+        return len(self._new_cache) + len(self._old_cache) - self._overlap
+
+    def get_stats(self):
+        """See `storm.store.Cache.get_stats`.
+
+        Objects are counted as evicted when their generation is evicted,
+        even if they're added again right after.
+        """
+        return {"size": self._get_size(),
+                "promotions": self._promotions,
+                "insertions": self._insertions,
+                "evictions": self._evictions}
+
+
+class TwoQueueCache(object):
+    """Scan resistant replacement for Storm's LRU cache.
+
+    This cache implements the 2Q algorithm.  Objects added for the first
+    time enter a probationary queue, in which they're kept in the order
+    they were added.  Objects added again while still in the probationary
+    queue, or soon after leaving it, are promoted to the main queue, in
+    which they're kept in least recently used order.
+
+    When the cache is full, objects are evicted from the probationary
+    queue while it holds more than its share of the cache, and from the
+    main queue otherwise.  The rows of objects evicted from the
+    probationary queue are remembered for a while, without holding the
+    objects, so that loading them again promotes them.
+
+    Use this when large result sets are iterated over, as each object
+    they load would otherwise evict an object used more frequently.
+    """
+
+    def __init__(self, size=1000, probation_ratio=0.25, ghost_ratio=0.5):
+        """Create a 2Q cache with the given size limit.
+
+        @param size: The maximum number of objects held by the cache.
+        @param probation_ratio: The share of the cache which objects
+            added only once may keep when it's full.
+        @param ghost_ratio: The number of rows remembered after leaving
+            the probationary queue, relative to the size of the cache.
+        """
+        self._probation_ratio = probation_ratio
+        self._ghost_ratio = ghost_ratio
+        # Entries are [previous, next, obj_info, obj, root] lists, linked
+        # in the queue starting at root, with the newest one after it.
+        self._probation = probation = []
+        probation[:] = [probation, probation, None, None, None]
+        self._main = main = []
+        main[:] = [main, main, None, None, None]
+        self._ghost = ghost = []
+        ghost[:] = [ghost, ghost, None, None, None]
+        self._cache = {} # {obj_info: entry, ...}
+        self._ghosts = {} # {row key: entry, ...}
+        self._probation_count = 0
+        self._promotions = 0
+        self._insertions = 0
+        self._ghost_hits = 0
+        self._evictions = 0
+        self._set_limits(size)
+
+    def _set_limits(self, size):
+        self._size = size
+        self._probation_size = max(1, int(size * self._probation_ratio))
+        self._ghost_size = max(1, int(size * self._ghost_ratio))
+
+    def clear(self):
+        """See `storm.store.Cache.clear`.
+
+        Forgets the rows of objects evicted from the probationary queue
+        as well.
+        """
+        for root in (self._probation, self._main, self._ghost):
+            entry = root[1]
+            while entry is not root:
+                next_entry = entry[1]
+                del entry[:]
+                entry = next_entry
+            root[:] = [root, root, None, None, None]
+        self._cache.clear()
+        self._ghosts.clear()
+        self._probation_count = 0
+
+    def add(self, obj_info):
+        """See `storm.store.Cache.add`.
+
+        Objects already in the cache, or evicted from its probationary
+        queue recently, become the most recent entry of the main queue.
+        """
+        if self._size != 0:
+            main = self._main
+            entry = self._cache.get(obj_info)
+            if entry is not None:
+                self._promotions += 1
+                if entry[4] is not main:
+                    self._probation_count -= 1
+                _unlink(entry)
+            else:
+                self._insertions += 1
+                entry = [None, None, obj_info, obj_info.get_obj(), None]
+                self._cache[obj_info] = entry
+                ghost = self._ghosts.pop(_get_row_key(obj_info), None)
+                if ghost is not None:
+                    self._ghost_hits += 1
+                    _unlink(ghost)
+                else:
+                    self._probation_count += 1
+                    entry[4] = self._probation
+                    _link(self._probation, entry)
+                    self._evict(self._size)
+                    return
+            entry[4] = main
+            _link(main, entry)
+            self._evict(self._size)
+
+    def _evict(self, size):
+        """Evict objects until at most C{size} are cached."""
+        cache = self._cache
+        main = self._main
+        while len(cache) > size:
+            self._evictions += 1
+            if (self._probation_count > self._probation_size or
+                main[0] is main):
+                entry = self._probation[0]
+                self._remove(entry)
+                self._add_ghost(_get_row_key(entry[2]))
+            else:
+                self._remove(main[0])
+
+    def _add_ghost(self, key):
+        ghosts = self._ghosts
+        ghost = ghosts.pop(key, None)
+        if ghost is not None:
+            _unlink(ghost)
+        ghost = [None, None, key, None, self._ghost]
+        ghosts[key] = ghost
+        _link(self._ghost, ghost)
+        while len(ghosts) > self._ghost_size:
+            ghost = self._ghost[0]
+            _unlink(ghost)
+            del ghosts[ghost[2]]
+
+    def _remove(self, entry):
+        if entry[4] is not self._main:
+            self._probation_count -= 1
+        _unlink(entry)
+        del self._cache[entry[2]]
+
+    def remove(self, obj_info):
+        """See `storm.store.Cache.remove`."""
+        entry = self._cache.get(obj_info)
+        if entry is not None:
+            self._remove(entry)
+            return True
+        return False
+
+    def set_size(self, size):
+        """See `storm.store.Cache.set_size`."""
+        if size == 0:
+            self._evictions += len(self._cache)
+            self.clear()
+        self._set_limits(size)
+        self._evict(size)
+        while len(self._ghosts) > self._ghost_size:
+            ghost = self._ghost[0]
+            _unlink(ghost)
+            del self._ghosts[ghost[2]]
+
+    def get_cached(self):
+        """See `storm.store.Cache.get_cached`.
+
+        The objects of the main queue come first, followed by those of
+        the probationary queue.  The most recent objects of each queue
+        come first.
+        """
+        cached = []
+        for root in (self._main, self._probation):
+            entry = root[1]
+            while entry is not root:
+                cached.append(entry[2])
+                entry = entry[1]
+        return cached
+
+    def get_stats(self):
+        """See `storm.store.Cache.get_stats`.
+
+        The number of objects in the probationary queue is also under
+        "probation_size", and the number of insertions of objects
+        promoted because they were evicted from it recently under
+        "ghost_hits".
+        """
+        return {"size": len(self._cache),
+                "probation_size": self._probation_count,
+                "promotions": self._promotions,
+                "insertions": self._insertions,
+                "ghost_hits": self._ghost_hits,
+                "evictions": self._evictions}
+
+
+def _get_row_key(obj_info):
+    """Return a key identifying the row of an object across its lifetimes.
+
+    Objects of a store are identified by their class and the values of
+    their primary key, which are kept in the object info when it's
+    alive in a store.  Others are identified by their object info.
+    """
+    primary_vars = obj_info.get("primary_vars")
+    if primary_vars is None:
+        return obj_info
+    return (obj_info.cls_info.cls,
+            tuple(var.get(to_db=True) for var in primary_vars))
+
+
+def _estimate_sequence_size(value, estimate_size):
+    return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+
+
+def _estimate_dict_size(value, estimate_size):
+    return sys.getsizeof(value) + sum(estimate_size(key) +
+                                      estimate_size(item)
+                                      for key, item in value.iteritems())
+
+
+DEFAULT_SIZE_ESTIMATORS = {
+    list: _estimate_sequence_size,
+    tuple: _estimate_sequence_size,
+    set: _estimate_sequence_size,
+    frozenset: _estimate_sequence_size,
+    dict: _estimate_dict_size,
+    }
+
+
+class MemoryCache(object):
+    """Cache holding recently used objects within a memory budget.
+
+    This works like L{Cache}, but instead of holding a fixed number of
+    objects, it holds as many as fit in the given number of bytes.  The
+    size of an object is estimated from the values of its variables when
+    it's added, and kept until the object changes, so objects changed
+    later are only measured again when they're used again.
+
+    Values are measured with C{sys.getsizeof}, except for those of types
+    with an estimator, which is called with the value and a function
+    estimating the size of other values, and returns the estimated size
+    of the value in bytes.  Estimators for lists, tuples, sets and dicts,
+    which also measure their items, are used by default.
+    """
+
+    def __init__(self, max_bytes=64*1024*1024, estimators=None):
+        """Create a cache holding objects of up to C{max_bytes} in total.
+
+        @param max_bytes: The maximum estimated size of the objects in
+            the cache, in bytes.
+        @param estimators: A dict of estimators by type, used in addition
+            to L{DEFAULT_SIZE_ESTIMATORS}.
+        """
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._estimators = DEFAULT_SIZE_ESTIMATORS.copy()
+        if estimators is not None:
+            self._estimators.update(estimators)
+        # Entries are [previous, next, obj_info, obj, size, changed]
+        # lists, linked in order of use, with the most recently used one
+        # after the root.  The size is estimated again when the object
+        # changed since it was last estimated.
+        self._root = root = []
+        root[:] = [root, root, None, None, 0, False]
+        self._cache = {} # {obj_info: entry, ...}
+        self._promotions = 0
+        self._insertions = 0
+        self._evictions = 0
+
+    def estimate_size(self, obj_info):
+        """Return the estimated size of an object, in bytes."""
+        estimators = self._estimators
+        seen = set()
+        def estimate_value_size(value):
+            estimator = estimators.get(type(value))
+            if estimator is None:
+                return sys.getsizeof(value)
+            # Containers shared by values, or by themselves, are only
+            # measured once.
+            if id(value) in seen:
+                return 0
+            seen.add(id(value))
+            return estimator(value, estimate_value_size)
+        size = sys.getsizeof(obj_info.get_obj()) + sys.getsizeof(obj_info)
+        for variable in obj_info.variables.itervalues():
+            size += (sys.getsizeof(variable) +
+                     estimate_value_size(variable._value))
+        return size
+
+    def clear(self):
+        """See `storm.store.Cache.clear`."""
+        root = self._root
+        entry = root[1]
+        while entry is not root:
+            next_entry = entry[1]
+            del entry[:]
+            entry = next_entry
+        root[:] = [root, root, None, None, 0, False]
+        self._cache.clear()
+        self._bytes = 0
+
+    def add(self, obj_info):
+        """See `storm.store.Cache.add`.
+
+        The size of the object is estimated if it's new to the cache or
+        changed since it was last estimated, and the least recently used
+        objects are evicted until the cache fits in its budget.  An
+        object larger than the whole budget isn't kept.
+        """
+        if self._max_bytes != 0:
+            entry = self._cache.get(obj_info)
+            if entry is not None:
+                self._promotions += 1
+                _unlink(entry)
+            else:
+                self._insertions += 1
+                entry = [None, None, obj_info, obj_info.get_obj(), 0, True]
+                self._cache[obj_info] = entry
+            if entry[5]:
+                size = self.estimate_size(obj_info)
+                self._bytes += size - entry[4]
+                entry[4] = size
+                entry[5] = False
+                obj_info.event.hook("changed", self._object_changed)
+            _link(self._root, entry)
+            self._evict(self._max_bytes)
+
+    def _object_changed(self, obj_info, variable, old_value, new_value,
+                        fromdb):
+        entry = self._cache.get(obj_info)
+        if entry is not None:
+            entry[5] = True
+        # Hooked again when the size is estimated.
+        return False
+
+    def _evict(self, max_bytes):
+        root = self._root
+        while self._bytes > max_bytes:
+            self._evictions += 1
+            self._remove(root[0])
+
+    def _remove(self, entry):
+        _unlink(entry)
+        del self._cache[entry[2]]
+        self._bytes -= entry[4]
+
+    def remove(self, obj_info):
+        """See `storm.store.Cache.remove`."""
+        entry = self._cache.get(obj_info)
+        if entry is not None:
+            self._remove(entry)
+            return True
+        return False
+
+    def set_size(self, max_bytes):
+        """Set the maximum estimated size of the objects, in bytes.
+
+        If the size is reduced, older objects may be evicted from the
+        cache to respect the new size.
+        """
+        if max_bytes == 0:
+            self._evictions += len(self._cache)
+            self.clear()
+        else:
+            self._evict(max_bytes)
+        self._max_bytes = max_bytes
+
+    def get_size(self):
+        """Return the estimated size of the cached objects, in bytes."""
+        return self._bytes
+
+    def get_cached(self):
+        """See `storm.store.Cache.get_cached`."""
+        cached = []
+        root = self._root
+        entry = root[1]
+        while entry is not root:
+            cached.append(entry[2])
+            entry = entry[1]
+        return cached
+
+    def get_stats(self):
+        """See `storm.store.Cache.get_stats`.
+
+        The estimated size of the cached objects is also under "bytes".
+        """
+        return {"size": len(self._cache),
+                "bytes": self._bytes,
+                "promotions": self._promotions,
+                "insertions": self._insertions,
+                "evictions": self._evictions}
+
+
+class RowCache(object):
+    """Cache of database rows shared by the stores of a process.
+
+    Rows are kept as immutable snapshots of the values in the database
+    of the eager columns of objects, keyed by table and primary key.
+    Stores given a row cache look rows up in it in
+    L{Store.get()<storm.store.Store.get>} before querying the database,
+    and add the rows they load to it.  Rows of a table are dropped when
+    a store flushes changes to it, through any class mapped to it, and
+    again when it commits them.
+
+    Tables are identified by the C{table_key} of the
+    L{ClassInfo<storm.info.ClassInfo>} of their classes.  Since the
+    columns of a row depend on the class which loaded it, a row is only
+    returned for that class.
+
+    Least recently used rows are evicted once the estimated size of all
+    the rows exceeds the given number of bytes.
+
+    A store may have read a row in a transaction which started before
+    the row was changed and removed from the cache by another store.
+    Stores pass the L{version<get_version>} of the cache at the start of
+    their transactions along with rows, and rows of tables removed from
+    since then are dropped rather than added.
+
+    Rows changed with L{Store.execute()<storm.store.Store.execute>}, or
+    by other processes, aren't noticed.
+    """
+
+    def __init__(self, max_bytes=16*1024*1024):
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Entries are [previous, next, key, row, size, cls] lists, linked
+        # in order of use, with the most recently used one after the root.
+        self._root = root = []
+        root[:] = [root, root, None, None, 0, None]
+        self._entries = {} # (table_key, primary_values): entry
+        self._keys = {} # table_key: {(table_key, primary_values): True}
+        # Versions are bumped whenever rows are removed.
+        self._version = 0
+        self._versions = {} # table_key: version of the last removal
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, cls, primary_values):
+        """Return the row of the given object, or None if not cached."""
+        key = (get_cls_info(cls).table_key, primary_values)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None or entry[5] is not cls:
+                self._misses += 1
+                return None
+            self._hits += 1
+            _unlink(entry)
+            _link(self._root, entry)
+            return entry[3]
+        finally:
+            self._lock.release()
+
+    def get_version(self):
+        """Return the current version of the cache, for L{add}."""
+        return self._version
+
+    def add(self, cls, primary_values, row, version=None):
+        """Add the row of the given object, as a tuple of database values.
+
+        @param version: The version of the cache when the transaction
+            which read the row started.  If rows of its table were
+            removed since then, the row may be out of date and isn't
+            added.
+        """
+        table = get_cls_info(cls).table_key
+        key = (table, primary_values)
+        size = sys.getsizeof(row) + sum(sys.getsizeof(value)
+                                        for value in row)
+        self._lock.acquire()
+        try:
+            if (version is not None and
+                self._versions.get(table, 0) > version):
+                return
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                _unlink(entry)
+                self._bytes -= entry[4]
+            entry = [None, None, key, row, size, cls]
+            self._entries[key] = entry
+            self._keys.setdefault(table, {})[key] = True
+            _link(self._root, entry)
+            self._bytes += size
+            root = self._root
+            while self._bytes > self._max_bytes:
+                self._evictions += 1
+                self._remove(root[0])
+        finally:
+            self._lock.release()
+
+    def remove(self, table, primary_values):
+        """Remove a row of the given table key, if cached."""
+        self._lock.acquire()
+        try:
+            self._version += 1
+            self._versions[table] = self._version
+            entry = self._entries.get((table, primary_values))
+            if entry is not None:
+                self._remove(entry)
+        finally:
+            self._lock.release()
+
+    def remove_table(self, table):
+        """Remove all the rows of the given table key."""
+        self._lock.acquire()
+        try:
+            self._version += 1
+            self._versions[table] = self._version
+            for key in self._keys.pop(table, ()):
+                entry = self._entries.pop(key)
+                _unlink(entry)
+                self._bytes -= entry[4]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Remove all the rows."""
+        self._lock.acquire()
+        try:
+            root = self._root
+            root[:] = [root, root, None, None, 0, None]
+            self._entries.clear()
+            self._keys.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    def get_size(self):
+        """Return the estimated size of the cached rows, in bytes."""
+        return self._bytes
+
+    def get_stats(self):
+        """Return a dict of statistics about the cache.
+
+        The number of rows in the cache is under "size", and their
+        estimated size in bytes under "bytes".  Since the cache was
+        created, the number of lookups which found a row are under
+        "hits", those which didn't under "misses", and the number of
+        rows dropped to respect the size of the cache under "evictions".
+        """
+        self._lock.acquire()
+        try:
+            return {"size": len(self._entries),
+                    "bytes": self._bytes,
+                    "hits": self._hits,
+                    "misses": self._misses,
+                    "evictions": self._evictions}
+        finally:
+            self._lock.release()
+
+    def _remove(self, entry):
+        table, primary_values = key = entry[2]
+        del self._entries[key]
+        keys = self._keys[table]
+        del keys[key]
+        if not keys:
+            del self._keys[table]
+        _unlink(entry)
+        self._bytes -= entry[4]
@@ -244,6 +244,35 @@ class Connection(object):
             return None
         return self.result_factory(self, raw_cursor)
 
+    def execute_many(self, statement, params_list):
+        """Execute a statement once for each of the given parameter sets.
+
+        The statement is handed to the database with the DB-API
+        C{executemany()} method, so it's only parsed once.  Unlike
+        L{execute}, no result is returned.
+
+        @type statement: C{str}
+        @param statement: The statement to execute, using C{?} as the
+            parameter mark.
+        @param params_list: A sequence with one sequence of parameters
+            for each execution of the statement.
+
+        @raise ConnectionBlockedError: Raised if access to the connection
+            has been blocked with L{block_access}.
+        @raise DisconnectionError: Raised when the connection is lost.
+            Reconnection happens automatically on rollback.
+        """
+        if self._closed:
+            raise ClosedError("Connection is closed")
+        if self._blocked:
+            raise ConnectionBlockedError("Access to connection is blocked")
+        if self._event:
+            self._event.emit("register-transaction")
+        self._ensure_connected()
+        statement = convert_param_marks(statement, "?", self.param_mark)
+        raw_cursor = self.raw_execute_many(statement, params_list)
+        self._check_disconnect(raw_cursor.close)
+
     def close(self):
         """Close the connection if it is not already closed."""
         if not self._closed:
@@ -383,6 +412,34 @@ class Connection(object):
                 statement, params or ())
         return raw_cursor
 
+    def raw_execute_many(self, statement, params_list):
+        """Execute a raw statement once for each of the given parameter sets.
+
+        It's acceptable to override this method in subclasses, but it
+        is not intended to be called externally.
+
+        @return: The dbapi cursor object, as fetched from L{build_raw_cursor}.
+        """
+        raw_cursor = self._check_disconnect(self.build_raw_cursor)
+        self._check_disconnect(
+            trace, "connection_raw_execute_many", self, raw_cursor,
+            statement, params_list)
+        raw_params_list = [tuple(self.to_database(params))
+                           for params in params_list]
+        try:
+            self._check_disconnect(raw_cursor.executemany,
+                                   statement, raw_params_list)
+        except Exception, error:
+            self._check_disconnect(
+                trace, "connection_raw_execute_many_error", self, raw_cursor,
+                statement, params_list, error)
+            raise
+        else:
+            self._check_disconnect(
+                trace, "connection_raw_execute_many_success", self,
+                raw_cursor, statement, params_list)
+        return raw_cursor
+
     def _ensure_connected(self):
         """Ensure that we are connected to the database.
 
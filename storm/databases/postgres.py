@@ -275,6 +275,16 @@ class PostgresConnection(Connection):
             statement = statement.encode("UTF-8")
         return Connection.raw_execute(self, statement, params)
 
+    def raw_execute_many(self, statement, params_list):
+        """
+        Like L{Connection.raw_execute_many}, but encode the statement to
+        UTF-8 if it is unicode.
+        """
+        if type(statement) is unicode:
+            # psycopg breaks with unicode statements.
+            statement = statement.encode("UTF-8")
+        return Connection.raw_execute_many(self, statement, params_list)
+
     def to_database(self, params):
         """
         Like L{Connection.to_database}, but this converts datetime
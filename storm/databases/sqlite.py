@@ -138,6 +138,15 @@ class SQLiteConnection(Connection):
         versions < 2.3.4, so we make sure the timeout is respected
         here.
         """
+        return self._raw_execute(Connection.raw_execute, statement, params,
+                                 _end)
+
+    def raw_execute_many(self, statement, params_list):
+        """Like L{raw_execute}, but executes the statement several times."""
+        return self._raw_execute(Connection.raw_execute_many, statement,
+                                 params_list)
+
+    def _raw_execute(self, raw_execute, statement, params, _end=False):
         if _end:
             self._in_transaction = False
         elif not self._in_transaction:
@@ -151,7 +160,7 @@ class SQLiteConnection(Connection):
         started = now()
         while True:
             try:
-                return Connection.raw_execute(self, statement, params)
+                return raw_execute(self, statement, params)
             except sqlite.OperationalError, e:
                 if str(e) != "database is locked":
                     raise
@@ -70,7 +70,16 @@ class NotFlushedError(StoreError):
     pass
 
 class OrderLoopError(StoreError):
-    pass
+    """Raised when objects can't be flushed due to an ordering loop.
+
+    @ivar objects: The objects involved in the loop, each of which must
+        be flushed before the next one, and the last one before the
+        first one.
+    """
+
+    def __init__(self, message, objects=()):
+        StoreError.__init__(self, message)
+        self.objects = list(objects)
 
 class NotOneError(StoreError):
     pass
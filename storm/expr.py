@@ -205,19 +205,39 @@ if has_cextensions:
 
 class CompilePython(Compile):
 
+    # Maximum number of matcher closures kept by get_matcher().
+    closure_cache_size = 1000
+
+    def __init__(self, parent=None):
+        Compile.__init__(self, parent)
+        self._closures = {} # source: closure
+
     def get_matcher(self, expr):
+        """Return a function telling whether an object matches expr.
+
+        Values in the expression are bound as parameters, so expressions
+        of the same shape share the code built for their source, which
+        is only executed the first time it's seen.
+        """
         state = State()
         source = self(expr, state)
-        namespace = {}
-        code = ("def closure(parameters, bool):\n"
-                "    [%s] = parameters\n"
-                "    def match(get_column):\n"
-                "        return bool(%s)\n"
-                "    return match" %
-                (",".join("_%d" % i for i in range(len(state.parameters))),
-                 source))
-        exec code in namespace
-        return namespace['closure'](state.parameters, bool)
+        closure = self._closures.get(source)
+        if closure is None:
+            namespace = {}
+            code = ("def closure(parameters, bool):\n"
+                    "    [%s] = parameters\n"
+                    "    def match(get_column):\n"
+                    "        return bool(%s)\n"
+                    "    return match" %
+                    (",".join("_%d" % i
+                              for i in range(len(state.parameters))),
+                     source))
+            exec code in namespace
+            closure = namespace['closure']
+            if len(self._closures) >= self.closure_cache_size:
+                self._closures.clear()
+            self._closures[source] = closure
+        return closure(state.parameters, bool)
 
 
 class State(object):
@@ -1505,6 +1525,22 @@ def compare_columns(columns, values):
         return And(*equals)
 
 
+def compare_columns_in(columns, values_list):
+    """Build an expression matching rows with any of the given values.
+
+    @param columns: The columns to be compared, usually a primary key.
+    @param values_list: A non-empty sequence with one tuple of values
+        or variables for each row to be matched.
+
+    A single column is compared with C{IN}, while composed keys become
+    a disjunction of L{compare_columns} expressions, so that backends
+    without support for row values work as well.
+    """
+    if len(columns) == 1:
+        return columns[0].is_in([values[0] for values in values_list])
+    return Or(*[compare_columns(columns, values) for values in values_list])
+
+
 # --------------------------------------------------------------------
 # Auto table
 
@@ -45,6 +45,19 @@ def set_obj_info(obj, obj_info):
     obj.__dict__["__storm_object_info__"] = obj_info
 
 
+def resolve_stale(obj_info):
+    """Let the store of a lazily invalidated object invalidate it now.
+
+    Stores tag the objects they hold with a generation, and invalidate
+    all of them at once by starting a new one.  Objects tagged with an
+    older generation are then invalidated when they're next touched,
+    through the "resolve-stale" event emitted here.
+    """
+    generation = obj_info.get("generation")
+    if generation is not None and generation.stale:
+        obj_info.event.emit("resolve-stale")
+
+
 def get_cls_info(cls):
     if "__storm_class_info__" in cls.__dict__:
         # Can't use attribute access here, otherwise subclassing won't work.
@@ -60,10 +73,33 @@ class ClassInfo(dict):
     The following attributes are defined:
 
     @ivar table: Expression from where columns will be looked up.
+    @ivar table_key: Hashable value identifying the table, the same for
+        all the classes mapped to it: the name of the table, or the table
+        expression itself when it isn't a plain table.
     @ivar cls: Class which should be used to build objects.
     @ivar columns: Tuple of column properties found in the class.
     @ivar primary_key: Tuple of column properties used to form the primary key
     @ivar primary_key_pos: Position of primary_key items in the columns tuple.
+    @ivar lazy_groups: Dictionary mapping the id of each column with a lazy
+        group to that group.  Such columns aren't loaded along with the
+        object, but only when one of the columns in the group is touched.
+    @ivar lazy_columns: Tuple of columns with a lazy group.
+    @ivar eager_columns: Tuple of columns loaded along with the object.
+    @ivar eager_primary_key_pos: Position of primary_key items in the
+        eager_columns tuple.
+    @ivar unique_columns: Tuple of columns with unique values, which
+        the store may use to look objects up.
+    @ivar indexed_columns: Tuple of columns by which stores index their
+        alive objects.
+    @ivar cache_all: Value of C{__storm_cache_all__} in the class, or None.
+        When set, stores load the whole table at once, and answer the
+        queries they can for the class in memory.  True keeps the table
+        for a transaction, and a number of seconds keeps it for that
+        long, across transactions.
+    @ivar cache_quota: Value of C{__storm_cache_quota__} in the class, or
+        None.  When set, stores keep the given number of recently used
+        objects of the class in a cache of their own, instead of their
+        main cache.
     """
 
     def __init__(self, cls):
@@ -75,6 +111,10 @@ class ClassInfo(dict):
 
         if isinstance(self.table, basestring):
             self.table = Table(self.table)
+        if isinstance(self.table, Table):
+            self.table_key = self.table.name
+        else:
+            self.table_key = self.table
 
         pairs = []
         for attr in dir(cls):
@@ -123,6 +163,31 @@ class ClassInfo(dict):
         self.primary_key_pos = tuple(id_positions[id(column)]
                                      for column in self.primary_key)
 
+        self.lazy_groups = {}
+        for column in self.columns:
+            lazy_group = getattr(column, "lazy_group", None)
+            if lazy_group is not None:
+                if id(column) in self.primary_key_idx:
+                    raise ClassInfoError("%s has a lazy primary key column: "
+                                         "%s" % (repr(cls), column.name))
+                self.lazy_groups[id(column)] = lazy_group
+        self.lazy_columns = tuple(column for column in self.columns
+                                  if id(column) in self.lazy_groups)
+        self.eager_columns = tuple(column for column in self.columns
+                                   if id(column) not in self.lazy_groups)
+        id_positions = dict((id(column), i)
+                            for i, column in enumerate(self.eager_columns))
+        self.eager_primary_key_pos = tuple(id_positions[id(column)]
+                                           for column in self.primary_key)
+
+        self.unique_columns = tuple(column for column in self.columns
+                                    if getattr(column, "unique", False))
+        self.indexed_columns = tuple(column for column in self.columns
+                                     if getattr(column, "indexed", False))
+
+        self.cache_all = getattr(cls, "__storm_cache_all__", None) or None
+        self.cache_quota = getattr(cls, "__storm_cache_quota__", None)
+
         __order__ = getattr(cls, "__storm_order__", None)
         if __order__ is None:
             self.default_order = Undef
@@ -0,0 +1,268 @@
+#
+# Copyright (c) 2011 Canonical
+#
+# This file is part of Storm Object Relational Mapper.
+#
+# Storm is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 2.1 of
+# the License, or (at your option) any later version.
+#
+# Storm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Sharing the changes committed by stores with their peers.
+
+Stores describe the rows changed by each transaction they commit with a
+L{ChangeSet}.  When given an L{InvalidationBus}, they publish their change
+sets on it, and drop what they hold of the rows changed by their peers,
+which may live in other threads or processes.
+"""
+
+from time import time as now
+from uuid import uuid4
+from weakref import ref
+import threading
+
+from storm.compat import json
+
+
+__all__ = ["ChangeSet", "InvalidationBus", "LocalInvalidationBus",
+           "SQLiteInvalidationBus"]
+
+
+class ChangeSet(object):
+    """The rows changed by a committed transaction.
+
+    Rows are identified by their table and the database values of their
+    primary key, as in C{("person", (42,))}, so that the changes apply
+    to every class mapped to the table.  Tables are given by the
+    C{table_key} of the L{ClassInfo<storm.info.ClassInfo>} of their
+    classes, which is their name unless they're given as expressions.
+
+    @ivar inserted: Set of rows inserted.
+    @ivar updated: Set of rows updated.
+    @ivar deleted: Set of rows deleted.
+    @ivar tables: Set of tables with changes to unknown rows, such as
+        those made by L{ResultSet.set()<storm.store.ResultSet.set>}.
+    @ivar store: The store which committed the changes, when it's in
+        this process.
+    @ivar lost: Whether change sets of peers were lost, such as when a
+        bus can't reach them, so that any row may have changed.
+    """
+
+    def __init__(self, inserted=(), updated=(), deleted=(), tables=(),
+                 store=None, lost=False):
+        self.inserted = set(inserted)
+        self.updated = set(updated)
+        self.deleted = set(deleted)
+        self.tables = set(tables)
+        self.store = store
+        self.lost = lost
+
+    def __iter__(self):
+        """Iterate over all the rows changed."""
+        for rows in (self.inserted, self.updated, self.deleted):
+            for row in rows:
+                yield row
+
+    def __nonzero__(self):
+        return bool(self.inserted or self.updated or self.deleted or
+                    self.tables or self.lost)
+
+
+class InvalidationBus(object):
+    """Transport of change sets between stores.
+
+    Subscribed callbacks are called with the change sets published by
+    peers.  Subclasses implement L{publish}, and L{poll} if change sets
+    aren't delivered as soon as they're published.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """Call C{callback} with each change set published by peers.
+
+        Bound methods are only referenced weakly, so that subscribing
+        doesn't keep their object alive.
+        """
+        self._lock.acquire()
+        try:
+            self._subscribers.append(_get_callback_ref(callback))
+        finally:
+            self._lock.release()
+
+    def unsubscribe(self, callback):
+        """Stop calling C{callback} with change sets."""
+        self._lock.acquire()
+        try:
+            self._subscribers = [subscriber
+                                 for subscriber in self._subscribers
+                                 if subscriber() != callback]
+        finally:
+            self._lock.release()
+
+    def publish(self, change_set):
+        """Send C{change_set} to the peers."""
+        raise NotImplementedError
+
+    def poll(self):
+        """Deliver the change sets published by peers since the last poll.
+        """
+
+    def _deliver(self, change_set):
+        self._lock.acquire()
+        try:
+            subscribers = self._subscribers = [
+                subscriber for subscriber in self._subscribers
+                if subscriber() is not None]
+        finally:
+            self._lock.release()
+        for subscriber in subscribers:
+            callback = subscriber()
+            if callback is not None:
+                callback(change_set)
+
+
+def _get_callback_ref(callback):
+    """Return a function returning C{callback}, or None once it's dead."""
+    obj = getattr(callback, "im_self", None)
+    if obj is None:
+        return lambda: callback
+    obj_ref = ref(obj)
+    func = callback.im_func
+    def get_callback():
+        obj = obj_ref()
+        if obj is None:
+            return None
+        return func.__get__(obj, type(obj))
+    return get_callback
+
+
+class LocalInvalidationBus(InvalidationBus):
+    """Bus delivering change sets to subscribers in this process.
+
+    Change sets are delivered as soon as they're published, in the
+    thread publishing them.
+    """
+
+    def publish(self, change_set):
+        self._deliver(change_set)
+
+
+class SQLiteInvalidationBus(InvalidationBus):
+    """Bus sharing change sets between processes through a SQLite file.
+
+    Published change sets are written to a table in the given file, and
+    those written by other buses are delivered by L{poll}, which stores
+    call at the end of their transactions.  Change sets are kept in the
+    file for the given number of seconds, which should be longer than
+    the time between polls.  If change sets were deleted before being
+    polled, a change set with C{lost} set is delivered instead.
+
+    Rows with primary keys which can't be written as JSON are written as
+    changes to unknown rows of their table.  Changes to tables given as
+    expressions rather than by name can't be written, and aren't shared.
+    """
+
+    def __init__(self, filename, keep=60, timeout=5):
+        InvalidationBus.__init__(self)
+        self._filename = filename
+        self._keep = keep
+        self._timeout = timeout
+        self._source = uuid4().hex
+        connection = self._connect()
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS storm_change_set "
+                               "(id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "source TEXT, time REAL, data TEXT)")
+            connection.commit()
+            self._last_id = self._get_last_id(connection)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        from storm.databases.sqlite import sqlite
+        return sqlite.connect(self._filename, timeout=self._timeout)
+
+    def _get_last_id(self, connection):
+        """Return the id of the last change set written, even if deleted.
+        """
+        row = connection.execute(
+            "SELECT seq FROM sqlite_sequence "
+            "WHERE name = 'storm_change_set'").fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def publish(self, change_set):
+        data = json.dumps(_dump_change_set(change_set))
+        connection = self._connect()
+        try:
+            connection.execute("INSERT INTO storm_change_set "
+                               "(source, time, data) VALUES (?, ?, ?)",
+                               (self._source, now(), data))
+            connection.execute("DELETE FROM storm_change_set WHERE time < ?",
+                               (now() - self._keep,))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def poll(self):
+        connection = self._connect()
+        try:
+            last_id = self._get_last_id(connection)
+            rows = connection.execute(
+                "SELECT id, source, data FROM storm_change_set "
+                "WHERE id > ? AND id <= ? ORDER BY id",
+                (self._last_id, last_id)).fetchall()
+        finally:
+            connection.close()
+        if len(rows) < last_id - self._last_id:
+            # Some were deleted before being polled.
+            self._last_id = last_id
+            self._deliver(ChangeSet(lost=True))
+            return
+        for id, source, data in rows:
+            self._last_id = id
+            if source != self._source:
+                self._deliver(_load_change_set(json.loads(data)))
+
+
+def _dump_change_set(change_set):
+    """Return a change set as a dictionary which may be written as JSON."""
+    data = {}
+    tables = set(table for table in change_set.tables
+                 if isinstance(table, basestring))
+    for kind in ("inserted", "updated", "deleted"):
+        rows = data[kind] = []
+        for table, primary_values in getattr(change_set, kind):
+            if not isinstance(table, basestring):
+                continue
+            try:
+                json.dumps(primary_values)
+            except (TypeError, ValueError):
+                tables.add(table)
+            else:
+                rows.append((table, primary_values))
+    data["tables"] = list(tables)
+    return data
+
+
+def _load_change_set(data):
+    """Return the change set written with L{_dump_change_set}."""
+    rows = {}
+    for kind in ("inserted", "updated", "deleted"):
+        rows[kind] = [(table, tuple(primary_values))
+                      for table, primary_values in data[kind]]
+    return ChangeSet(rows["inserted"], rows["updated"], rows["deleted"],
+                     data["tables"])
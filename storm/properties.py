@@ -23,7 +23,7 @@ import weakref
 import sys
 
 from storm.exceptions import PropertyPathError
-from storm.info import get_obj_info, get_cls_info
+from storm.info import get_obj_info, get_cls_info, resolve_stale
 from storm.expr import Column, Undef
 from storm.variables import (
     Variable, VariableFactory, BoolVariable, IntVariable, FloatVariable,
@@ -36,22 +36,43 @@ from storm.variables import (
 __all__ = ["Property", "SimpleProperty",
            "Bool", "Int", "Float", "Decimal", "RawStr", "Unicode",
            "DateTime", "Date", "Time", "TimeDelta", "UUID", "Enum",
-           "Pickle", "JSON", "List", "PropertyRegistry"]
+           "Pickle", "JSON", "List", "PropertyRegistry", "LazyGroup"]
+
+
+class LazyGroup(object):
+    """A group of lazy properties.
+
+    Properties in the same group aren't loaded along with their object,
+    but all of them are loaded at once when one of them is touched::
+
+        class C(object):
+            ...
+            lazy_group = LazyGroup()
+            attr1 = Unicode(lazy_group=lazy_group)
+            attr2 = Unicode(lazy_group=lazy_group)
+
+    Any other hashable value, such as an integer, may be used as well.
+    """
 
 
 class Property(object):
 
     def __init__(self, name=None, primary=False,
-                 variable_class=Variable, variable_kwargs={}):
+                 variable_class=Variable, variable_kwargs={},
+                 lazy_group=None, unique=False, indexed=False):
         self._name = name
         self._primary = primary
         self._variable_class = variable_class
         self._variable_kwargs = variable_kwargs
+        self._lazy_group = lazy_group
+        self._unique = unique
+        self._indexed = indexed
 
     def __get__(self, obj, cls=None):
         if obj is None:
             return self._get_column(cls)
         obj_info = get_obj_info(obj)
+        resolve_stale(obj_info)
         if cls is None:
             # Don't get obj.__class__ because we don't trust it
             # (might be proxied or whatever).
@@ -61,6 +82,7 @@ class Property(object):
 
     def __set__(self, obj, value):
         obj_info = get_obj_info(obj)
+        resolve_stale(obj_info)
         # Don't get obj.__class__ because we don't trust it
         # (might be proxied or whatever).
         column = self._get_column(obj_info.cls_info.cls)
@@ -68,6 +90,7 @@ class Property(object):
 
     def __delete__(self, obj):
         obj_info = get_obj_info(obj)
+        resolve_stale(obj_info)
         # Don't get obj.__class__ because we don't trust it
         # (might be proxied or whatever).
         column = self._get_column(obj_info.cls_info.cls)
@@ -101,7 +124,9 @@ class Property(object):
                 name = self._name
             column = PropertyColumn(self, cls, attr, name, self._primary,
                                     self._variable_class,
-                                    self._variable_kwargs)
+                                    self._variable_kwargs,
+                                    self._lazy_group, self._unique,
+                                    self._indexed)
             cls._storm_columns[self] = column
         return column
 
@@ -109,13 +134,17 @@ class Property(object):
 class PropertyColumn(Column):
 
     def __init__(self, prop, cls, attr, name, primary,
-                 variable_class, variable_kwargs):
+                 variable_class, variable_kwargs, lazy_group=None,
+                 unique=False, indexed=False):
         Column.__init__(self, name, cls, primary,
                         VariableFactory(variable_class, column=self,
                                         validator_attribute=attr,
                                         **variable_kwargs))
 
         self.cls = cls # Used by references
+        self.lazy_group = lazy_group
+        self.unique = unique
+        self.indexed = indexed
 
         # Copy attributes from the property to avoid one additional
         # function call on each access.
@@ -128,9 +157,29 @@ class SimpleProperty(Property):
     variable_class = None
 
     def __init__(self, name=None, primary=False, **kwargs):
+        """
+        @param lazy: If true, the property isn't loaded along with its
+            object, but only when it's touched.
+        @param lazy_group: Like C{lazy}, but loads all the properties
+            in the same L{LazyGroup} at once.  None means not lazy.
+        @param unique: If true, no two rows have the same non-NULL value
+            in the column, so that objects may be retrieved by it with
+            L{Store.get()<storm.store.Store.get>}, using the in-memory
+            cache of alive objects.
+        @param indexed: If true, stores keep a hash index of their alive
+            objects by the value of the property, so that
+            L{ResultSet.cached()<storm.store.ResultSet.cached>} finds
+            those equal to a given value without going over all of them.
+        """
         kwargs["value"] = kwargs.pop("default", Undef)
         kwargs["value_factory"] = kwargs.pop("default_factory", Undef)
-        Property.__init__(self, name, primary, self.variable_class, kwargs)
+        lazy_group = kwargs.pop("lazy_group", None)
+        if kwargs.pop("lazy", False) and lazy_group is None:
+            lazy_group = LazyGroup()
+        unique = kwargs.pop("unique", False)
+        indexed = kwargs.pop("indexed", False)
+        Property.__init__(self, name, primary, self.variable_class, kwargs,
+                          lazy_group, unique, indexed)
 
 
 class Bool(SimpleProperty):
@@ -26,8 +26,8 @@ from storm.store import Store, get_where_for_args, LostObjectError
 from storm.variables import LazyValue
 from storm.expr import (
     Select, Column, Exists, ComparableExpr, LeftJoin, Not, SQLRaw,
-    compare_columns, compile)
-from storm.info import get_cls_info, get_obj_info
+    compare_columns, compare_columns_in, compile)
+from storm.info import get_cls_info, get_obj_info, resolve_stale
 
 
 __all__ = ["Reference", "ReferenceSet", "Proxy"]
@@ -200,6 +200,64 @@ class Reference(object):
         self._relation = Relation(self._local_key, self._remote_key,
                                   False, self._on_remote)
 
+    def _prefetch(self, store, locals):
+        """Load the remote objects of many local objects at once.
+
+        Remote objects which aren't linked to their local objects yet are
+        retrieved with as few queries as possible, and then linked, so
+        that getting the reference from the local objects doesn't touch
+        the database.
+
+        @param store: The L{Store} holding the local objects.
+        @param locals: The local objects, instances of the class holding
+            this reference.
+        @return: A list with the distinct remote objects found.
+        """
+        relation = self._relation
+        remotes = {}
+        pending = []
+        for local in locals:
+            remote = relation.get_remote(local)
+            if remote is not None:
+                remotes.setdefault(get_obj_info(remote), remote)
+            elif not relation.local_variables_are_none(local):
+                pending.append((local, relation.get_local_variables(local)))
+
+        if pending:
+            if relation.remote_key_is_primary:
+                keys = [tuple(variable.get() for variable in variables)
+                        for local, variables in pending]
+                found = store.get_many(relation.remote_cls, keys)
+            else:
+                by_key = {}
+                step = max(1, store._batch_parameters //
+                              len(relation.remote_key))
+                for start in xrange(0, len(pending), step):
+                    where = compare_columns_in(
+                        relation.remote_key,
+                        [variables for local, variables
+                         in pending[start:start+step]])
+                    for remote in store.find(relation.remote_cls, where):
+                        key = tuple(variable.get() for variable in
+                                    relation.get_remote_variables(remote))
+                        by_key.setdefault(key, []).append(remote)
+                found = []
+                for local, variables in pending:
+                    matches = by_key.get(tuple(variable.get()
+                                               for variable in variables))
+                    # When many objects match, they're left for __get__()
+                    # to complain about.
+                    if matches is not None and len(matches) == 1:
+                        found.append(matches[0])
+                    else:
+                        found.append(None)
+            for (local, variables), remote in zip(pending, found):
+                if remote is not None:
+                    relation.link(local, remote)
+                    remotes.setdefault(get_obj_info(remote), remote)
+
+        return remotes.values()
+
     def __eq__(self, other):
         return self._relation.get_where_for_local(other)
 
@@ -250,6 +308,71 @@ class ReferenceSet(object):
     def __set__(self, local, value):
         raise FeatureError("Assigning to ResultSets not supported")
 
+    def _prefetch(self, store, locals):
+        """Load the remote objects of many local objects at once.
+
+        The remote objects of all the local objects are retrieved with
+        as few queries as possible, through the link class for indirect
+        reference sets, and kept with each local object, so that
+        iterating over its bound reference set doesn't touch the database
+        until the local object or any of its remote objects change.
+
+        @param store: The L{Store} holding the local objects.
+        @param locals: The local objects, instances of the class holding
+            this reference set.
+        @return: A list with the distinct remote objects found.
+        """
+        relation1 = self._relation1
+        relation2 = self._relation2
+
+        # Local objects with the same key share their remote objects.
+        local_infos = {}
+        keys = []
+        for local in locals:
+            if relation1.local_variables_are_none(local):
+                key = None
+            else:
+                variables = relation1.get_local_variables(local)
+                key = tuple(variable.get() for variable in variables)
+                if key not in local_infos:
+                    keys.append(variables)
+            local_infos.setdefault(key, []).append(get_obj_info(local))
+
+        generation = store._watch_prefetched(
+            get_cls_info(relation1.remote_cls), relation1.remote_key)
+        children = {}
+        step = max(1, store._batch_parameters // len(relation1.remote_key))
+        for start in xrange(0, len(keys), step):
+            where = compare_columns_in(relation1.remote_key,
+                                       keys[start:start+step])
+            if relation2 is None:
+                result = store.find(relation1.remote_cls, where)
+            else:
+                result = store.find((relation1.remote_cls, relation2.local_cls),
+                                    where, relation2.get_where_for_join())
+            if self._order_by is not None:
+                result.order_by(self._order_by)
+            for item in result:
+                if relation2 is None:
+                    link = remote = item
+                else:
+                    link, remote = item
+                key = tuple(variable.get() for variable in
+                            relation1.get_remote_variables(link))
+                links, remotes = children.setdefault(key, ([], []))
+                links.append(link)
+                remotes.append(remote)
+
+        found = {}
+        for key, key_local_infos in local_infos.iteritems():
+            links, remotes = children.get(key, ((), ()))
+            for local_info in key_local_infos:
+                _set_prefetched(local_info, relation1, generation,
+                                links, remotes)
+            for remote in remotes:
+                found[get_obj_info(remote)] = remote
+        return found.values()
+
     def _build_relations(self):
         resolver = PropertyResolver(self, self._cls)
 
@@ -285,6 +408,9 @@ class BoundReferenceSetBase(object):
         return result
 
     def __iter__(self):
+        remotes = self._get_prefetched()
+        if remotes is not None:
+            return iter(remotes)
         return self.find().__iter__()
 
     def __contains__(self, item):
@@ -309,6 +435,9 @@ class BoundReferenceSetBase(object):
         return self.find().order_by(*args)
 
     def count(self):
+        remotes = self._get_prefetched()
+        if remotes is not None:
+            return len(remotes)
         return self.find().count()
 
 
@@ -323,7 +452,11 @@ class BoundReferenceSet(BoundReferenceSetBase):
     def _get_where_clause(self):
         return self._relation.get_where_for_remote(self._local)
 
+    def _get_prefetched(self):
+        return _get_prefetched(get_obj_info(self._local), self._relation)
+
     def clear(self, *args, **kwargs):
+        _drop_prefetched(get_obj_info(self._local), self._relation)
         set_kwargs = {}
         for remote_column in self._relation.remote_key:
             set_kwargs[remote_column.name] = None
@@ -334,9 +467,11 @@ class BoundReferenceSet(BoundReferenceSetBase):
         store.find(self._target_cls, where, *args, **kwargs).set(**set_kwargs)
 
     def add(self, remote):
+        _drop_prefetched(get_obj_info(self._local), self._relation)
         self._relation.link(self._local, remote, True)
 
     def remove(self, remote):
+        _drop_prefetched(get_obj_info(self._local), self._relation)
         self._relation.unlink(get_obj_info(self._local),
                               get_obj_info(remote), True)
 
@@ -356,7 +491,11 @@ class BoundIndirectReferenceSet(BoundReferenceSetBase):
         return (self._relation1.get_where_for_remote(self._local) &
                 self._relation2.get_where_for_join())
 
+    def _get_prefetched(self):
+        return _get_prefetched(get_obj_info(self._local), self._relation1)
+
     def clear(self, *args, **kwargs):
+        _drop_prefetched(get_obj_info(self._local), self._relation1)
         store = Store.of(self._local)
         if store is None:
             raise NoStoreError("Can't perform operation without a store")
@@ -369,6 +508,7 @@ class BoundIndirectReferenceSet(BoundReferenceSetBase):
         store.find(self._link_cls, where).remove()
 
     def add(self, remote):
+        _drop_prefetched(get_obj_info(self._local), self._relation1)
         link = self._link_cls()
         self._relation1.link(self._local, link, True)
         # Don't use remote here, as it might be security proxied or something.
@@ -379,6 +519,7 @@ class BoundIndirectReferenceSet(BoundReferenceSetBase):
         store = Store.of(self._local)
         if store is None:
             raise NoStoreError("Can't perform operation without a store")
+        _drop_prefetched(get_obj_info(self._local), self._relation1)
         # Don't use remote here, as it might be security proxied or something.
         remote = get_obj_info(remote).get_obj()
         where = (self._relation1.get_where_for_remote(self._local) &
@@ -483,11 +624,13 @@ class Relation(object):
         check if it's still in the database.
         """
         local_info = get_obj_info(local)
+        resolve_stale(local_info)
         try:
             obj = local_info[self]["remote"]
         except KeyError:
             return None
         remote_info = get_obj_info(obj)
+        resolve_stale(remote_info)
         if remote_info.get("invalidated"):
             try:
                 Store.of(obj)._validate_alive(remote_info)
@@ -504,7 +647,7 @@ class Relation(object):
         local_variables = self.get_local_variables(local)
         for variable in local_variables:
             if not variable.is_defined():
-                Store.of(local).flush()
+                Store.of(local).flush(local)
                 break
         return compare_columns(self.remote_key, local_variables)
 
@@ -541,12 +684,14 @@ class Relation(object):
 
     def get_local_variables(self, local):
         local_info = get_obj_info(local)
+        resolve_stale(local_info)
         return tuple(local_info.variables[column]
                      for column in self._get_local_columns(local.__class__))
 
     def local_variables_are_none(self, local):
         """Return true if all variables of the local key have None values."""
         local_info = get_obj_info(local)
+        resolve_stale(local_info)
         for column in self._get_local_columns(local.__class__):
             if local_info.variables[column].get() is not None:
                 return False
@@ -554,6 +699,7 @@ class Relation(object):
 
     def get_remote_variables(self, remote):
         remote_info = get_obj_info(remote)
+        resolve_stale(remote_info)
         return tuple(remote_info.variables[column]
                      for column in self._get_remote_columns(remote.__class__))
 
@@ -930,6 +1076,58 @@ class PropertyResolver(object):
         return self._registry.get(property_path, self._namespace)
 
 
+def _set_prefetched(local_info, relation, generation, links, remotes):
+    """Keep the prefetched remote objects of a reference set.
+
+    They're dropped as soon as the local object, or any of the link or
+    remote objects, change or are removed, and once the store changes
+    the given generation of the remote class of the relation, as other
+    objects may then have joined the set.
+    """
+    local_info.setdefault("prefetched", {})[relation] = (generation, remotes)
+    for obj_info in [local_info] + [get_obj_info(obj)
+                                    for obj in links + remotes]:
+        obj_info.event.hook("changed", _drop_prefetched_on_changed,
+                            local_info, relation)
+        obj_info.event.hook("removed", _drop_prefetched_on_removed,
+                            local_info, relation)
+
+
+def _get_prefetched(local_info, relation):
+    # Lazily invalidated objects drop what was prefetched for them.
+    resolve_stale(local_info)
+    prefetched = local_info.get("prefetched")
+    if prefetched is not None:
+        entry = prefetched.get(relation)
+        if entry is not None:
+            generation, remotes = entry
+            store = local_info.get("store")
+            if (store is not None and generation ==
+                store._get_prefetched_generation(
+                    get_cls_info(relation.remote_cls))):
+                return remotes
+            del prefetched[relation]
+    return None
+
+
+def _drop_prefetched(local_info, relation):
+    prefetched = local_info.get("prefetched")
+    if prefetched is not None:
+        prefetched.pop(relation, None)
+    return False
+
+
+def _drop_prefetched_on_changed(obj_info, variable, old_value, new_value,
+                                fromdb, local_info, relation):
+    # Values loaded from the database, such as lazy ones, are no changes.
+    if not fromdb:
+        return _drop_prefetched(local_info, relation)
+
+
+def _drop_prefetched_on_removed(obj_info, local_info, relation):
+    return _drop_prefetched(local_info, relation)
+
+
 def _find_descriptor_class(used_cls, descr):
     for cls in used_cls.__mro__:
         for attr, _descr in cls.__dict__.iteritems():
@@ -365,11 +365,11 @@ class SQLObjectBase(Storm):
         return result._first()
 
     def syncUpdate(self):
-        self._get_store().flush()
+        self._get_store().flush(self)
 
     def sync(self):
         store = self._get_store()
-        store.flush()
+        store.flush(self)
         store.autoreload(self)
 
 
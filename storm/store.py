@@ -25,30 +25,142 @@ This module contains the highest-level ORM interface in Storm.
 """
 
 from copy import copy
-from weakref import WeakValueDictionary
+from weakref import WeakValueDictionary, KeyedRef, ref
 from operator import itemgetter
+from itertools import chain, groupby
+from heapq import heapify, heappop, heappush
+from time import time as now
+import logging
 
 from storm.info import get_cls_info, get_obj_info, set_obj_info
 from storm.variables import Variable, LazyValue
 from storm.expr import (
     Expr, Select, Insert, Update, Delete, Column, Count, Max, Min,
-    Avg, Sum, Eq, And, Asc, Desc, compile_python, compare_columns, SQLRaw,
-    Union, Except, Intersect, Alias, SetExpr)
+    Avg, Sum, Eq, And, Asc, Desc, compile_python, compare_columns,
+    compare_columns_in, SQLRaw, Union, Except, Intersect, Alias, SetExpr,
+    State)
 from storm.exceptions import (
     WrongStoreError, NotFlushedError, OrderLoopError, UnorderedError,
     NotOneError, FeatureError, CompileError, LostObjectError, ClassInfoError)
 from storm import Undef
 from storm.cache import Cache
+from storm.database import Result
 from storm.event import EventSystem
+from storm.invalidation import ChangeSet
 
 
 __all__ = ["Store", "AutoReload", "EmptyResultSet"]
 
 
+logger = logging.getLogger("storm")
+
 PENDING_ADD = 1
 PENDING_REMOVE = 2
 
 
+class _Generation(object):
+    """Tag of the objects held by a store since it was last invalidated."""
+
+    def __init__(self):
+        self.stale = False
+
+
+class _Index(object):
+    """Alive objects of a class, by the values of its indexed columns.
+
+    Objects whose value for a column isn't known in memory, such as
+    when it must be reloaded, are kept under L{Undef}.  Objects left
+    behind by an invalidation stay under their last known value until
+    they're touched and invalidated for real.
+    """
+
+    def __init__(self):
+        self._buckets = {} # (id(column), value): {id(obj_info): ref}
+
+    def add(self, column, value, obj_info):
+        key = (id(column), value)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {}
+        bucket[id(obj_info)] = KeyedRef(obj_info, self._remove_ref,
+                                        (key, id(obj_info)))
+
+    def remove(self, column, value, obj_info):
+        key = (id(column), value)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.pop(id(obj_info), None)
+            if not bucket:
+                del self._buckets[key]
+
+    def get(self, column, value):
+        """Return the objects with the value, or with an unknown one."""
+        obj_infos = []
+        for key in ((id(column), value), (id(column), Undef)):
+            for obj_info_ref in self._buckets.get(key, {}).values():
+                obj_info = obj_info_ref()
+                if obj_info is not None:
+                    obj_infos.append(obj_info)
+        return obj_infos
+
+    def _remove_ref(self, obj_info_ref):
+        key, obj_info_id = obj_info_ref.key
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket.get(obj_info_id) is obj_info_ref:
+            del bucket[obj_info_id]
+            if not bucket:
+                del self._buckets[key]
+
+
+class _CachedTable(object):
+    """All the objects of a class with C{__storm_cache_all__}.
+
+    The objects are referenced strongly, so that they stay alive, and
+    the table is valid for the generation of the store it was loaded
+    in.  When cached for some time, it's kept for new generations until
+    it expires: commits, rollbacks and raw statements don't drop it,
+    unless the store itself changed the table in the transaction, and
+    only changes received from an invalidation bus do.
+    """
+
+    def __init__(self, generation, cache_all):
+        self.generation = generation
+        self.objects = {} # id(obj_info): obj
+        if cache_all is True:
+            self.expires = None
+        else:
+            self.expires = now() + cache_all
+
+    def is_valid(self, generation):
+        return (self.generation is generation and
+                (self.expires is None or now() < self.expires))
+
+
+def _is_select(statement):
+    """Tell whether a statement given to L{Store.execute} only reads."""
+    if isinstance(statement, Select):
+        return True
+    return (isinstance(statement, basestring) and
+            statement.lstrip()[:6].upper() == "SELECT")
+
+
+class _Siblings(object):
+    """Objects loaded together, which are reloaded together as well."""
+
+    def __init__(self):
+        self._refs = []
+
+    def add(self, obj_info):
+        obj_info["siblings"] = self
+        self._refs.append(ref(obj_info))
+
+    def __iter__(self):
+        for obj_info_ref in self._refs:
+            obj_info = obj_info_ref()
+            if obj_info is not None:
+                yield obj_info
+
+
 class Store(object):
     """The Storm Store.
 
@@ -63,23 +175,97 @@ class Store(object):
 
     _result_set_factory = None
 
-    def __init__(self, database, cache=None):
+    # Maximum number of values sent in a single statement when flushing
+    # several objects at once.  SQLite's default limit is 999.
+    _batch_parameters = 999
+
+    def __init__(self, database, cache=None, negative_cache=False,
+                 validate_siblings=False, row_cache=None,
+                 invalidation_bus=None, cache_quotas=None):
         """
         @param database: The L{storm.database.Database} instance to use.
         @param cache: The cache to use.  Defaults to a L{Cache} instance.
+        @param negative_cache: If true, primary keys which L{get} didn't
+            find in the database are remembered, so that looking them up
+            again doesn't touch the database.  They are forgotten when
+            an object with the same key and class is flushed or loaded,
+            when the store is invalidated, which happens on commits and
+            rollbacks, and when a statement is run with L{execute}.
+            Rows inserted by other means, or through other classes mapped
+            to the same table, aren't noticed until then.
+        @param validate_siblings: If true, when an invalidated object
+            must be checked to still be in the database, all the other
+            invalidated objects of the same class are checked along
+            with it, as with L{revalidate}.
+        @param row_cache: A L{RowCache<storm.cache.RowCache>}, usually
+            shared by all the stores of the process, from which L{get}
+            takes the rows of objects which aren't alive, and to which
+            loaded rows are added.  Classes which this store wrote to
+            don't use it until the transaction ends, through any class
+            mapped to them.
+        @param invalidation_bus: An L{InvalidationBus
+            <storm.invalidation.InvalidationBus>} on which the changes
+            committed by this store are published.  The rows changed by
+            peers are dropped from the row cache and from fully cached
+            tables, and their alive objects are invalidated, when this
+            store commits or rolls back.
+        @param cache_quotas: A dict mapping classes to the number of their
+            recently used objects to keep in a L{Cache} of their own,
+            rather than in the main cache, so that loading many objects
+            of a class doesn't evict those of others.  Overrides the
+            C{__storm_cache_quota__} attribute of classes.
         """
         self._database = database
         self._event = EventSystem(self)
         self._connection = database.connect(self._event)
         self._alive = WeakValueDictionary()
+        self._alive_by_class = {} # cls: {id(obj_info): obj_info}
+        self._indexes = {} # cls: _Index
+        self._cached_tables = {} # cls: _CachedTable
+        self._unique = WeakValueDictionary() # (id(column), value)
         self._dirty = {}
         self._order = {} # (info, info) = count
         if cache is None:
             self._cache = Cache()
         else:
             self._cache = cache
+        if cache_quotas is None:
+            cache_quotas = {}
+        self._cache_quotas = cache_quotas
+        self._class_caches = {} # cls: Cache, or None for the main cache
+        self._pinned = {} # obj_info: obj
+        if negative_cache:
+            self._missing = set() # (cls, primary_values)
+        else:
+            self._missing = None
+        self._validate_siblings = validate_siblings
+        self._row_cache = row_cache
+        # Version of the row cache when the transaction started.
+        self._row_cache_version = None
+        if row_cache is not None:
+            self._row_cache_version = row_cache.get_version()
+            self._event.hook("register-transaction", self._start_transaction)
+        self._written = set() # Table keys written to in this transaction.
+        self._changes = {} # (table_key, primary_values): kind
+        self._changed_tables = set()
+        self._invalidation_bus = invalidation_bus
+        # Changed rows are only tracked when something may use them.
+        self._track_changes = (row_cache is not None or
+                               invalidation_bus is not None)
+        self._received = [] # Change sets from peers.
+        if invalidation_bus is not None:
+            invalidation_bus.subscribe(self._receive_changes)
         self._implicit_flush_block_count = 0
         self._sequence = 0 # Advisory ordering.
+        self._generation = _Generation()
+        # Objects with an __storm_invalidated__ hook.
+        self._hooked = WeakValueDictionary() # id(obj_info): obj_info
+        # Tables of prefetched reference sets.
+        self._prefetched_tables = {} # table_key: [generation, column names]
+        self._get_hits = 0
+        self._get_misses = 0
+        self._negative_hits = 0
+        self._rebuilt = 0
 
     def get_database(self):
         """Return this Store's Database object."""
@@ -101,14 +287,27 @@ class Store(object):
         """Execute a basic query.
 
         This is just like L{storm.database.Database.execute}, except
-        that a flush is performed first.
+        that a flush is performed first.  Tables of classes with
+        C{__storm_cache_all__} set to True are reloaded after anything
+        but a SELECT, while those cached for some time are kept until
+        they expire.
         """
         if self._implicit_flush_block_count == 0:
             self.flush()
+        if not _is_select(statement):
+            if self._missing:
+                # The statement may insert anything.
+                self._missing.clear()
+            # ... or change anything.
+            for cls, cached_table in self._cached_tables.items():
+                if cached_table.expires is None:
+                    del self._cached_tables[cls]
         return self._connection.execute(statement, params, noresult)
 
     def close(self):
         """Close the connection."""
+        if self._invalidation_bus is not None:
+            self._invalidation_bus.unsubscribe(self._receive_changes)
         self._connection.close()
 
     def begin(self, xid):
@@ -131,14 +330,52 @@ class Store(object):
         """Commit all changes to the database.
 
         This invalidates the cache, so all live objects will have data
-        reloaded next time they are touched.
+        reloaded next time they are touched.  Objects of classes with
+        C{__storm_cache_all__} set to a number of seconds are kept as
+        they are until their table expires.
+
+        When the store has a row cache or an invalidation bus, a
+        L{ChangeSet<storm.invalidation.ChangeSet>} with the rows changed
+        is then emitted as the "changes-committed" event of the store,
+        and published on its invalidation bus.  Errors of the bus are
+        logged rather than raised, since the transaction is committed by
+        then, and the row cache and cached tables are dropped instead.
         """
         self.flush()
+        cached_tables = self._cached_tables.items()
         self.invalidate()
         self._connection.commit()
+        if self._row_cache is not None:
+            for table in self._written:
+                self._row_cache.remove_table(table)
+        self._written.clear()
+        self._keep_cached_tables(cached_tables)
+        change_set = self._get_change_set()
+        if change_set:
+            self._event.emit("changes-committed", change_set)
+            if self._invalidation_bus is not None:
+                try:
+                    self._invalidation_bus.publish(change_set)
+                except Exception:
+                    logger.exception("Error publishing committed changes")
+                    self._received.append(ChangeSet(lost=True))
+        self._apply_received_changes()
+        if self._row_cache is not None:
+            self._event.hook("register-transaction", self._start_transaction)
 
     def rollback(self):
-        """Roll back all outstanding changes, reverting to database state."""
+        """Roll back all outstanding changes, reverting to database state.
+
+        Objects of classes with C{__storm_cache_all__} set to a number of
+        seconds are kept as they are until their table expires, unless
+        the table was changed by this store in the transaction.
+        """
+        changed = set(obj_info.cls_info.cls for obj_info in self._dirty)
+        cached_tables = [
+            (cls, cached_table)
+            for cls, cached_table in self._cached_tables.iteritems()
+            if cls not in changed and
+               get_cls_info(cls).table_key not in self._written]
         for obj_info in self._dirty:
             pending = obj_info.pop("pending", None)
             if pending is PENDING_ADD:
@@ -150,16 +387,28 @@ class Store(object):
                 # and thus should continue to resolve from now on.
                 self._enable_lazy_resolving(obj_info)
         self._dirty.clear()
+        self._written.clear()
+        self._changes.clear()
+        self._changed_tables.clear()
         self.invalidate()
         self._connection.rollback()
+        self._keep_cached_tables(cached_tables)
+        self._apply_received_changes()
+        if self._row_cache is not None:
+            self._event.hook("register-transaction", self._start_transaction)
 
     def get(self, cls, key):
         """Get object of type cls with the given primary key from the database.
 
         If the object is alive the database won't be touched.
 
-        @param cls: Class of the object to be retrieved.
+        Objects may also be retrieved by the value of a property defined
+        with C{unique=True}, such as in C{store.get(User.email, email)}.
+
+        @param cls: Class of the object to be retrieved, or a unique
+            property of it.
         @param key: Primary key of object. May be a tuple for composed keys.
+            When C{cls} is a unique property, a value of it.
 
         @return: The object found with the given primary key, or None
             if no object is found.
@@ -168,35 +417,183 @@ class Store(object):
         if self._implicit_flush_block_count == 0:
             self.flush()
 
-        if type(key) != tuple:
-            key = (key,)
+        if isinstance(cls, Column):
+            return self._get_unique(cls, key)
 
         cls_info = get_cls_info(cls)
 
-        assert len(key) == len(cls_info.primary_key)
-
-        primary_vars = []
-        for column, variable in zip(cls_info.primary_key, key):
-            if not isinstance(variable, Variable):
-                variable = column.variable_factory(value=variable)
-            primary_vars.append(variable)
-
+        primary_vars = self._get_primary_vars(cls_info, key)
         primary_values = tuple(var.get(to_db=True) for var in primary_vars)
-        obj_info = self._alive.get((cls_info.cls, primary_values))
-        if obj_info is not None and not obj_info.get("invalidated"):
-            return self._get_object(obj_info)
+        found, obj = self._get_in_memory(
+            cls_info, primary_values,
+            self._get_cached_table(cls_info) is not None)
+        if found:
+            return obj
 
         where = compare_columns(cls_info.primary_key, primary_vars)
 
-        select = Select(cls_info.columns, where,
+        select = Select(cls_info.eager_columns, where,
                         default_tables=cls_info.table, limit=1)
 
         result = self._connection.execute(select)
         values = result.get_one()
         if values is None:
+            if self._missing is not None:
+                self._missing.add((cls_info.cls, primary_values))
             return None
         return self._load_object(cls_info, result, values)
 
+    def _get_in_memory(self, cls_info, primary_values, cached):
+        """Look an object up by primary key without querying the database.
+
+        Alive objects, the fully cached table of the class, the negative
+        cache and the row cache are tried in turn, counting the hits and
+        misses reported by L{get_stats}.
+
+        @param cached: Whether the table of the class is fully cached.
+        @return: A C{(found, obj)} tuple.  If C{found} is false, the
+            database must be queried.  Otherwise C{obj} is the object,
+            or None if it's known not to exist.
+        """
+        obj_info = self._alive.get((cls_info.cls, primary_values))
+        # All the objects of a fully cached table are alive.
+        if cached:
+            if obj_info is None:
+                self._negative_hits += 1
+                return True, None
+            self._get_hits += 1
+            return True, self._get_object(obj_info)
+        if obj_info is not None:
+            self._check_generation(obj_info)
+            if obj_info.get("invalidated") and self._validate_siblings:
+                try:
+                    self._validate_alive(obj_info)
+                except LostObjectError:
+                    pass
+            if not obj_info.get("invalidated"):
+                self._get_hits += 1
+                return True, self._get_object(obj_info)
+
+        if (self._missing is not None and
+            (cls_info.cls, primary_values) in self._missing):
+            self._negative_hits += 1
+            return True, None
+
+        self._get_misses += 1
+
+        if (self._row_cache is not None and
+            cls_info.table_key not in self._written):
+            row = self._row_cache.get(cls_info.cls, primary_values)
+            if row is not None:
+                # Rows are kept as database values, which the base
+                # Result sets into variables as they are.
+                return True, self._load_object(cls_info, Result, row)
+        return False, None
+
+    def get_many(self, cls, keys):
+        """Get objects of type cls with the given primary keys.
+
+        Each object is looked up in memory as with L{get}, and all the
+        others are retrieved from the database at once, in as few
+        queries as possible.
+
+        @param cls: Class of the objects to be retrieved.
+        @param keys: Sequence of primary keys.  Each of them may be a
+            tuple for composed keys.
+
+        @return: A list with the object found for each given primary key,
+            in the same order, with None for keys with no object.
+        """
+        if self._implicit_flush_block_count == 0:
+            self.flush()
+
+        cls_info = get_cls_info(cls)
+        cached = self._get_cached_table(cls_info) is not None
+
+        objects = {}
+        missing = {}
+        all_primary_values = []
+        for key in keys:
+            primary_vars = self._get_primary_vars(cls_info, key)
+            primary_values = tuple(var.get(to_db=True)
+                                   for var in primary_vars)
+            all_primary_values.append(primary_values)
+            if primary_values in objects or primary_values in missing:
+                continue
+            found, obj = self._get_in_memory(cls_info, primary_values,
+                                             cached)
+            if found:
+                objects[primary_values] = obj
+            else:
+                missing[primary_values] = primary_vars
+
+        if missing:
+            primary_key = cls_info.primary_key
+            missing_vars = missing.values()
+            step = max(1, self._batch_parameters // len(primary_key))
+            for start in xrange(0, len(missing_vars), step):
+                where = compare_columns_in(primary_key,
+                                           missing_vars[start:start+step])
+                select = Select(cls_info.eager_columns, where,
+                                default_tables=cls_info.table)
+                result = self._connection.execute(select)
+                for values in result:
+                    obj = self._load_object(cls_info, result, values)
+                    primary_values = tuple(
+                        var.get(to_db=True)
+                        for var in get_obj_info(obj)["primary_vars"])
+                    objects[primary_values] = obj
+            if self._missing is not None:
+                for primary_values in missing:
+                    if primary_values not in objects:
+                        self._missing.add((cls_info.cls, primary_values))
+
+        siblings = _Siblings()
+        for obj in objects.itervalues():
+            if obj is not None:
+                siblings.add(get_obj_info(obj))
+
+        return [objects.get(primary_values)
+                for primary_values in all_primary_values]
+
+    def _get_unique(self, column, value):
+        """Get the object with the given value in a unique column."""
+        cls = getattr(column, "cls", None)
+        if cls is None:
+            raise FeatureError("Can't get objects by %r" % (column,))
+        cls_info = get_cls_info(cls)
+        for unique_column in cls_info.unique_columns:
+            if unique_column is column:
+                break
+        else:
+            raise FeatureError("Can't get objects by %s.%s, which isn't "
+                               "unique" % (cls.__name__, column.name))
+
+        variable = column.variable_factory(value=value)
+        obj_info = self._unique.get((id(column), variable.get(to_db=True)))
+        if obj_info is not None:
+            self._check_generation(obj_info)
+            if not obj_info.get("invalidated"):
+                return self._get_object(obj_info)
+        return self.find(cls_info.cls, Eq(column, variable)).one()
+
+    def _get_primary_vars(self, cls_info, key):
+        """Return variables for the given primary key of cls_info.
+
+        @param key: Primary key value. May be a tuple for composed keys.
+        """
+        if type(key) != tuple:
+            key = (key,)
+
+        assert len(key) == len(cls_info.primary_key)
+
+        primary_vars = []
+        for column, variable in zip(cls_info.primary_key, key):
+            if not isinstance(variable, Variable):
+                variable = column.variable_factory(value=variable)
+            primary_vars.append(variable)
+        return primary_vars
+
     def find(self, cls_spec, *args, **kwargs):
         """Perform a query.
 
@@ -276,6 +673,8 @@ class Store(object):
             obj_info["pending"] = PENDING_ADD
             self._set_dirty(obj_info)
             self._enable_lazy_resolving(obj_info)
+            if self._prefetched_tables:
+                self._outdate_prefetched(obj_info)
             obj_info.event.emit("added")
 
         return obj
@@ -298,6 +697,7 @@ class Store(object):
         elif pending is PENDING_ADD:
             del obj_info["store"]
             del obj_info["pending"]
+            self._pinned.pop(obj_info, None)
             self._set_clean(obj_info)
             self._disable_lazy_resolving(obj_info)
             obj_info.event.emit("removed")
@@ -320,13 +720,18 @@ class Store(object):
         if "primary_vars" not in obj_info:
             raise NotFlushedError("Can't reload an object if it was "
                                   "never flushed")
+        self._check_generation(obj_info)
         where = compare_columns(cls_info.primary_key, obj_info["primary_vars"])
-        select = Select(cls_info.columns, where,
+        select = Select(cls_info.eager_columns, where,
                         default_tables=cls_info.table, limit=1)
         result = self._connection.execute(select)
         values = result.get_one()
-        self._set_values(obj_info, cls_info.columns, result, values,
+        self._set_values(obj_info, cls_info.eager_columns, result, values,
                          replace_unknown_lazy=True)
+        for column in cls_info.lazy_columns:
+            variable = obj_info.variables[column]
+            variable.set(AutoReload)
+            variable.checkpoint()
         self._set_clean(obj_info)
 
     def autoreload(self, obj=None):
@@ -355,12 +760,113 @@ class Store(object):
         transaction that bypassed the ORM layer. The Store
         automatically invalidates all cached objects on transaction
         boundaries.
+
+        When invalidating all objects, which takes constant time, they're
+        only actually invalidated when next touched, except for those
+        with unflushed changes or with an C{__storm_invalidated__} hook.
         """
         if obj is None:
-            self._cache.clear()
+            self._clear_caches()
+            self._cached_tables.clear()
+        else:
+            obj_info = get_obj_info(obj)
+            self._get_cache(obj_info.cls_info).remove(obj_info)
+            self._cached_tables.pop(obj_info.cls_info.cls, None)
+        if self._missing:
+            self._missing.clear()
+        if obj is None:
+            self._generation.stale = True
+            self._generation = _Generation()
+            obj_infos = self._dirty.keys()
+            obj_infos.extend(obj_info for obj_info in self._hooked.values()
+                             if obj_info not in self._dirty)
+            self._set_autoreload(obj_infos, True)
         else:
-            self._cache.remove(get_obj_info(obj))
-        self._mark_autoreload(obj, True)
+            self._mark_autoreload(obj, True)
+
+    def revalidate(self, objects):
+        """Check that many invalidated objects are still in the database.
+
+        Invalidated objects, such as all alive objects after a commit or
+        rollback, are usually checked one by one, when they're touched.
+        This checks all the given ones with as few queries as possible,
+        so that touching them afterwards doesn't need to.
+
+        @param objects: Objects in this store.  Those not invalidated
+            are ignored.
+        @return: A list of the objects which aren't in the database
+            anymore.
+        """
+        obj_infos = []
+        for obj in objects:
+            obj_info = get_obj_info(obj)
+            if obj_info.get("store") is not self:
+                raise WrongStoreError("%s is not in this store" % repr(obj))
+            obj_infos.append(obj_info)
+        return [obj_info.get_obj()
+                for obj_info in self._validate_many(obj_infos)]
+
+    def pin(self, obj):
+        """Keep an object in memory until it's unpinned.
+
+        Pinned objects aren't deallocated when they're evicted from the
+        cache, so that reference data loaded once is always found by
+        L{get}, like other alive objects.  They're still invalidated on
+        transaction boundaries, and unpinned when they're removed from
+        the store, or when the store is reset.
+        """
+        obj_info = get_obj_info(obj)
+        if obj_info.get("store") is not self:
+            raise WrongStoreError("%s is not in this store" % repr(obj))
+        self._pinned[obj_info] = obj
+
+    def unpin(self, obj):
+        """Stop keeping a pinned object in memory.
+
+        @return: True if the object was pinned, False otherwise.
+        """
+        return self._pinned.pop(get_obj_info(obj), None) is not None
+
+    def get_pinned(self):
+        """Return a list of the pinned objects."""
+        return self._pinned.values()
+
+    def get_stats(self):
+        """Return a dict of statistics about the store.
+
+        The number of alive objects is under "alive", and the number of
+        pinned objects under "pinned".  Since the store was created, the
+        number of L{get} calls answered by an alive object are under
+        "get_hits", those which had to load the object under
+        "get_misses", those answered without a query that the object
+        doesn't exist under "negative_hits", and the number of alive
+        objects rebuilt after their Python object was deallocated under
+        "rebuilt".
+
+        The statistics of the caches of the store, summed, are under
+        their own name prefixed with "cache_", and those of its row
+        cache under their name prefixed with "row_cache_".  Caches which
+        don't implement C{get_stats()} are ignored.
+        """
+        stats = {"alive": len(self._alive),
+                 "pinned": len(self._pinned),
+                 "get_hits": self._get_hits,
+                 "get_misses": self._get_misses,
+                 "negative_hits": self._negative_hits,
+                 "rebuilt": self._rebuilt}
+        caches = [self._cache]
+        caches.extend(cache for cache in self._class_caches.itervalues()
+                      if cache is not None)
+        for cache in caches:
+            get_cache_stats = getattr(cache, "get_stats", None)
+            if get_cache_stats is not None:
+                for name, value in get_cache_stats().iteritems():
+                    name = "cache_" + name
+                    stats[name] = stats.get(name, 0) + value
+        if self._row_cache is not None:
+            for name, value in self._row_cache.get_stats().iteritems():
+                stats["row_cache_" + name] = value
+        return stats
 
     def reset(self):
         """Reset this store, causing all future queries to return new objects.
@@ -376,9 +882,19 @@ class Store(object):
         for obj_info in self._iter_alive():
             if "store" in obj_info:
                 del obj_info["store"]
+            obj_info.pop("generation", None)
+            obj_info.pop("index_values", None)
         self._alive.clear()
+        self._alive_by_class.clear()
+        self._indexes.clear()
+        self._cached_tables.clear()
+        self._unique.clear()
+        self._hooked.clear()
         self._dirty.clear()
-        self._cache.clear()
+        self._clear_caches()
+        self._pinned.clear()
+        if self._missing:
+            self._missing.clear()
         # The following line is untested, but then, I can't really find a way
         # to test it without whitebox.
         self._order.clear()
@@ -389,6 +905,9 @@ class Store(object):
             obj_infos = self._iter_alive()
         else:
             obj_infos = (get_obj_info(obj),)
+        self._set_autoreload(obj_infos, invalidate)
+
+    def _set_autoreload(self, obj_infos, invalidate=False):
         for obj_info in obj_infos:
             cls_info = obj_info.cls_info
             for column in cls_info.columns:
@@ -401,6 +920,8 @@ class Store(object):
                 # (e.g. by a get()), the database should be queried to see
                 # if the object's still there.
                 obj_info["invalidated"] = True
+                if "generation" in obj_info:
+                    obj_info["generation"] = self._generation
         # We want to make sure we've marked all objects as invalidated and set
         # up their autoreloads before calling the invalidated hook on *any* of
         # them, because an invalidated hook might use other objects and we want
@@ -435,7 +956,7 @@ class Store(object):
         pair = (get_obj_info(before), get_obj_info(after))
         self._order[pair] -= 1
 
-    def flush(self):
+    def flush(self, obj=None):
         """Flush all dirty objects in cache to database.
 
         This method will first call the __storm_pre_flush__ hook of all dirty
@@ -453,98 +974,448 @@ class Store(object):
         only need to call this method explicitly in very rare cases where
         normal flushing times are insufficient, such as when you want to
         make sure a database trigger gets run at a particular time.
+
+        @param obj: If given, only this object and the dirty objects which
+            must be flushed before it, as specified with L{add_flush_order},
+            are flushed.  Other dirty objects are left for a later flush.
         """
+        if obj is None:
+            target_info = None
+        else:
+            target_info = get_obj_info(obj)
+            if target_info.get("store") is not self:
+                raise WrongStoreError("%s is not in this store" % repr(obj))
+
         self._event.emit("flush")
 
         # The _dirty list may change under us while we're running
         # the flush hooks, so we cannot just simply loop over it
         # once.  To prevent infinite looping we keep track of which
         # objects we've called the hook for using a `flushing` dict.
-        flushing = {}
-        while self._dirty:
-            (obj_info, obj) = self._dirty.popitem()
-            if obj_info not in flushing:
-                flushing[obj_info] = obj
-                self._run_hook(obj_info, "__storm_pre_flush__")
-        self._dirty = flushing
+        if target_info is None:
+            flushing = {}
+            while self._dirty:
+                (obj_info, obj) = self._dirty.popitem()
+                if obj_info not in flushing:
+                    flushing[obj_info] = obj
+                    self._run_hook(obj_info, "__storm_pre_flush__")
+            self._dirty = flushing
+        else:
+            flushing = set()
+            while True:
+                targets = [obj_info
+                           for obj_info in self._get_flush_targets(target_info)
+                           if obj_info not in flushing]
+                if not targets:
+                    break
+                for obj_info in targets:
+                    flushing.add(obj_info)
+                    self._run_hook(obj_info, "__storm_pre_flush__")
+
+        # The external loop is important because items can get into the dirty
+        # state while we're flushing objects, ...
+        while True:
+            if target_info is None:
+                dirty = self._dirty
+            else:
+                dirty = self._get_flush_targets(target_info)
+            if not dirty:
+                break
+
+            # ... but we don't have to schedule everything again after each
+            # object is flushed, so we have an internal loop too.  Objects
+            # are scheduled in topological order, using the number of dirty
+            # objects which must be flushed before each of them, and picking
+            # the earliest dirtied object among those ready to be flushed.
+            # If no objects become dirty during flush, this will clean
+            # self._dirty and the external loop will exit too.
+            pending = {}
+            successors = {}
+            for (before_info, after_info), n in self._order.iteritems():
+                if n > 0 and before_info in dirty and after_info in dirty:
+                    pending[after_info] = pending.get(after_info, 0) + 1
+                    after_list = successors.get(before_info)
+                    if after_list is None:
+                        successors[before_info] = [after_info]
+                    else:
+                        after_list.append(after_info)
+
+            ready = [(obj_info["sequence"], obj_info)
+                     for obj_info in dirty if obj_info not in pending]
+            heapify(ready)
+
+            while ready:
+                obj_info = heappop(ready)[1]
+
+                # Objects which are ready to be flushed right after this
+                # one, and which may be sent to the database in the same
+                # statement, are flushed together with it.
+                batch = [obj_info]
+                batch_key = self._get_batch_key(obj_info)
+                if batch_key is not None:
+                    while (ready and
+                           self._get_batch_key(ready[0][1]) == batch_key):
+                        batch.append(heappop(ready)[1])
+
+                for obj_info in batch:
+                    self._dirty.pop(obj_info, None)
+                try:
+                    self._flush_batch(batch)
+                except:
+                    # Objects which didn't get to the database are still
+                    # pending, and must stay dirty so that rollback()
+                    # detaches or restores them.
+                    for obj_info in batch:
+                        if "pending" in obj_info:
+                            self._dirty[obj_info] = obj_info.get_obj()
+                    raise
+
+                for obj_info in batch:
+                    for after_info in successors.get(obj_info, ()):
+                        n = pending[after_info] - 1
+                        if n:
+                            pending[after_info] = n
+                        else:
+                            del pending[after_info]
+                            heappush(ready, (after_info["sequence"],
+                                             after_info))
+
+            if pending:
+                objects = [obj_info.get_obj()
+                           for obj_info in self._find_order_loop(pending)]
+                raise OrderLoopError("Can't flush due to ordering loop: %s"
+                                     % ", ".join(map(repr, objects)),
+                                     objects)
 
+        if target_info is None:
+            self._order.clear()
+
+            # That's not stricly necessary, but prevents getting into
+            # bigints.
+            self._sequence = 0
+
+    def _get_flush_targets(self, obj_info):
+        """Return the dirty objects which must be flushed to write C{obj_info}.
+
+        These are C{obj_info} itself, if it's dirty, and the dirty objects
+        which must be flushed before it, directly or through other dirty
+        objects.
+        """
+        predecessors = {}
+        for (before_info, after_info), n in self._order.iteritems():
+            if n > 0 and before_info in self._dirty:
+                before_list = predecessors.get(after_info)
+                if before_list is None:
+                    predecessors[after_info] = [before_info]
+                else:
+                    before_list.append(before_info)
+
+        targets = set()
+        if obj_info in self._dirty:
+            targets.add(obj_info)
+        stack = [obj_info]
+        while stack:
+            for before_info in predecessors.get(stack.pop(), ()):
+                if before_info not in targets:
+                    targets.add(before_info)
+                    stack.append(before_info)
+        return targets
+
+    def _find_order_loop(self, pending):
+        """Find a loop in the flush order constraints between objects.
+
+        @param pending: Objects which couldn't be flushed because other
+            objects in C{pending} must be flushed before them.
+        @return: A list with the objects of one loop, each of which must
+            be flushed before the next one, and the last one before the
+            first one.
+        """
         predecessors = {}
         for (before_info, after_info), n in self._order.iteritems():
-            if n > 0:
-                before_set = predecessors.get(after_info)
-                if before_set is None:
-                    predecessors[after_info] = set((before_info,))
+            if n > 0 and before_info in pending and after_info in pending:
+                before_list = predecessors.get(after_info)
+                if before_list is None:
+                    predecessors[after_info] = [before_info]
                 else:
-                    before_set.add(before_info)
+                    before_list.append(before_info)
 
+        # Every pending object has a pending predecessor, so walking
+        # backwards from any of them must eventually revisit one.
         key_func = itemgetter("sequence")
+        obj_info = min(pending, key=key_func)
+        path = []
+        positions = {}
+        while obj_info not in positions:
+            positions[obj_info] = len(path)
+            path.append(obj_info)
+            obj_info = min(predecessors[obj_info], key=key_func)
+        loop = path[positions[obj_info]:]
+        loop.reverse()
+        # Start with the earliest dirtied object, for a stable report.
+        first = loop.index(min(loop, key=key_func))
+        return loop[first:] + loop[:first]
+
+    def _get_batch_key(self, obj_info):
+        """Return a key identifying objects which may be flushed together.
+
+        Consecutive objects ready to be flushed which have the same key
+        are handed to L{_flush_batch} at once.
+
+        @return: A hashable key, or None if the object must be flushed
+            on its own.
+        """
+        if obj_info.get("pending") is PENDING_ADD:
+            # The key must match the columns _get_changes_map() will
+            # return when adding the object.
+            signature = []
+            for column in obj_info.cls_info.columns:
+                variable = obj_info.variables[column]
+                signature.append(variable.is_defined() or
+                                 isinstance(variable.get_lazy(), Expr))
+            if True in signature:
+                return (PENDING_ADD, obj_info.cls_info, tuple(signature))
+        elif obj_info.get("pending") is PENDING_REMOVE:
+            return (PENDING_REMOVE, obj_info.cls_info)
+        elif "pending" not in obj_info:
+            # The key must match the columns _get_changes_map() will
+            # return when updating the object.  Expressions must be
+            # resolved after the update, so those aren't batched.
+            signature = []
+            for column in obj_info.cls_info.columns:
+                variable = obj_info.variables[column]
+                if variable.has_changed():
+                    if variable.is_defined():
+                        signature.append(True)
+                        continue
+                    if isinstance(variable.get_lazy(), Expr):
+                        return None
+                signature.append(False)
+            if True in signature:
+                return (None, obj_info.cls_info, tuple(signature))
+        return None
 
-        # The external loop is important because items can get into the dirty
-        # state while we're flushing objects, ...
-        while self._dirty:
-            # ... but we don't have to resort everytime an object is flushed,
-            # so we have an internal loop too.  If no objects become dirty
-            # during flush, this will clean self._dirty and the external loop
-            # will exit too.
-            sorted_dirty = sorted(self._dirty, key=key_func)
-            while sorted_dirty:
-                for i, obj_info in enumerate(sorted_dirty):
-                    for before_info in predecessors.get(obj_info, ()):
-                        if before_info in self._dirty:
-                            break # A predecessor is still dirty.
-                    else:
-                        break # Found an item without dirty predecessors.
-                else:
-                    raise OrderLoopError("Can't flush due to ordering loop")
-                del sorted_dirty[i]
-                self._dirty.pop(obj_info, None)
+    def _flush_batch(self, obj_infos):
+        """Flush objects sharing the same L{_get_batch_key} at once."""
+        pending = obj_infos[0].get("pending")
+        # Batched updates always have changes, but a single object may
+        # be flushed without touching its row.
+        if (pending is None and len(obj_infos) == 1 and
+            not self._has_changes(obj_infos[0])):
+            self._flush_one(obj_infos[0])
+            return
+        self._set_written(obj_infos[0].cls_info)
+        track = self._track_changes
+        if track and pending is PENDING_REMOVE:
+            for obj_info in obj_infos:
+                self._add_change(obj_info, "deleted")
+        elif track and pending is None:
+            # The primary key may change.
+            for obj_info in obj_infos:
+                self._add_change(obj_info, "updated")
+        if len(obj_infos) == 1:
+            self._flush_one(obj_infos[0])
+        elif pending is PENDING_REMOVE:
+            self._flush_removed(obj_infos)
+        elif pending is PENDING_ADD:
+            self._flush_added(obj_infos)
+        else:
+            self._flush_changed(obj_infos)
+        if track and pending is PENDING_ADD:
+            for obj_info in obj_infos:
+                self._add_change(obj_info, "inserted")
+        elif track and pending is None:
+            for obj_info in obj_infos:
+                self._add_change(obj_info, "updated")
+
+    def _has_changes(self, obj_info):
+        """Tell whether flushing an updated object will change its row.
+
+        The columns considered are those L{_get_changes_map} returns.
+        """
+        for variable in obj_info.variables.itervalues():
+            if variable.has_changed() and (
+                variable.is_defined() or
+                isinstance(variable.get_lazy(), Expr)):
+                return True
+        return False
+
+    def _flush_changed(self, obj_infos):
+        """Update several objects with changes in the same columns.
+
+        The UPDATE statement is compiled once, for the first object, and
+        then executed with the values of every object at once by
+        L{Connection.execute_many}.  If the compiled statement doesn't
+        map one parameter to each changed column and primary key
+        column, the objects are updated one at a time instead.
+        """
+        first_info = obj_infos[0]
+        cls_info = first_info.cls_info
+        primary_key = cls_info.primary_key
+        changes = self._get_changes_map(first_info)
+        expr = Update(changes,
+                      compare_columns(primary_key, first_info["primary_vars"]),
+                      cls_info.table)
+        state = State()
+        statement = self._connection.compile(expr, state)
+
+        # Find out which value each parameter of the statement refers to.
+        slots = {}
+        for column, variable in changes.iteritems():
+            slots[id(variable)] = (True, column)
+        for i, variable in enumerate(first_info["primary_vars"]):
+            slots[id(variable)] = (False, i)
+        params_slots = [slots.get(id(param)) for param in state.parameters]
+        if (len(params_slots) != len(slots) or None in params_slots or
+            len(set(map(id, state.parameters))) != len(slots)):
+            for obj_info in obj_infos:
                 self._flush_one(obj_info)
+            return
 
-        self._order.clear()
+        params_list = []
+        for obj_info in obj_infos:
+            variables = obj_info.variables
+            primary_vars = obj_info["primary_vars"]
+            params = []
+            for is_column, key in params_slots:
+                if is_column:
+                    params.append(variables[key])
+                else:
+                    params.append(primary_vars[key])
+            params_list.append(params)
+        self._connection.execute_many(statement, params_list)
 
-        # That's not stricly necessary, but prevents getting into bigints.
-        self._sequence = 0
+        for obj_info in obj_infos:
+            self._fill_missing_values(obj_info, obj_info.primary_vars)
+            self._add_to_alive(obj_info)
+            self._run_hook(obj_info, "__storm_flushed__")
+            obj_info.event.emit("flushed")
 
-    def _flush_one(self, obj_info):
-        cls_info = obj_info.cls_info
+    def _flush_removed(self, obj_infos):
+        """Delete several removed objects of the same class.
 
-        pending = obj_info.pop("pending", None)
+        The rows are deleted in chunks, matching their primary keys
+        with L{compare_columns_in}.
+        """
+        cls_info = obj_infos[0].cls_info
+        primary_key = cls_info.primary_key
+        step = max(1, self._batch_parameters // len(primary_key))
+        for start in xrange(0, len(obj_infos), step):
+            chunk = obj_infos[start:start+step]
+            where = compare_columns_in(
+                primary_key, [obj_info["primary_vars"] for obj_info in chunk])
+            self._connection.execute(Delete(where, cls_info.table),
+                                     noresult=True)
+        for obj_info in obj_infos:
+            del obj_info["pending"]
+            self._finish_remove(obj_info)
+            self._run_hook(obj_info, "__storm_flushed__")
+            obj_info.event.emit("flushed")
 
-        if pending is PENDING_REMOVE:
-            expr = Delete(compare_columns(cls_info.primary_key,
-                                          obj_info["primary_vars"]),
-                          cls_info.table)
-            self._connection.execute(expr, noresult=True)
+    def _finish_remove(self, obj_info):
+        """Stop tracking an object which was just deleted."""
+        # We're sure the cache is valid at this point.
+        obj_info.pop("invalidated", None)
 
-            # We're sure the cache is valid at this point.
-            obj_info.pop("invalidated", None)
+        self._disable_change_notification(obj_info)
+        self._remove_from_alive(obj_info)
+        del obj_info["store"]
 
-            self._disable_change_notification(obj_info)
-            self._remove_from_alive(obj_info)
-            del obj_info["store"]
+    def _flush_added(self, obj_infos):
+        """Insert several pending objects of the same class.
 
-        elif pending is PENDING_ADD:
+        Consecutive objects with values for the same set of columns,
+        including all the columns of their primary key, are sent in
+        multi-row INSERT statements.  Other objects are inserted one at
+        a time, so that the backend may tell their primary key.
+        """
+        cls_info = obj_infos[0].cls_info
 
-            # Give a chance to the backend to process primary variables.
-            self._connection.preset_primary_key(cls_info.primary_key,
-                                                obj_info.primary_vars)
+        rows = []
+        for obj_info in obj_infos:
+            changes = self._prepare_insert(obj_info)
+            columns = tuple(i for i, column in enumerate(cls_info.columns)
+                            if column in changes)
+            primary_known = True
+            for variable in obj_info.primary_vars:
+                if not variable.is_defined():
+                    primary_known = False
+                    break
+            rows.append(((columns, primary_known), obj_info, changes))
+
+        for (columns, primary_known), group in groupby(rows, itemgetter(0)):
+            group = [(obj_info, changes) for key, obj_info, changes in group]
+            if len(group) == 1 or not columns or not primary_known:
+                for obj_info, changes in group:
+                    self._insert_one(obj_info, changes)
+            else:
+                columns = [cls_info.columns[i] for i in columns]
+                self._insert_many(cls_info, columns, group)
 
-            changes = self._get_changes_map(obj_info, True)
+        for obj_info in obj_infos:
+            self._run_hook(obj_info, "__storm_flushed__")
+            obj_info.event.emit("flushed")
 
-            expr = Insert(changes, cls_info.table,
-                          primary_columns=cls_info.primary_key,
-                          primary_variables=obj_info.primary_vars)
+    def _insert_many(self, cls_info, columns, rows):
+        """Insert rows for objects with values for the same columns.
 
-            result = self._connection.execute(expr)
+        @param cls_info: The L{ClassInfo} shared by all objects.
+        @param columns: The columns inserted for every object, which
+            include the primary key.
+        @param rows: A list of C{(obj_info, changes)} pairs, as returned
+            by L{_prepare_insert}.
+        """
+        step = max(1, self._batch_parameters // len(columns))
+        for start in xrange(0, len(rows), step):
+            chunk = rows[start:start+step]
+            values = [tuple(changes[column] for column in columns)
+                      for obj_info, changes in chunk]
+            expr = Insert(columns, cls_info.table, values=values)
+            self._connection.execute(expr, noresult=True)
+            for obj_info, changes in chunk:
+                self._finish_insert(obj_info)
+
+    def _prepare_insert(self, obj_info):
+        """Return the changes map to be used when inserting an object."""
+        # Give a chance to the backend to process primary variables.
+        self._connection.preset_primary_key(obj_info.cls_info.primary_key,
+                                            obj_info.primary_vars)
+        return self._get_changes_map(obj_info, True)
+
+    def _insert_one(self, obj_info, changes):
+        """Insert a single object with the given changes map."""
+        cls_info = obj_info.cls_info
+        expr = Insert(changes, cls_info.table,
+                      primary_columns=cls_info.primary_key,
+                      primary_variables=obj_info.primary_vars)
+        result = self._connection.execute(expr)
+        self._finish_insert(obj_info, result)
+
+    def _finish_insert(self, obj_info, result=None):
+        """Start tracking an object which was just inserted."""
+        # We're sure the cache is valid at this point. We just added
+        # the object.
+        obj_info.pop("invalidated", None)
+        obj_info.pop("pending", None)
 
-            # We're sure the cache is valid at this point. We just added
-            # the object.
-            obj_info.pop("invalidated", None)
+        self._fill_missing_values(obj_info, obj_info.primary_vars, result)
 
-            self._fill_missing_values(obj_info, obj_info.primary_vars, result)
+        self._enable_change_notification(obj_info)
+        self._add_to_alive(obj_info)
 
-            self._enable_change_notification(obj_info)
-            self._add_to_alive(obj_info)
+    def _flush_one(self, obj_info):
+        cls_info = obj_info.cls_info
+
+        pending = obj_info.pop("pending", None)
+
+        if pending is PENDING_REMOVE:
+            expr = Delete(compare_columns(cls_info.primary_key,
+                                          obj_info["primary_vars"]),
+                          cls_info.table)
+            self._connection.execute(expr, noresult=True)
+            self._finish_remove(obj_info)
+
+        elif pending is PENDING_ADD:
+            self._insert_one(obj_info, self._prepare_insert(obj_info))
         else:
             cached_primary_vars = obj_info["primary_vars"]
 
@@ -565,6 +1436,101 @@ class Store(object):
 
         obj_info.event.emit("flushed")
 
+    def _set_written(self, cls_info):
+        """Note that the table of a class is written to in this transaction.
+
+        Rows of the table are dropped from the row cache, and it isn't
+        used for any class mapped to the table until the transaction
+        ends, so that neither this store nor others get rows which don't
+        match what this store sees in the database.  Tables cached for
+        some time aren't kept across a rollback either.
+        """
+        table = cls_info.table_key
+        if table not in self._written:
+            self._written.add(table)
+            if self._row_cache is not None:
+                self._row_cache.remove_table(table)
+
+    def _add_change(self, obj_info, kind):
+        """Note that the row of an object was changed by this transaction.
+        """
+        key = (obj_info.cls_info.table_key,
+               tuple(var.get(to_db=True) for var in obj_info["primary_vars"]))
+        old_kind = self._changes.get(key)
+        if old_kind == "inserted":
+            if kind == "deleted":
+                # The row was never committed.
+                del self._changes[key]
+            return
+        if old_kind == "deleted" and kind == "inserted":
+            kind = "updated"
+        self._changes[key] = kind
+
+    def _get_change_set(self):
+        """Return the changes of this transaction, and forget them."""
+        rows = {"inserted": [], "updated": [], "deleted": []}
+        for key, kind in self._changes.iteritems():
+            rows[kind].append(key)
+        change_set = ChangeSet(rows["inserted"], rows["updated"],
+                               rows["deleted"], self._changed_tables,
+                               store=self)
+        self._changes.clear()
+        self._changed_tables.clear()
+        return change_set
+
+    def _receive_changes(self, change_set):
+        # Called by the invalidation bus, maybe from another thread, so
+        # the changes are only applied at the end of the transaction.
+        if change_set.store is not self:
+            self._received.append(change_set)
+
+    def _apply_received_changes(self):
+        """Drop what the store holds of the rows changed by peers.
+
+        If changes were lost, the whole row cache is dropped along with
+        everything the store holds.
+        """
+        if self._invalidation_bus is None:
+            return
+        try:
+            self._invalidation_bus.poll()
+        except Exception:
+            logger.exception("Error polling changes committed by peers")
+            self._received.append(ChangeSet(lost=True))
+        while self._received:
+            change_set = self._received.pop(0)
+            if change_set.lost:
+                if self._row_cache is not None:
+                    self._row_cache.clear()
+                self.invalidate()
+                continue
+            classes = self._get_classes_by_table()
+            for table, primary_values in change_set:
+                if self._row_cache is not None:
+                    self._row_cache.remove(table, primary_values)
+                for cls in classes.get(table, ()):
+                    self._cached_tables.pop(cls, None)
+                    obj_info = self._alive.get((cls, primary_values))
+                    if obj_info is not None:
+                        self._set_autoreload([obj_info], True)
+            for table in change_set.tables:
+                if self._row_cache is not None:
+                    self._row_cache.remove_table(table)
+                for cls in classes.get(table, ()):
+                    self._cached_tables.pop(cls, None)
+                    self._set_autoreload(self._iter_alive(get_cls_info(cls)),
+                                         True)
+
+    def _get_classes_by_table(self):
+        """Return the classes with alive objects or cached tables.
+
+        @return: A dict mapping table keys to sets of classes.
+        """
+        classes = {}
+        for cls in chain(self._alive_by_class, self._cached_tables):
+            classes.setdefault(get_cls_info(cls).table_key, set()).add(cls)
+        return classes
+
     def block_implicit_flushes(self):
         """Block implicit flushes from operations like execute()."""
         self._implicit_flush_block_count += 1
@@ -668,6 +1634,14 @@ class Store(object):
 
     def _validate_alive(self, obj_info):
         """Perform cache validation for the given obj_info."""
+        if self._validate_siblings:
+            cls_info = obj_info.cls_info
+            obj_infos = [obj_info]
+            obj_infos.extend(other for other in self._iter_alive(cls_info)
+                             if other is not obj_info)
+            if obj_info in self._validate_many(obj_infos):
+                raise LostObjectError("Object is not in the database anymore")
+            return
         where = compare_columns(obj_info.cls_info.primary_key,
                                 obj_info["primary_vars"])
         result = self._connection.execute(Select(SQLRaw("1"), where))
@@ -675,6 +1649,79 @@ class Store(object):
             raise LostObjectError("Object is not in the database anymore")
         obj_info.pop("invalidated", None)
 
+    def _validate_many(self, obj_infos):
+        """Perform cache validation for many obj_infos at once.
+
+        @return: A list of the obj_infos not in the database anymore,
+            which are left invalidated.
+        """
+        pending = {} # cls: (cls_info, {primary_values: obj_info})
+        for obj_info in obj_infos:
+            self._check_generation(obj_info)
+            primary_vars = obj_info.get("primary_vars")
+            if obj_info.get("invalidated") and primary_vars is not None:
+                cls_info = obj_info.cls_info
+                primary_values = tuple(var.get(to_db=True)
+                                       for var in primary_vars)
+                cls_pending = pending.get(cls_info.cls)
+                if cls_pending is None:
+                    cls_pending = pending[cls_info.cls] = (cls_info, {})
+                cls_pending[1][primary_values] = obj_info
+
+        lost = []
+        for cls_info, cls_pending in pending.itervalues():
+            primary_key = cls_info.primary_key
+            items = cls_pending.items()
+            step = max(1, self._batch_parameters // len(primary_key))
+            for start in xrange(0, len(items), step):
+                where = compare_columns_in(
+                    primary_key, [obj_info["primary_vars"]
+                                  for primary_values, obj_info
+                                  in items[start:start+step]])
+                result = self._connection.execute(Select(primary_key, where))
+                for values in result:
+                    primary_values = self._get_row_primary_values(
+                        primary_key, values)
+                    obj_info = cls_pending.pop(primary_values, None)
+                    if obj_info is not None:
+                        obj_info.pop("invalidated", None)
+            lost.extend(cls_pending.itervalues())
+        return lost
+
+    @staticmethod
+    def _get_row_primary_values(primary_key, values):
+        """Return the primary key of a row, as it's kept in the cache."""
+        primary_vars = [column.variable_factory(value=value, from_db=True)
+                        for column, value in zip(primary_key, values)]
+        return tuple(var.get(to_db=True) for var in primary_vars)
+
+    def _start_transaction(self, store):
+        """Note the version of the row cache as a transaction starts.
+
+        This is hooked to the "register-transaction" event, which is
+        emitted before statements are executed, until the first one of
+        the transaction.  Rows read in the transaction aren't added to
+        the row cache if their table was removed from it since then.
+        """
+        self._row_cache_version = self._row_cache.get_version()
+        return False
+
+    def _add_to_row_cache(self, cls_info, primary_values, result, values):
+        """Add a row loaded from the database to the row cache.
+
+        The row is kept with the database values of its columns, so that
+        the base L{Result} may set them into variables as they are.
+        """
+        row = []
+        for column, value in zip(cls_info.eager_columns, values):
+            if value is not None:
+                variable = column.variable_factory(column=column)
+                result.set_variable(variable, value)
+                value = variable.get(to_db=True)
+            row.append(value)
+        self._row_cache.add(cls_info.cls, primary_values, tuple(row),
+                            self._row_cache_version)
+
     def _load_object(self, cls_info, result, values):
         # _set_values() need the cls_info columns for the class of the
         # actual object, not from a possible wrapper (e.g. an alias).
@@ -683,7 +1730,7 @@ class Store(object):
 
         # Prepare cache key.
         primary_vars = []
-        columns = cls_info.columns
+        columns = cls_info.eager_columns
 
         for value in values:
             if value is not None:
@@ -694,7 +1741,7 @@ class Store(object):
             # rows are represented like that.
             return None
 
-        for i in cls_info.primary_key_pos:
+        for i in cls_info.eager_primary_key_pos:
             value = values[i]
             variable = columns[i].variable_factory(value=value, from_db=True)
             primary_vars.append(variable)
@@ -704,15 +1751,25 @@ class Store(object):
         obj_info = self._alive.get((cls, primary_values))
 
         if obj_info is not None:
+            self._check_generation(obj_info)
+
             # Found object in cache, and it must be valid since the
             # primary key was extracted from result values.
             obj_info.pop("invalidated", None)
 
             # Take that chance and fill up any undefined variables
             # with fresh data, since we got it anyway.
-            self._set_values(obj_info, cls_info.columns, result,
+            self._set_values(obj_info, columns, result,
                              values, keep_defined=True)
 
+            if (self._row_cache is not None and
+                cls_info.table_key not in self._written):
+                self._add_to_row_cache(cls_info, primary_values,
+                                       result, values)
+
+            if cls_info.unique_columns:
+                self._set_unique_keys(obj_info)
+
             # We're not sure if the obj is still in memory at this
             # point.  This will rebuild it if needed.
             obj = self._get_object(obj_info)
@@ -723,9 +1780,18 @@ class Store(object):
             obj_info = get_obj_info(obj)
             obj_info["store"] = self
 
-            self._set_values(obj_info, cls_info.columns, result, values,
+            self._set_values(obj_info, columns, result, values,
                              replace_unknown_lazy=True)
 
+            if (self._row_cache is not None and
+                cls_info.table_key not in self._written):
+                self._add_to_row_cache(cls_info, primary_values,
+                                       result, values)
+
+            # Lazy columns are loaded when touched.
+            for column in cls_info.lazy_columns:
+                obj_info.variables[column].set(AutoReload)
+
             self._add_to_alive(obj_info)
             self._enable_change_notification(obj_info)
             self._enable_lazy_resolving(obj_info)
@@ -742,12 +1808,13 @@ class Store(object):
             obj = cls.__new__(cls)
             obj_info.set_obj(obj)
             set_obj_info(obj, obj_info)
+            self._rebuilt += 1
             # Re-enable change notification, as it may have been implicitely
             # disabled when the previous object has been collected
             self._enable_change_notification(obj_info)
             self._run_hook(obj_info, "__storm_loaded__")
         # Renew the cache.
-        self._cache.add(obj_info)
+        self._get_cache(obj_info.cls_info).add(obj_info)
         return obj
 
     @staticmethod
@@ -830,8 +1897,48 @@ class Store(object):
         new_primary_values = tuple(
             var.get(to_db=True) for var in new_primary_vars)
         self._alive[cls_info.cls, new_primary_values] = obj_info
+        class_alive = self._alive_by_class.get(cls_info.cls)
+        if class_alive is None:
+            class_alive = self._alive_by_class[cls_info.cls] = \
+                WeakValueDictionary()
+        class_alive[id(obj_info)] = obj_info
         obj_info["primary_vars"] = new_primary_vars
-        self._cache.add(obj_info)
+        obj_info["generation"] = self._generation
+        if getattr(cls_info.cls, "__storm_invalidated__", None) is not None:
+            self._hooked[id(obj_info)] = obj_info
+        self._get_cache(cls_info).add(obj_info)
+        if self._missing:
+            self._missing.discard((cls_info.cls, new_primary_values))
+        if cls_info.unique_columns:
+            self._set_unique_keys(obj_info)
+        if cls_info.indexed_columns:
+            for column in cls_info.indexed_columns:
+                self._update_index(obj_info, column)
+        cached_table = self._cached_tables.get(cls_info.cls)
+        if cached_table is not None:
+            obj = obj_info.get_obj()
+            if obj is not None:
+                cached_table.objects[id(obj_info)] = obj
+
+    def _get_cache(self, cls_info):
+        """Return the cache holding recently used objects of a class."""
+        cls = cls_info.cls
+        cache = self._class_caches.get(cls, Undef)
+        if cache is Undef:
+            quota = self._cache_quotas.get(cls, cls_info.cache_quota)
+            cache = None
+            if quota is not None:
+                cache = Cache(quota)
+            self._class_caches[cls] = cache
+        if cache is None:
+            return self._cache
+        return cache
+
+    def _clear_caches(self):
+        self._cache.clear()
+        for cache in self._class_caches.itervalues():
+            if cache is not None:
+                cache.clear()
 
     def _remove_from_alive(self, obj_info):
         """Remove an object from the cache.
@@ -842,13 +1949,165 @@ class Store(object):
         """
         primary_vars = obj_info.get("primary_vars")
         if primary_vars is not None:
-            self._cache.remove(obj_info)
+            self._get_cache(obj_info.cls_info).remove(obj_info)
+            self._pinned.pop(obj_info, None)
             primary_values = tuple(var.get(to_db=True) for var in primary_vars)
             del self._alive[obj_info.cls_info.cls, primary_values]
+            del self._alive_by_class[obj_info.cls_info.cls][id(obj_info)]
             del obj_info["primary_vars"]
+            del obj_info["generation"]
+            self._hooked.pop(id(obj_info), None)
+            self._drop_unique_keys(obj_info)
+            cached_table = self._cached_tables.get(obj_info.cls_info.cls)
+            if cached_table is not None:
+                cached_table.objects.pop(id(obj_info), None)
+            index_values = obj_info.pop("index_values", None)
+            if index_values is not None:
+                index = self._indexes[obj_info.cls_info.cls]
+                for column in obj_info.cls_info.indexed_columns:
+                    index.remove(column, index_values[id(column)], obj_info)
+
+    def _set_unique_keys(self, obj_info):
+        """Index an object by the current values of its unique columns.
+
+        Like keys in the set of alive objects, these are only updated
+        when the object is loaded or flushed, so that they reflect the
+        values in the database.
+        """
+        self._drop_unique_keys(obj_info)
+        unique_keys = []
+        for column in obj_info.cls_info.unique_columns:
+            variable = obj_info.variables[column]
+            if variable.is_defined():
+                value = variable.get(to_db=True)
+                if value is not None:
+                    key = (id(column), value)
+                    self._unique[key] = obj_info
+                    unique_keys.append(key)
+        if unique_keys:
+            obj_info["unique_keys"] = unique_keys
+
+    def _drop_unique_keys(self, obj_info):
+        for key in obj_info.pop("unique_keys", ()):
+            if self._unique.get(key) is obj_info:
+                del self._unique[key]
+
+    def _update_index(self, obj_info, column):
+        """Index an object by the current value of the given column."""
+        cls = obj_info.cls_info.cls
+        index = self._indexes.get(cls)
+        if index is None:
+            index = self._indexes[cls] = _Index()
+        index_values = obj_info.setdefault("index_values", {})
+        if id(column) in index_values:
+            index.remove(column, index_values[id(column)], obj_info)
+        variable = obj_info.variables[column]
+        if variable.get_lazy() is not None or not variable.is_defined():
+            value = Undef
+        else:
+            value = variable.get()
+            try:
+                hash(value)
+            except TypeError:
+                value = Undef
+        index_values[id(column)] = value
+        index.add(column, value, obj_info)
+
+    def _find_indexed(self, cls_info, where):
+        """Return alive objects which may match the given where clause.
+
+        An equality on an indexed column is looked for in the where
+        clause, and the objects with the compared value are returned,
+        along with those with an unknown value.  None is returned if
+        the index can't be used.
+
+        Objects left behind by an invalidation are looked up by their
+        last known value, as going over all of them would make the first
+        lookup of every generation as slow as matching every object.
+        """
+        if isinstance(where, And):
+            exprs = where.exprs
+        else:
+            exprs = (where,)
+        for expr in exprs:
+            if type(expr) is not Eq:
+                continue
+            column, value = expr.expr1, expr.expr2
+            if isinstance(value, Column):
+                column, value = value, column
+            for indexed_column in cls_info.indexed_columns:
+                if column is indexed_column:
+                    break
+            else:
+                continue
+            if isinstance(value, Variable):
+                value = value.get()
+            elif isinstance(value, Expr):
+                continue
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            index = self._indexes.get(cls_info.cls)
+            if index is None:
+                return []
+            return [obj_info for obj_info in index.get(column, value)
+                    if obj_info.cls_info is cls_info]
+        return None
+
+    def _get_cached_table(self, cls_info):
+        """Return all the objects of a class with C{__storm_cache_all__}.
 
-    def _iter_alive(self):
-        return self._alive.values()
+        The table is loaded if it isn't cached yet, or if it expired.
+        None is returned if the class isn't fully cached.
+        """
+        if cls_info.cache_all is None:
+            return None
+        if get_cls_info(cls_info.cls) is not cls_info:
+            # A ClassAlias, whose objects are those of the original class.
+            return None
+        cached_table = self._cached_tables.get(cls_info.cls)
+        if cached_table is None or not cached_table.is_valid(
+                self._generation):
+            cached_table = _CachedTable(self._generation, cls_info.cache_all)
+            result = self._connection.execute(
+                Select(cls_info.eager_columns,
+                       default_tables=cls_info.table))
+            for values in result:
+                obj = self._load_object(cls_info, result, values)
+                cached_table.objects[id(get_obj_info(obj))] = obj
+            self._cached_tables[cls_info.cls] = cached_table
+        return cached_table.objects.values()
+
+    def _keep_cached_tables(self, cached_tables):
+        for cls, cached_table in cached_tables:
+            if cached_table.expires is not None:
+                self._keep_cached_table(cls, cached_table)
+
+    def _keep_cached_table(self, cls, cached_table):
+        """Keep a table cached for some time across a new generation."""
+        if not cached_table.is_valid(cached_table.generation):
+            return
+        obj_infos = [get_obj_info(obj)
+                     for obj in cached_table.objects.itervalues()]
+        for obj_info in obj_infos:
+            if obj_info.get("invalidated"):
+                # Invalidated right away, by an __storm_invalidated__ hook.
+                return
+        for obj_info in obj_infos:
+            obj_info["generation"] = self._generation
+        cached_table.generation = self._generation
+        self._cached_tables[cls] = cached_table
+
+    def _iter_alive(self, cls_info=None):
+        """Return the alive objects, optionally only those of cls_info."""
+        if cls_info is None:
+            return self._alive.values()
+        class_alive = self._alive_by_class.get(cls_info.cls)
+        if class_alive is None:
+            return []
+        return [obj_info for obj_info in class_alive.values()
+                if obj_info.cls_info is cls_info]
 
     def _enable_change_notification(self, obj_info):
         obj_info.event.emit("start-tracking-changes", self._event)
@@ -860,11 +2119,18 @@ class Store(object):
 
     def _variable_changed(self, obj_info, variable,
                           old_value, new_value, fromdb):
+        index_values = obj_info.get("index_values")
+        if (index_values is not None and
+            id(variable.column) in index_values):
+            self._update_index(obj_info, variable.column)
         # The fromdb check makes sure that values coming from the
         # database don't mark the object as dirty again.
         # XXX The fromdb check is untested. How to test it?
         if not fromdb:
             if new_value is not Undef and new_value is not AutoReload:
+                self._check_generation(obj_info, variable)
+                if self._prefetched_tables:
+                    self._outdate_prefetched(obj_info, variable.column)
                 if obj_info.get("invalidated"):
                     # This might be a previously alive object being
                     # updated.  Let's validate it now to improve debugging.
@@ -873,43 +2139,169 @@ class Store(object):
                 self._set_dirty(obj_info)
 
 
+    def _watch_prefetched(self, cls_info, columns):
+        """Return the generation of objects prefetched by some columns.
+
+        Reference sets keep the objects of C{cls_info} prefetched for
+        each local object along with the generation returned here, and
+        drop them once it changes.  That happens when an object of the
+        same table is added, or when one of the given columns changes in
+        such an object, since either may move it into a prefetched set.
+        """
+        watch = self._prefetched_tables.get(cls_info.table_key)
+        if watch is None:
+            watch = self._prefetched_tables[cls_info.table_key] = [0, set()]
+        watch[1].update(column.name for column in columns)
+        return watch[0]
+
+    def _get_prefetched_generation(self, cls_info):
+        watch = self._prefetched_tables.get(cls_info.table_key)
+        if watch is not None:
+            return watch[0]
+        return None
+
+    def _outdate_prefetched(self, obj_info, column=None):
+        """Outdate the sets which an added or changed object may join."""
+        watch = self._prefetched_tables.get(obj_info.cls_info.table_key)
+        if watch is not None and (column is None or column.name in watch[1]):
+            watch[0] += 1
+
+    def _check_generation(self, obj_info, changed_variable=None):
+        """Invalidate an object left behind by a store-wide invalidation.
+
+        @param changed_variable: A variable just changed, which must keep
+            its value.
+        """
+        generation = obj_info.get("generation")
+        if generation is not None and generation.stale:
+            obj_info["generation"] = self._generation
+            cls_info = obj_info.cls_info
+            for column in cls_info.columns:
+                variable = obj_info.variables[column]
+                if (variable is not changed_variable and
+                    id(column) not in cls_info.primary_key_idx):
+                    variable.set(AutoReload)
+            obj_info["invalidated"] = True
+            self._run_hook(obj_info, "__storm_invalidated__")
+
     def _enable_lazy_resolving(self, obj_info):
         obj_info.event.hook("resolve-lazy-value", self._resolve_lazy_value)
+        obj_info.event.hook("resolve-stale", self._check_generation)
 
     def _disable_lazy_resolving(self, obj_info):
         obj_info.event.unhook("resolve-lazy-value", self._resolve_lazy_value)
+        obj_info.event.unhook("resolve-stale", self._check_generation)
 
     def _resolve_lazy_value(self, obj_info, variable, lazy_value):
         """Resolve a variable set to a lazy value when it's touched.
 
         This method is hooked into the obj_info to resolve variables
         set to lazy values when they're accessed.  It will first flush
-        the store, and then set all variables set to AutoReload to
-        their database values.
+        the object and the ones it depends on, and then set all variables
+        set to AutoReload to their database values.  Variables of lazy
+        columns are only loaded along with the ones in the same lazy
+        group.  Siblings of the object get their eager columns set to
+        AutoReload loaded along with it, but never their lazy groups.
         """
         if lazy_value is not AutoReload and not isinstance(lazy_value, Expr):
             # It's not something we handle.
             return
 
-        # XXX This will do it for now, but it should really flush
-        #     just this single object and ones that it depends on.
-        #     _flush_one() doesn't consider dependencies, so it may
-        #     not be used directly.  Maybe allow flush(obj)?
         if self._implicit_flush_block_count == 0:
-            self.flush()
+            self.flush(obj_info.get_obj())
 
+        lazy_groups = obj_info.cls_info.lazy_groups
+        touched_group = lazy_groups.get(id(variable.column))
         autoreload_columns = []
         for column in obj_info.cls_info.columns:
             if obj_info.variables[column].get_lazy() is AutoReload:
-                autoreload_columns.append(column)
+                lazy_group = lazy_groups.get(id(column))
+                if lazy_group is None or lazy_group == touched_group:
+                    autoreload_columns.append(column)
 
-        if autoreload_columns:
-            where = compare_columns(obj_info.cls_info.primary_key,
-                                    obj_info["primary_vars"])
-            result = self._connection.execute(
-                Select(autoreload_columns, where))
-            self._set_values(obj_info, autoreload_columns,
-                             result, result.get_one())
+        if not autoreload_columns:
+            return
+
+        siblings = obj_info.get("siblings")
+        if siblings is not None:
+            # Lazy groups are only loaded for objects which touch them.
+            eager_columns = [column for column in autoreload_columns
+                             if id(column) not in lazy_groups]
+            if eager_columns:
+                obj_infos = self._get_reload_siblings(obj_info, siblings,
+                                                      eager_columns)
+                if obj_infos:
+                    obj_infos.insert(0, obj_info)
+                    self._reload_many(obj_infos, eager_columns)
+                    autoreload_columns = [column
+                                          for column in autoreload_columns
+                                          if id(column) in lazy_groups]
+                    if not autoreload_columns:
+                        return
+
+        where = compare_columns(obj_info.cls_info.primary_key,
+                                obj_info["primary_vars"])
+        result = self._connection.execute(
+            Select(autoreload_columns, where))
+        self._set_values(obj_info, autoreload_columns,
+                         result, result.get_one())
+
+    def _get_reload_siblings(self, obj_info, siblings, columns):
+        """Return the siblings of obj_info with the columns to reload.
+
+        Only clean siblings in this store with all the given columns set
+        to AutoReload qualify, once invalidated if they're stale.
+        """
+        cls_info = obj_info.cls_info
+        for column in columns:
+            if id(column) in cls_info.primary_key_idx:
+                return []
+        obj_infos = []
+        for other in siblings:
+            if (other is obj_info or other.cls_info is not cls_info or
+                other.get("store") is not self or
+                "primary_vars" not in other or other in self._dirty):
+                continue
+            self._check_generation(other)
+            variables = other.variables
+            for column in columns:
+                if variables[column].get_lazy() is not AutoReload:
+                    break
+            else:
+                obj_infos.append(other)
+        return obj_infos
+
+    def _reload_many(self, obj_infos, columns):
+        """Load the given columns of many objects of a class at once.
+
+        The first object must be in the database, but the others may be
+        gone, in which case they're left alone.
+        """
+        primary_key = obj_infos[0].cls_info.primary_key
+        select_columns = primary_key + tuple(columns)
+        found = False
+        step = max(1, self._batch_parameters // len(primary_key))
+        for start in xrange(0, len(obj_infos), step):
+            pending = {}
+            for obj_info in obj_infos[start:start+step]:
+                primary_values = tuple(var.get(to_db=True)
+                                       for var in obj_info["primary_vars"])
+                pending[primary_values] = obj_info
+            where = compare_columns_in(primary_key,
+                                       [obj_info["primary_vars"]
+                                        for obj_info in pending.itervalues()])
+            result = self._connection.execute(Select(select_columns, where))
+            for values in result:
+                obj_info = pending.pop(self._get_row_primary_values(
+                    primary_key, values), None)
+                if obj_info is not None:
+                    self._set_values(obj_info, columns, result,
+                                     values[len(primary_key):])
+                    if obj_info is obj_infos[0]:
+                        found = True
+        if not found:
+            raise LostObjectError("Can't obtain values from the database "
+                                  "(object got removed?)")
 
 
 class ResultSet(object):
@@ -936,6 +2328,7 @@ class ResultSet(object):
         self._distinct = False
         self._group_by = Undef
         self._having = Undef
+        self._prefetch = ()
 
     def copy(self):
         """Return a copy of this ResultSet object, with the same configuration.
@@ -985,15 +2378,187 @@ class ResultSet(object):
                       distinct=self._distinct, group_by=self._group_by,
                       having=self._having)
 
+    def prefetch(self, *references):
+        """Load the objects referenced by the objects found at once.
+
+        When objects are retrieved from this result set, the objects
+        they refer to through the given references are retrieved too,
+        with one query for each reference rather than one for each
+        object when the reference is first accessed::
+
+            for person in store.find(Person).prefetch(Person.owner,
+                                                      "owner.company"):
+                print person.owner.company.name
+
+        @param references: Reference properties of the classes being
+            found, or strings with the names of such properties in the
+            class being found.  Names may be separated by dots to follow
+            references from the objects found in the previous step.
+        @return: self (not a copy).
+        """
+        prefetch = list(self._prefetch)
+        for reference in references:
+            if isinstance(reference, basestring):
+                if self._find_spec.default_cls is None:
+                    raise FeatureError("Can't prefetch %r without a single "
+                                       "class being found" % reference)
+                prefetch.append(tuple(reference.split(".")))
+            else:
+                prefetch.append((reference,))
+        self._prefetch = tuple(prefetch)
+        return self
+
+    def _prefetch_objects(self, items):
+        """Prefetch the configured references for the given items."""
+        if self._find_spec.is_tuple:
+            objects = []
+            for item in items:
+                for (is_expr, info), obj in zip(
+                    self._find_spec._cls_spec_info, item):
+                    if not is_expr and obj is not None:
+                        objects.append(obj)
+        else:
+            objects = [obj for obj in items if obj is not None]
+
+        for path in self._prefetch:
+            current = objects
+            for reference in path:
+                # Group the objects by the property to prefetch for them.
+                props = {}
+                for obj in current:
+                    if isinstance(reference, basestring):
+                        cls = get_obj_info(obj).cls_info.cls
+                        prop = getattr(cls, reference)
+                    elif isinstance(obj, reference._cls):
+                        prop = reference
+                    else:
+                        continue
+                    if id(prop) in props:
+                        props[id(prop)][1].append(obj)
+                    else:
+                        props[id(prop)] = (prop, [obj])
+                remotes = {}
+                for prop, locals in props.itervalues():
+                    for remote in prop._prefetch(self._store, locals):
+                        remotes[get_obj_info(remote)] = remote
+                current = remotes.values()
+
     def _load_objects(self, result, values):
         return self._find_spec.load_objects(self._store, result, values)
 
+    def _find_cached_table(self, sliced=True):
+        """Return the objects found, if the query can be run in memory.
+
+        Queries for a single class with C{__storm_cache_all__} are run
+        against its cached table, unless they use expressions which
+        can't be evaluated in Python, or columns of other classes.
+
+        @param sliced: Whether to apply the offset and limit.
+        @return: The list of objects found, in order, or None if the
+            query must be run in the database.
+        """
+        cls_info = self._find_spec.default_cls_info
+        if (cls_info is None or cls_info.cache_all is None or
+            self._tables is not Undef or self._select is not Undef or
+            self._group_by is not Undef or
+            (self._distinct is not False and self._distinct is not True)):
+            return None
+
+        columns = {}
+        for column in cls_info.columns:
+            columns[id(column)] = column
+
+        if self._where is Undef:
+            match = None
+        else:
+            state = State()
+            try:
+                compile_python(self._where, state)
+            except CompileError:
+                return None
+            for parameter in state.parameters:
+                if (isinstance(parameter, Column) and
+                    id(parameter) not in columns):
+                    return None
+            match = compile_python.get_matcher(self._where)
+
+        order_by = []
+        if self._order_by is not Undef:
+            for expr in self._order_by:
+                reverse = isinstance(expr, Desc)
+                if reverse or isinstance(expr, Asc):
+                    expr = expr.expr
+                if id(expr) not in columns:
+                    return None
+                order_by.append((expr, reverse))
+
+        objects = self._store._get_cached_table(cls_info)
+        if objects is None:
+            return None
+        if match is not None:
+            def get_column(column):
+                return obj_info.variables[column].get()
+            matched = []
+            for obj in objects:
+                obj_info = get_obj_info(obj)
+                if match(get_column):
+                    matched.append(obj)
+            objects = matched
+        # Sort by the last column first, relying on the sort being stable.
+        for column, reverse in reversed(order_by):
+            def key(obj):
+                return get_obj_info(obj).variables[column].get()
+            objects.sort(key=key, reverse=reverse)
+        if sliced:
+            start = 0
+            if self._offset is not Undef:
+                start = self._offset
+            if self._limit is not Undef:
+                objects = objects[start:start+self._limit]
+            else:
+                objects = objects[start:]
+        return objects
+
+    def _load_one(self, result, values):
+        """Load a single item, prefetching its references if needed."""
+        item = self._load_objects(result, values)
+        if self._prefetch:
+            self._prefetch_objects([item])
+        return item
+
     def __iter__(self):
         """Iterate the results of the query.
         """
+        items = self._find_cached_table()
+        if items is not None:
+            if self._prefetch:
+                self._prefetch_objects(items)
+            for item in items:
+                yield item
+            return
         result = self._store._connection.execute(self._get_select())
+        if self._find_spec.default_cls_info is None:
+            items = (self._load_objects(result, values) for values in result)
+        else:
+            items = self._load_siblings(result)
+        if not self._prefetch:
+            for item in items:
+                yield item
+        else:
+            # All the objects must be known to prefetch their references.
+            items = list(items)
+            self._prefetch_objects(items)
+            for item in items:
+                yield item
+
+    def _load_siblings(self, result):
+        """Load objects from the result, remembering them as siblings."""
+        siblings = _Siblings()
         for values in result:
-            yield self._load_objects(result, values)
+            obj = self._load_objects(result, values)
+            if obj is not None:
+                siblings.add(get_obj_info(obj))
+            yield obj
 
     def __getitem__(self, index):
         """Get an individual item by offset, or a range of items by slice.
@@ -1067,6 +2632,9 @@ class ResultSet(object):
 
     def is_empty(self):
         """Return C{True} if this result set doesn't contain any results."""
+        items = self._find_cached_table()
+        if items is not None:
+            return not items
         subselect = self._get_select()
         subselect.limit = 1
         subselect.order_by = Undef
@@ -1080,13 +2648,16 @@ class ResultSet(object):
         @return: An arbitrary object or C{None} if one isn't available.
         @seealso: one(), first(), and last().
         """
+        items = self._find_cached_table()
+        if items is not None:
+            return self._get_one_cached(items)
         select = self._get_select()
         select.limit = 1
         select.order_by = Undef
         result = self._store._connection.execute(select)
         values = result.get_one()
         if values:
-            return self._load_objects(result, values)
+            return self._load_one(result, values)
         return None
 
     def _any(self):
@@ -1094,12 +2665,15 @@ class ResultSet(object):
 
         @return: An arbitrary object or C{None} if one isn't available.
         """
+        items = self._find_cached_table()
+        if items is not None:
+            return self._get_one_cached(items)
         select = self._get_select()
         select.limit = 1
         result = self._store._connection.execute(select)
         values = result.get_one()
         if values:
-            return self._load_objects(result, values)
+            return self._load_one(result, values)
         return None
 
     def first(self):
@@ -1126,6 +2700,9 @@ class ResultSet(object):
         if self._limit is not Undef:
             raise FeatureError("Can't use last() with a slice "
                                "of defined stop index")
+        items = self._find_cached_table(sliced=False)
+        if items is not None:
+            return self._get_one_cached(items[-1:])
         select = self._get_select()
         select.offset = Undef
         select.limit = 1
@@ -1140,7 +2717,7 @@ class ResultSet(object):
         result = self._store._connection.execute(select)
         values = result.get_one()
         if values:
-            return self._load_objects(result, values)
+            return self._load_one(result, values)
         return None
 
     def one(self):
@@ -1151,6 +2728,12 @@ class ResultSet(object):
         @return: The object or C{None} if one isn't available.
         @seealso: first(), one(), and any().
         """
+        items = self._find_cached_table()
+        if items is not None:
+            if len(items) > 1:
+                raise NotOneError("one() used with more than one result "
+                                  "available")
+            return self._get_one_cached(items)
         select = self._get_select()
         # limit could be 1 due to slicing, for instance.
         if select.limit is not Undef and select.limit > 2:
@@ -1160,9 +2743,17 @@ class ResultSet(object):
         if result.get_one():
             raise NotOneError("one() used with more than one result available")
         if values:
-            return self._load_objects(result, values)
+            return self._load_one(result, values)
         return None
 
+    def _get_one_cached(self, items):
+        """Return the first of the items found in memory, or None."""
+        if not items:
+            return None
+        if self._prefetch:
+            self._prefetch_objects(items[:1])
+        return items[0]
+
     def order_by(self, *args):
         """Specify the ordering of the results.
 
@@ -1195,6 +2786,11 @@ class ResultSet(object):
         if self._select is not Undef:
             raise FeatureError("Removing isn't supported with "
                                "set expressions (unions, etc)")
+        self._store._cached_tables.pop(self._find_spec.default_cls, None)
+        self._store._set_written(self._find_spec.default_cls_info)
+        if self._store._track_changes:
+            self._store._changed_tables.add(
+                self._find_spec.default_cls_info.table_key)
         result = self._store._connection.execute(
             Delete(self._where, self._find_spec.default_cls_info.table))
         return result.rowcount
@@ -1257,6 +2853,10 @@ class ResultSet(object):
 
     def count(self, expr=Undef, distinct=False):
         """Get the number of objects represented by this ResultSet."""
+        if expr is Undef and not distinct:
+            items = self._find_cached_table()
+            if items is not None:
+                return len(items)
         return int(self._aggregate(lambda expr: Count(expr, distinct), expr))
 
     def max(self, expr):
@@ -1384,18 +2984,18 @@ class ResultSet(object):
         expr = Update(changes, self._where,
                       self._find_spec.default_cls_info.table)
         self._store.execute(expr, noresult=True)
+        self._store._set_written(self._find_spec.default_cls_info)
+        if self._store._track_changes:
+            self._store._changed_tables.add(
+                self._find_spec.default_cls_info.table_key)
 
         try:
             cached = self.cached()
         except CompileError:
-            # We are iterating through all objects in memory here, so
-            # check if the object type matches to avoid trying to
-            # invalidate a column that does not exist, on an unrelated
-            # object.
-            for obj_info in self._store._iter_alive():
-                if obj_info.cls_info is self._find_spec.default_cls_info:
-                    for column in changes:
-                        obj_info.variables[column].set(AutoReload)
+            cls_info = self._find_spec.default_cls_info
+            for obj_info in self._store._iter_alive(cls_info):
+                for column in changes:
+                    obj_info.variables[column].set(AutoReload)
         else:
             changes = changes.items()
             for obj in cached:
@@ -1432,10 +3032,16 @@ class ResultSet(object):
                 return obj_info.variables[column].get()
 
         objects = []
-        for obj_info in self._store._iter_alive():
+        cls_info = self._find_spec.default_cls_info
+        obj_infos = None
+        if match is not None and cls_info.indexed_columns:
+            obj_infos = self._store._find_indexed(cls_info, self._where)
+        if obj_infos is None:
+            obj_infos = self._store._iter_alive(cls_info)
+        for obj_info in obj_infos:
             try:
-                if (obj_info.cls_info is self._find_spec.default_cls_info and
-                    (match is None or match(get_column))):
+                self._store._check_generation(obj_info)
+                if match is None or match(get_column):
                     objects.append(self._store._get_object(obj_info))
             except LostObjectError:
                 pass # This may happen when resolving lazy values
@@ -1535,6 +3141,9 @@ class EmptyResultSet(object):
     def config(self, distinct=None, offset=None, limit=None):
         pass
 
+    def prefetch(self, *references):
+        return self
+
     def __iter__(self):
         return
         yield None
@@ -1697,7 +3306,7 @@ class FindSpec(object):
                 if isinstance(info, Column):
                     default_tables.append(info.table)
             else:
-                columns.extend(info.columns)
+                columns.extend(info.eager_columns)
                 default_tables.append(info.table)
         return columns, default_tables
 
@@ -1725,7 +3334,7 @@ class FindSpec(object):
                     value=values[values_start], from_db=True)
                 objects.append(variable.get())
             else:
-                values_end += len(info.columns)
+                values_end += len(info.eager_columns)
                 obj = store._load_object(info, result,
                                          values[values_start:values_end])
                 objects.append(obj)
@@ -42,6 +42,32 @@ class DebugTracer(object):
         self._stream.write("[%s] DONE\n" % time)
         self._stream.flush()
 
+    def connection_raw_execute_many(self, connection, raw_cursor, statement,
+                                    params_list):
+        time = datetime.now().isoformat()[11:]
+        raw_params_list = []
+        for params in params_list:
+            raw_params = []
+            for param in params:
+                if isinstance(param, Variable):
+                    raw_params.append(param.get())
+                else:
+                    raw_params.append(param)
+            raw_params_list.append(tuple(raw_params))
+        self._stream.write(
+            "[%s] EXECUTE MANY: %r, %r\n" % (time, statement, raw_params_list))
+        self._stream.flush()
+
+    def connection_raw_execute_many_error(self, connection, raw_cursor,
+                                          statement, params_list, error):
+        self.connection_raw_execute_error(connection, raw_cursor, statement,
+                                          params_list, error)
+
+    def connection_raw_execute_many_success(self, connection, raw_cursor,
+                                            statement, params_list):
+        self.connection_raw_execute_success(connection, raw_cursor,
+                                            statement, params_list)
+
 
 class TimeoutTracer(object):
     """Provide a timeout facility for connections to prevent rogue operations.
@@ -87,6 +113,21 @@ class TimeoutTracer(object):
         raise NotImplementedError("%s.connection_raw_execute_error() must be "
                                   "implemented" % self.__class__.__name__)
 
+    def connection_raw_execute_many(self, connection, raw_cursor, statement,
+                                    params_list):
+        """Check timeout conditions before a statement is executed many times.
+
+        The whole batch shares the time budget of a single statement.
+        """
+        self.connection_raw_execute(connection, raw_cursor, statement,
+                                    params_list)
+
+    def connection_raw_execute_many_error(self, connection, raw_cursor,
+                                          statement, params_list, error):
+        """Raise TimeoutError if the given error was a timeout issue."""
+        self.connection_raw_execute_error(connection, raw_cursor, statement,
+                                          params_list, error)
+
     def set_statement_timeout(self, raw_cursor, remaining_time):
         """Perform the timeout setup in the raw cursor.
 
@@ -149,6 +190,12 @@ class BaseStatementTracer(object):
                     statement, query_params)
         self._expanded_raw_execute(connection, raw_cursor, statement_to_log)
 
+    def connection_raw_execute_many(self, connection, raw_cursor,
+                                    statement, params_list):
+        # Expanding every parameter set would produce one statement per
+        # row, so the batch is logged once with its parameter marks.
+        self._expanded_raw_execute(connection, raw_cursor, statement)
+
     def _expanded_raw_execute(self, connection, raw_cursor, statement):
         """Called by connection_raw_execute after parameter substitution."""
         raise NotImplementedError(self._expanded_raw_execute)
@@ -205,6 +252,16 @@ class TimelineTracer(BaseStatementTracer):
         self.connection_raw_execute_success(
             connection, raw_cursor, statement, params)
 
+    def connection_raw_execute_many_success(self, connection, raw_cursor,
+                                            statement, params_list):
+        self.connection_raw_execute_success(
+            connection, raw_cursor, statement, params_list)
+
+    def connection_raw_execute_many_error(self, connection, raw_cursor,
+                                          statement, params_list, error):
+        self.connection_raw_execute_success(
+            connection, raw_cursor, statement, params_list)
+
 
 _tracers = []
 
@@ -1,8 +1,9 @@
 from unittest import defaultTestLoader
 
-from storm.properties import Int
+from storm.properties import Int, Pickle
 from storm.info import get_obj_info
-from storm.cache import Cache, GenerationalCache
+from storm.cache import (
+    Cache, GenerationalCache, TwoQueueCache, MemoryCache, RowCache)
 
 from tests.helper import TestHelper
 
@@ -16,6 +17,9 @@ class StubObjectInfo(object):
     def get_obj(self):
         return str(self.id)
 
+    def get(self, key, default=None):
+        return default
+
     def __repr__(self):
         return "%s(%s)" % (self.__class__.__name__, self.id)
 
@@ -34,6 +38,32 @@ class StubClass(object):
     id = Int(primary=True)
 
 
+class OtherStubClass(object):
+
+    __storm_table__ = "other_stub_class"
+
+    id = Int(primary=True)
+
+
+class SameTableStubClass(object):
+
+    __storm_table__ = "stub_class"
+
+    id = Int(primary=True)
+
+
+class StubDataClass(object):
+
+    __storm_table__ = "stub_data_class"
+
+    id = Int(primary=True)
+    data = Pickle()
+
+    def __init__(self, id, data=None):
+        self.id = id
+        self.data = data
+
+
 class BaseCacheTest(TestHelper):
 
     Cache = Cache
@@ -128,6 +158,17 @@ class BaseCacheTest(TestHelper):
         cache.set_size(0)
         self.assertEquals(cache.get_cached(), [])
 
+    def test_get_stats(self):
+        cache = self.Cache(5)
+        for obj_info in self.obj_infos[:3]:
+            cache.add(obj_info)
+        cache.add(self.obj_infos[0])
+        stats = cache.get_stats()
+        self.assertEquals(stats["size"], 3)
+        self.assertEquals(stats["promotions"], 1)
+        self.assertEquals(stats["insertions"], 3)
+        self.assertEquals(stats["evictions"], 0)
+
     def test_fit_size(self):
         """
         A cache of size n can hold at least n objects.
@@ -189,6 +230,57 @@ class CacheTest(BaseCacheTest):
         self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
                           [5, 4, 3, 2, 1, 0, 9, 8, 7, 6])
 
+    def test_add_existing_becomes_most_recent(self):
+        cache = Cache(5)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        cache.add(self.obj_infos[2])
+        cache.add(self.obj_infos[4])
+        cache.add(self.obj_infos[0])
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [0, 4, 2, 3, 1])
+
+        # The least recently used entry is dropped first.
+        cache.add(self.obj_infos[5])
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [5, 0, 4, 2, 3])
+
+    def test_remove_keeps_order(self):
+        cache = Cache(5)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        self.assertEquals(cache.remove(self.obj_infos[4]), True)
+        self.assertEquals(cache.remove(self.obj_infos[2]), True)
+        self.assertEquals(cache.remove(self.obj_infos[0]), True)
+        self.assertEquals(cache.remove(self.obj_infos[0]), False)
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [3, 1])
+        for obj_info in self.obj_infos[5:]:
+            cache.add(obj_info)
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [9, 8, 7, 6, 5])
+
+    def test_get_stats_evictions(self):
+        cache = Cache(5)
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        self.assertEquals(cache.get_stats()["evictions"], 5)
+        cache.set_size(2)
+        self.assertEquals(cache.get_stats()["evictions"], 8)
+        cache.set_size(0)
+        self.assertEquals(cache.get_stats(),
+                          {"size": 0, "promotions": 0, "insertions": 10,
+                           "evictions": 10})
+
+    def test_add_after_clear(self):
+        cache = Cache(5)
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        cache.clear()
+        cache.add(self.obj1)
+        cache.add(self.obj2)
+        self.assertEquals(cache.get_cached(), [self.obj2, self.obj1])
+
 
 class TestGenerationalCache(BaseCacheTest):
 
@@ -381,5 +473,387 @@ class TestGenerationalCache(BaseCacheTest):
         self.assertEqual(sorted(cache.get_cached()), [self.obj1, self.obj3])
 
 
+    def test_get_stats_evictions(self):
+        cache = GenerationalCache(2)
+        for obj_info in [self.obj1, self.obj2, self.obj3, self.obj1]:
+            cache.add(obj_info)
+        self.assertEquals(cache.get_stats()["evictions"], 0)
+        cache.add(self.obj4)
+        self.assertEquals(cache.get_stats(),
+                          {"size": 3, "promotions": 1, "insertions": 4,
+                           "evictions": 1})
+
+    def test_get_stats_size_with_overlap(self):
+        cache = GenerationalCache(2)
+        for obj_info in [self.obj1, self.obj2, self.obj3, self.obj1]:
+            cache.add(obj_info)
+        self.assertEquals(cache.get_stats()["size"], 3)
+        cache.remove(self.obj1)
+        self.assertEquals(cache.get_stats()["size"], 2)
+        cache.set_size(1)
+        self.assertEquals(cache.get_stats()["size"], 1)
+        self.assertEquals(cache.get_stats()["evictions"], 1)
+
+
+class TwoQueueCacheTest(BaseCacheTest):
+
+    Cache = TwoQueueCache
+
+    def get_cached_ids(self, cache):
+        return [obj_info.id for obj_info in cache.get_cached()]
+
+    def test_probation_is_fifo(self):
+        cache = TwoQueueCache(4)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        self.assertEquals(self.get_cached_ids(cache), [4, 3, 2, 1])
+
+    def test_add_existing_promotes(self):
+        cache = TwoQueueCache(4)
+        cache.add(self.obj1)
+        cache.add(self.obj2)
+        cache.add(self.obj1)
+        self.assertEquals(self.get_cached_ids(cache), [0, 1])
+
+    def test_scan_keeps_objects_added_again(self):
+        cache = TwoQueueCache(4)
+        cache.add(self.obj1)
+        cache.add(self.obj1)
+        cache.add(self.obj2)
+        cache.add(self.obj2)
+        for obj_info in self.obj_infos[2:]:
+            cache.add(obj_info)
+        self.assertEquals(self.get_cached_ids(cache), [1, 0, 9, 8])
+
+    def test_main_is_lru(self):
+        cache = TwoQueueCache(4)
+        for obj_info in [self.obj1, self.obj2, self.obj3, self.obj1,
+                         self.obj4]:
+            cache.add(obj_info)
+            cache.add(obj_info)
+        self.assertEquals(self.get_cached_ids(cache), [3, 0, 2, 1])
+        cache.add(self.obj5)
+        cache.add(self.obj5)
+        self.assertEquals(self.get_cached_ids(cache), [4, 3, 0, 2])
+
+    def test_evicted_from_probation_promoted_when_added_again(self):
+        cache = TwoQueueCache(4)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        cache.add(self.obj1)
+        self.assertEquals(self.get_cached_ids(cache), [0, 4, 3, 2])
+
+    def test_evicted_from_probation_forgotten(self):
+        cache = TwoQueueCache(4, ghost_ratio=0.5)
+        for obj_info in self.obj_infos[:7]:
+            cache.add(obj_info)
+        # Only the last two objects evicted are remembered.
+        cache.add(self.obj1)
+        self.assertEquals(self.get_cached_ids(cache), [0, 6, 5, 4])
+        cache.add(self.obj3)
+        self.assertEquals(self.get_cached_ids(cache), [2, 0, 6, 5])
+
+    def test_evicted_from_probation_forgotten_on_clear(self):
+        cache = TwoQueueCache(4)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        cache.clear()
+        cache.add(self.obj1)
+        cache.add(self.obj2)
+        self.assertEquals(self.get_cached_ids(cache), [1, 0])
+
+    def test_get_stats_ghost_hits(self):
+        cache = TwoQueueCache(4)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        cache.add(self.obj1)
+        cache.add(self.obj1)
+        self.assertEquals(cache.get_stats(),
+                          {"size": 4, "probation_size": 3, "promotions": 1,
+                           "insertions": 6, "ghost_hits": 1,
+                           "evictions": 2})
+
+    def test_reduce_max_size(self):
+        cache = TwoQueueCache(4)
+        for obj_info in self.obj_infos[:4]:
+            cache.add(obj_info)
+            cache.add(obj_info)
+        cache.add(self.obj5)
+        cache.set_size(2)
+        self.assertEquals(self.get_cached_ids(cache), [3, 4])
+
+
+class MemoryCacheTest(TestHelper):
+
+    def setUp(self):
+        super(MemoryCacheTest, self).setUp()
+        self.objs = [StubDataClass(i, "x" * 1000) for i in range(10)]
+        self.obj_infos = [get_obj_info(obj) for obj in self.objs]
+        self.size = MemoryCache().estimate_size(self.obj_infos[0])
+
+    def get_cached_ids(self, cache):
+        return [obj_info.get_obj().id for obj_info in cache.get_cached()]
+
+    def test_initially_empty(self):
+        cache = MemoryCache()
+        self.assertEquals(cache.get_cached(), [])
+        self.assertEquals(cache.get_size(), 0)
+
+    def test_estimate_size(self):
+        cache = MemoryCache()
+        small_obj_info = get_obj_info(StubDataClass(1, "x"))
+        self.assertTrue(self.size > 1000)
+        self.assertTrue(cache.estimate_size(small_obj_info) < self.size)
+
+    def test_estimate_size_of_nested_values(self):
+        cache = MemoryCache()
+        obj_info = get_obj_info(StubDataClass(1, {"key": ["x" * 1000]}))
+        self.assertTrue(cache.estimate_size(obj_info) > 1000)
+
+    def test_estimate_size_of_recursive_value(self):
+        cache = MemoryCache()
+        value = ["x" * 1000]
+        value.append(value)
+        obj_info = get_obj_info(StubDataClass(1, value))
+        self.assertTrue(cache.estimate_size(obj_info) > 1000)
+
+    def test_estimate_size_with_estimator(self):
+        class Blob(object):
+            pass
+        def estimate_blob_size(value, estimate_size):
+            return 1000000 + estimate_size(["x"])
+        cache = MemoryCache(estimators={Blob: estimate_blob_size})
+        obj_info = get_obj_info(StubDataClass(1, Blob()))
+        self.assertTrue(cache.estimate_size(obj_info) > 1000000)
+
+    def test_add(self):
+        cache = MemoryCache()
+        cache.add(self.obj_infos[0])
+        cache.add(self.obj_infos[1])
+        self.assertEquals(self.get_cached_ids(cache), [1, 0])
+        self.assertEquals(cache.get_size(), self.size * 2)
+
+    def test_add_existing(self):
+        cache = MemoryCache()
+        for obj_info in self.obj_infos[:3]:
+            cache.add(obj_info)
+        cache.add(self.obj_infos[0])
+        self.assertEquals(self.get_cached_ids(cache), [0, 2, 1])
+        self.assertEquals(cache.get_size(), self.size * 3)
+
+    def test_add_existing_estimates_size_again(self):
+        cache = MemoryCache()
+        obj_info = self.obj_infos[0]
+        cache.add(obj_info)
+        obj_info.get_obj().data = "x" * 100000
+        cache.add(obj_info)
+        self.assertEquals(cache.get_size(), cache.estimate_size(obj_info))
+        self.assertTrue(cache.get_size() > 100000)
+
+    def test_add_existing_reuses_size_of_unchanged_object(self):
+        estimated = []
+        class CountingMemoryCache(MemoryCache):
+            def estimate_size(self, obj_info):
+                estimated.append(obj_info)
+                return MemoryCache.estimate_size(self, obj_info)
+        cache = CountingMemoryCache()
+        obj_info = self.obj_infos[0]
+        cache.add(obj_info)
+        cache.add(obj_info)
+        cache.add(obj_info)
+        self.assertEquals(estimated, [obj_info])
+        self.assertEquals(cache.get_size(), self.size)
+
+    def test_add_after_removal_estimates_size_again(self):
+        cache = MemoryCache()
+        obj_info = self.obj_infos[0]
+        cache.add(obj_info)
+        cache.remove(obj_info)
+        obj_info.get_obj().data = "x" * 100000
+        cache.add(obj_info)
+        self.assertEquals(cache.get_size(), cache.estimate_size(obj_info))
+
+    def test_evict_least_recently_used(self):
+        cache = MemoryCache(self.size * 3)
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        self.assertEquals(self.get_cached_ids(cache), [9, 8, 7])
+        self.assertEquals(cache.get_size(), self.size * 3)
+
+    def test_large_object_evicts_several(self):
+        cache = MemoryCache(self.size * 5)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        large_obj = StubDataClass(10, "x" * 3000)
+        cache.add(get_obj_info(large_obj))
+        self.assertEquals(self.get_cached_ids(cache), [10, 4, 3])
+
+    def test_object_larger_than_budget_not_kept(self):
+        cache = MemoryCache(self.size)
+        cache.add(get_obj_info(StubDataClass(10, "x" * 3000)))
+        self.assertEquals(cache.get_cached(), [])
+        self.assertEquals(cache.get_size(), 0)
+
+    def test_remove(self):
+        cache = MemoryCache()
+        for obj_info in self.obj_infos[:3]:
+            cache.add(obj_info)
+        self.assertEquals(cache.remove(self.obj_infos[1]), True)
+        self.assertEquals(cache.remove(self.obj_infos[1]), False)
+        self.assertEquals(self.get_cached_ids(cache), [2, 0])
+        self.assertEquals(cache.get_size(), self.size * 2)
+
+    def test_clear(self):
+        cache = MemoryCache()
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        cache.clear()
+        self.assertEquals(cache.get_cached(), [])
+        self.assertEquals(cache.get_size(), 0)
+        for obj_info in self.obj_infos:
+            self.assertEquals(cache.remove(obj_info), False)
+
+    def test_get_stats(self):
+        cache = MemoryCache(self.size * 3)
+        for obj_info in self.obj_infos[:4]:
+            cache.add(obj_info)
+        cache.add(self.obj_infos[3])
+        self.assertEquals(cache.get_stats(),
+                          {"size": 3, "bytes": self.size * 3,
+                           "promotions": 1, "insertions": 4,
+                           "evictions": 1})
+
+    def test_reduce_max_size(self):
+        cache = MemoryCache()
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        cache.set_size(self.size * 2)
+        self.assertEquals(self.get_cached_ids(cache), [9, 8])
+        cache.add(self.obj_infos[0])
+        self.assertEquals(self.get_cached_ids(cache), [0, 9])
+
+    def test_set_zero_size(self):
+        cache = MemoryCache()
+        cache.add(self.obj_infos[0])
+        cache.set_size(0)
+        self.assertEquals(cache.get_cached(), [])
+        cache.add(self.obj_infos[0])
+        self.assertEquals(cache.get_cached(), [])
+
+
+class RowCacheTest(TestHelper):
+
+    def test_add_and_get(self):
+        cache = RowCache()
+        self.assertEquals(cache.get(StubClass, (1,)), None)
+        cache.add(StubClass, (1,), (1, u"Title"))
+        self.assertEquals(cache.get(StubClass, (1,)), (1, u"Title"))
+        self.assertEquals(cache.get(StubClass, (2,)), None)
+        self.assertEquals(cache.get(OtherStubClass, (1,)), None)
+
+    def test_get_with_other_class_of_table(self):
+        cache = RowCache()
+        cache.add(StubClass, (1,), (1, u"Title"))
+        self.assertEquals(cache.get(SameTableStubClass, (1,)), None)
+        cache.add(SameTableStubClass, (1,), (1,))
+        self.assertEquals(cache.get(SameTableStubClass, (1,)), (1,))
+        self.assertEquals(cache.get(StubClass, (1,)), None)
+
+    def test_remove(self):
+        cache = RowCache()
+        cache.add(StubClass, (1,), (1,))
+        cache.add(StubClass, (2,), (2,))
+        cache.remove("stub_class", (1,))
+        self.assertEquals(cache.get(StubClass, (1,)), None)
+        self.assertEquals(cache.get(StubClass, (2,)), (2,))
+        cache.remove("stub_class", (1,))
+
+    def test_add_existing(self):
+        cache = RowCache()
+        cache.add(StubClass, (1,), (1, u"Title"))
+        size = cache.get_size()
+        cache.add(StubClass, (1,), (1, u"Other"))
+        self.assertEquals(cache.get(StubClass, (1,)), (1, u"Other"))
+        self.assertEquals(cache.get_size(), size)
+
+    def test_add_with_version(self):
+        cache = RowCache()
+        version = cache.get_version()
+        cache.add(StubClass, (1,), (1,), version)
+        self.assertEquals(cache.get(StubClass, (1,)), (1,))
+        cache.add(OtherStubClass, (1,), (1,))
+        cache.remove("other_stub_class", (2,))
+        cache.add(StubClass, (2,), (2,), version)
+        self.assertEquals(cache.get(StubClass, (2,)), (2,))
+
+    def test_add_with_version_before_remove(self):
+        cache = RowCache()
+        version = cache.get_version()
+        cache.remove("stub_class", (2,))
+        cache.add(StubClass, (1,), (1,), version)
+        self.assertEquals(cache.get(StubClass, (1,)), None)
+        cache.add(StubClass, (1,), (1,), cache.get_version())
+        self.assertEquals(cache.get(StubClass, (1,)), (1,))
+
+    def test_add_with_version_before_remove_table(self):
+        cache = RowCache()
+        version = cache.get_version()
+        cache.remove_table("stub_class")
+        cache.add(SameTableStubClass, (1,), (1,), version)
+        self.assertEquals(cache.get(SameTableStubClass, (1,)), None)
+
+    def test_remove_table(self):
+        cache = RowCache()
+        cache.add(StubClass, (1,), (1,))
+        cache.add(SameTableStubClass, (2,), (2,))
+        cache.add(OtherStubClass, (1,), (1,))
+        cache.remove_table("stub_class")
+        self.assertEquals(cache.get(StubClass, (1,)), None)
+        self.assertEquals(cache.get(SameTableStubClass, (2,)), None)
+        self.assertEquals(cache.get(OtherStubClass, (1,)), (1,))
+        cache.remove_table("stub_class")
+
+    def test_clear(self):
+        cache = RowCache()
+        cache.add(StubClass, (1,), (1,))
+        cache.clear()
+        self.assertEquals(cache.get(StubClass, (1,)), None)
+        self.assertEquals(cache.get_size(), 0)
+
+    def test_size(self):
+        cache = RowCache()
+        self.assertEquals(cache.get_size(), 0)
+        cache.add(StubClass, (1,), (1,))
+        self.assertTrue(cache.get_size() > 0)
+        cache.remove_table("stub_class")
+        self.assertEquals(cache.get_size(), 0)
+
+    def test_evict_least_recently_used(self):
+        cache = RowCache()
+        cache.add(StubClass, (1,), (1,))
+        cache = RowCache(cache.get_size() * 2)
+        cache.add(StubClass, (1,), (1,))
+        cache.add(StubClass, (2,), (2,))
+        cache.get(StubClass, (1,))
+        cache.add(StubClass, (3,), (3,))
+        self.assertEquals(cache.get(StubClass, (1,)), (1,))
+        self.assertEquals(cache.get(StubClass, (2,)), None)
+        self.assertEquals(cache.get(StubClass, (3,)), (3,))
+
+    def test_get_stats(self):
+        cache = RowCache()
+        cache.add(StubClass, (1,), (1,))
+        size = cache.get_size()
+        cache = RowCache(size * 2)
+        cache.add(StubClass, (1,), (1,))
+        cache.add(StubClass, (2,), (2,))
+        cache.add(StubClass, (3,), (3,))
+        cache.get(StubClass, (1,))
+        cache.get(StubClass, (3,))
+        self.assertEquals(cache.get_stats(),
+                          {"size": 2, "bytes": size * 2, "hits": 1,
+                           "misses": 1, "evictions": 1})
+
+
 def test_suite():
     return defaultTestLoader.loadTestsFromName(__name__)
@@ -76,6 +76,9 @@ class RawCursor(object):
     def execute(self, statement, params=marker):
         self.executed.append((statement, params))
 
+    def executemany(self, statement, params_list):
+        self.executed.append(("MANY", statement, params_list))
+
     def fetchone(self):
         if self._fetchone_data:
             return self._fetchone_data.pop(0)
@@ -118,6 +121,21 @@ class FakeTracer(object):
         self.seen.append(("ERROR", connection, type(raw_cursor),
                           statement, params, error))
 
+    def connection_raw_execute_many(self, connection, raw_cursor,
+                                    statement, params_list):
+        self.seen.append(("EXECUTE MANY", connection, type(raw_cursor),
+                          statement, params_list))
+
+    def connection_raw_execute_many_success(self, connection, raw_cursor,
+                                            statement, params_list):
+        self.seen.append(("SUCCESS MANY", connection, type(raw_cursor),
+                          statement, params_list))
+
+    def connection_raw_execute_many_error(self, connection, raw_cursor,
+                                          statement, params_list, error):
+        self.seen.append(("ERROR MANY", connection, type(raw_cursor),
+                          statement, params_list, error))
+
 
 class DatabaseTest(TestHelper):
 
@@ -175,6 +193,26 @@ class ConnectionTest(TestHelper):
         #                  [("'?' %s '?' %s '?'", marker),
         #                   ("$$?$$ %s $asd'?$asd$ %s '?'", marker)])
 
+    def test_execute_many(self):
+        result = self.connection.execute_many("something", [(1, 2), (3, 4)])
+        self.assertEquals(result, None)
+        self.assertEquals(self.executed,
+                          [("MANY", "something", [(1, 2), (3, 4)]),
+                           "RCLOSE"])
+
+    def test_execute_many_convert_param_style(self):
+        class MyConnection(Connection):
+            param_mark = "%s"
+        connection = MyConnection(self.database)
+        connection.execute_many("'?' ? '?' ?", [(1, 2)])
+        self.assertEquals(self.executed,
+                          [("MANY", "'?' %s '?' %s", [(1, 2)]), "RCLOSE"])
+
+    def test_execute_many_closed(self):
+        self.connection.close()
+        self.assertRaises(ClosedError, self.connection.execute_many,
+                          "something", [])
+
     def test_execute_select(self):
         select = Select([SQLToken("column1"), SQLToken("column2")],
                         tables=[SQLToken("table1"), SQLToken("table2")])
@@ -210,6 +248,18 @@ class ConnectionTest(TestHelper):
                                         ("SUCCESS", self.connection, RawCursor,
                                          "something", (1, 2))])
 
+    def test_raw_execute_many_tracing(self):
+        self.assertMethodsMatch(FakeTracer, DebugTracer)
+        tracer = FakeTracer()
+        install_tracer(tracer)
+        self.connection.execute_many("something", [(1, 2), (3, 4)])
+        self.assertEquals(tracer.seen, [("EXECUTE MANY", self.connection,
+                                         RawCursor, "something",
+                                         [(1, 2), (3, 4)]),
+                                        ("SUCCESS MANY", self.connection,
+                                         RawCursor, "something",
+                                         [(1, 2), (3, 4)])])
+
     def test_raw_execute_error_tracing(self):
         cursor_mock = self.mocker.patch(RawCursor)
         cursor_mock.execute(ARGS)
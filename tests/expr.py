@@ -1103,6 +1103,25 @@ class CompileTest(TestHelper):
         self.assertEquals(statement, "func1() IN (SELECT column1)")
         self.assertEquals(state.parameters, [])
 
+    def test_compare_columns_in(self):
+        expr = compare_columns_in([Column(column1)], [(1,), (2,)])
+        state = State()
+        statement = compile(expr, state)
+        self.assertEquals(statement, "column1 IN (?, ?)")
+        self.assertVariablesEqual(state.parameters,
+                                  [Variable(1), Variable(2)])
+
+    def test_compare_columns_in_composed(self):
+        expr = compare_columns_in([Column(column1), Column(column2)],
+                                  [(1, 2), (3, 4)])
+        state = State()
+        statement = compile(expr, state)
+        self.assertEquals(statement, "column1 = ? AND column2 = ? OR "
+                                     "column1 = ? AND column2 = ?")
+        self.assertVariablesEqual(
+            state.parameters,
+            [Variable(1), Variable(2), Variable(3), Variable(4)])
+
     def test_eq_none(self):
         expr = Func1() == None
 
@@ -2374,6 +2393,32 @@ class CompilePythonTest(TestHelper):
         match = compile_python.get_matcher(col1 == Variable(value))
         self.assertTrue(match({col1: value}.get))
 
+    def test_match_reuses_code_for_same_shape(self):
+        col1 = Column(column1)
+        match1 = compile_python.get_matcher(col1 == Variable(1))
+        match2 = compile_python.get_matcher(col1 == Variable(2))
+        self.assertTrue(match1.func_code is match2.func_code)
+        self.assertTrue(match1({col1: 1}.get))
+        self.assertFalse(match1({col1: 2}.get))
+        self.assertTrue(match2({col1: 2}.get))
+        self.assertFalse(match2({col1: 1}.get))
+
+    def test_match_with_different_shapes(self):
+        col1 = Column(column1)
+        match1 = compile_python.get_matcher(col1 == Variable(1))
+        match2 = compile_python.get_matcher(col1 > Variable(1))
+        self.assertTrue(match1({col1: 1}.get))
+        self.assertFalse(match2({col1: 1}.get))
+
+    def test_match_closure_cache_size(self):
+        compile = compile_python.create_child()
+        compile.closure_cache_size = 2
+        col1 = Column(column1)
+        compile.get_matcher(col1 == Variable(1))
+        compile.get_matcher(col1 > Variable(1))
+        compile.get_matcher(col1 < Variable(1))
+        self.assertEquals(len(compile._closures), 1)
+
 
 class LazyValueExprTest(TestHelper):
 
@@ -168,6 +168,77 @@ class ClassInfoTest(TestHelper):
         cls_info = ClassInfo(Class)
         self.assertEquals(cls_info.primary_key_pos, (2, 0))
 
+    def test_lazy_columns(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", primary=True)
+            prop2 = Property("column2", lazy_group=1)
+            prop3 = Property("column3")
+            prop4 = Property("column4", lazy_group=1)
+            prop5 = Property("column5", lazy_group=2)
+        cls_info = ClassInfo(Class)
+        self.assertEquals(cls_info.lazy_groups,
+                          {id(Class.prop2): 1, id(Class.prop4): 1,
+                           id(Class.prop5): 2})
+        self.assertEquals(len(cls_info.lazy_columns), 3)
+        self.assertTrue(cls_info.lazy_columns[0] is Class.prop2)
+        self.assertTrue(cls_info.lazy_columns[1] is Class.prop4)
+        self.assertTrue(cls_info.lazy_columns[2] is Class.prop5)
+        self.assertEquals(len(cls_info.eager_columns), 2)
+        self.assertTrue(cls_info.eager_columns[0] is Class.prop1)
+        self.assertTrue(cls_info.eager_columns[1] is Class.prop3)
+
+    def test_eager_primary_key_pos(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", lazy_group=1)
+            prop2 = Property("column2", primary=True)
+        cls_info = ClassInfo(Class)
+        self.assertEquals(cls_info.primary_key_pos, (1,))
+        self.assertEquals(cls_info.eager_primary_key_pos, (0,))
+
+    def test_unique_columns(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", primary=True)
+            prop2 = Property("column2", unique=True)
+            prop3 = Property("column3")
+        cls_info = ClassInfo(Class)
+        self.assertEquals(len(cls_info.unique_columns), 1)
+        self.assertTrue(cls_info.unique_columns[0] is Class.prop2)
+
+    def test_cache_all(self):
+        self.assertEquals(self.cls_info.cache_all, None)
+        class Class(object):
+            __storm_table__ = "table"
+            __storm_cache_all__ = 60
+            prop1 = Property("column1", primary=True)
+        self.assertEquals(ClassInfo(Class).cache_all, 60)
+
+    def test_cache_quota(self):
+        self.assertEquals(self.cls_info.cache_quota, None)
+        class Class(object):
+            __storm_table__ = "table"
+            __storm_cache_quota__ = 100
+            prop1 = Property("column1", primary=True)
+        self.assertEquals(ClassInfo(Class).cache_quota, 100)
+
+    def test_indexed_columns(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", primary=True)
+            prop2 = Property("column2", indexed=True)
+            prop3 = Property("column3")
+        cls_info = ClassInfo(Class)
+        self.assertEquals(len(cls_info.indexed_columns), 1)
+        self.assertTrue(cls_info.indexed_columns[0] is Class.prop2)
+
+    def test_lazy_primary_key(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", primary=True, lazy_group=1)
+        self.assertRaises(ClassInfoError, ClassInfo, Class)
+
 
 class ObjectInfoTest(TestHelper):
 
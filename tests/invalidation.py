@@ -0,0 +1,216 @@
+#
+# Copyright (c) 2011 Canonical
+#
+# This file is part of Storm Object Relational Mapper.
+#
+# Storm is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 2.1 of
+# the License, or (at your option) any later version.
+#
+# Storm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from unittest import defaultTestLoader
+import gc
+
+from storm.databases.sqlite import sqlite
+from storm.invalidation import (
+    ChangeSet, InvalidationBus, LocalInvalidationBus, SQLiteInvalidationBus)
+
+from tests.helper import TestHelper
+
+
+class Receiver(object):
+
+    def __init__(self):
+        self.change_sets = []
+
+    def receive(self, change_set):
+        self.change_sets.append(change_set)
+
+
+class ChangeSetTest(TestHelper):
+
+    def test_iter(self):
+        change_set = ChangeSet([("foo", (1,))], [("foo", (2,))], [("bar", (3,))])
+        self.assertEquals(sorted(change_set),
+                          sorted([("foo", (1,)), ("foo", (2,)), ("bar", (3,))]))
+
+    def test_nonzero(self):
+        self.assertFalse(ChangeSet())
+        self.assertTrue(ChangeSet(inserted=[("foo", (1,))]))
+        self.assertTrue(ChangeSet(updated=[("foo", (1,))]))
+        self.assertTrue(ChangeSet(deleted=[("foo", (1,))]))
+        self.assertTrue(ChangeSet(tables=["foo"]))
+        self.assertTrue(ChangeSet(lost=True))
+
+
+class InvalidationBusTest(TestHelper):
+
+    def test_publish_not_implemented(self):
+        self.assertRaises(NotImplementedError,
+                          InvalidationBus().publish, ChangeSet())
+
+
+class LocalInvalidationBusTest(TestHelper):
+
+    def test_publish(self):
+        bus = LocalInvalidationBus()
+        change_sets = []
+        bus.subscribe(change_sets.append)
+        change_set = ChangeSet(tables=["foo"])
+        bus.publish(change_set)
+        self.assertEquals(len(change_sets), 1)
+        self.assertTrue(change_sets[0] is change_set)
+
+    def test_unsubscribe(self):
+        bus = LocalInvalidationBus()
+        receiver = Receiver()
+        bus.subscribe(receiver.receive)
+        bus.unsubscribe(receiver.receive)
+        bus.publish(ChangeSet(tables=["foo"]))
+        self.assertEquals(receiver.change_sets, [])
+
+    def test_bound_methods_referenced_weakly(self):
+        bus = LocalInvalidationBus()
+        receiver = Receiver()
+        bus.subscribe(receiver.receive)
+        bus.publish(ChangeSet(tables=["foo"]))
+        self.assertEquals(len(receiver.change_sets), 1)
+        del receiver
+        gc.collect()
+        bus.publish(ChangeSet(tables=["foo"]))
+        self.assertEquals(bus._subscribers, [])
+
+
+class SQLiteInvalidationBusTest(TestHelper):
+
+    def setUp(self):
+        TestHelper.setUp(self)
+        self.filename = self.makeFile()
+
+    def test_poll_delivers_change_sets_of_peers(self):
+        bus1 = SQLiteInvalidationBus(self.filename)
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        bus1.publish(ChangeSet([("foo", (1,))], [("foo", (2, u"a"))],
+                               [("bar", (3,))], ["bar"]))
+        self.assertEquals(receiver.change_sets, [])
+        bus2.poll()
+        [change_set] = receiver.change_sets
+        self.assertEquals(change_set.inserted, set([("foo", (1,))]))
+        self.assertEquals(change_set.updated, set([("foo", (2, u"a"))]))
+        self.assertEquals(change_set.deleted, set([("bar", (3,))]))
+        self.assertEquals(change_set.tables, set(["bar"]))
+        self.assertEquals(change_set.store, None)
+
+    def test_poll_delivers_change_sets_once(self):
+        bus1 = SQLiteInvalidationBus(self.filename)
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        bus1.publish(ChangeSet(tables=["foo"]))
+        bus2.poll()
+        bus2.poll()
+        self.assertEquals(len(receiver.change_sets), 1)
+
+    def test_poll_ignores_own_change_sets(self):
+        bus = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus.subscribe(receiver.receive)
+        bus.publish(ChangeSet(tables=["foo"]))
+        bus.poll()
+        self.assertEquals(receiver.change_sets, [])
+
+    def test_poll_ignores_change_sets_published_before_creation(self):
+        bus1 = SQLiteInvalidationBus(self.filename)
+        bus1.publish(ChangeSet(tables=["foo"]))
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        bus2.poll()
+        self.assertEquals(receiver.change_sets, [])
+
+    def test_poll_delivers_lost_change_set_after_deletion(self):
+        bus1 = SQLiteInvalidationBus(self.filename, keep=-1)
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        bus1.publish(ChangeSet(tables=["foo"]))
+        bus1.publish(ChangeSet(tables=["bar"]))
+        bus2.poll()
+        [change_set] = receiver.change_sets
+        self.assertTrue(change_set.lost)
+        bus2.poll()
+        self.assertEquals(len(receiver.change_sets), 1)
+
+    def test_poll_delivers_change_sets_after_lost_ones(self):
+        bus1 = SQLiteInvalidationBus(self.filename, keep=-1)
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        bus1.publish(ChangeSet(tables=["foo"]))
+        bus2.poll()
+        bus3 = SQLiteInvalidationBus(self.filename)
+        bus3.publish(ChangeSet(tables=["bar"]))
+        bus2.poll()
+        [lost_change_set, change_set] = receiver.change_sets
+        self.assertEquals(change_set.tables, set(["bar"]))
+        self.assertFalse(change_set.lost)
+
+    def test_poll_ignores_change_sets_deleted_before_creation(self):
+        bus1 = SQLiteInvalidationBus(self.filename, keep=-1)
+        bus1.publish(ChangeSet(tables=["foo"]))
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        bus2.poll()
+        self.assertEquals(receiver.change_sets, [])
+
+    def test_unencodable_primary_key_changes_table(self):
+        bus1 = SQLiteInvalidationBus(self.filename)
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        bus1.publish(ChangeSet(updated=[("foo", (object(),))]))
+        bus2.poll()
+        [change_set] = receiver.change_sets
+        self.assertEquals(change_set.updated, set())
+        self.assertEquals(change_set.tables, set(["foo"]))
+
+    def test_unnamed_tables_not_shared(self):
+        bus1 = SQLiteInvalidationBus(self.filename)
+        bus2 = SQLiteInvalidationBus(self.filename)
+        receiver = Receiver()
+        bus2.subscribe(receiver.receive)
+        table = object()
+        bus1.publish(ChangeSet([(table, (1,))], [("foo", (2,))],
+                               tables=[table]))
+        bus2.poll()
+        [change_set] = receiver.change_sets
+        self.assertEquals(change_set.inserted, set())
+        self.assertEquals(change_set.updated, set([("foo", (2,))]))
+        self.assertEquals(change_set.tables, set())
+
+    def test_old_change_sets_pruned(self):
+        bus = SQLiteInvalidationBus(self.filename, keep=-1)
+        bus.publish(ChangeSet(tables=["foo"]))
+        bus.publish(ChangeSet(tables=["bar"]))
+        connection = sqlite.connect(self.filename)
+        try:
+            count = connection.execute(
+                "SELECT COUNT(*) FROM storm_change_set").fetchone()[0]
+        finally:
+            connection.close()
+        self.assertEquals(count, 0)
+
+
+def test_suite():
+    return defaultTestLoader.loadTestsFromName(__name__)
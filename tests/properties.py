@@ -100,6 +100,51 @@ class PropertyTest(TestHelper):
         self.assertEquals(self.Class.prop1.table, self.Class)
         self.assertEquals(self.Class.prop2.table, self.Class)
 
+    def test_lazy_group(self):
+        self.assertEquals(self.Class.prop2.lazy_group, None)
+        group = LazyGroup()
+        class Class(object):
+            __storm_table__ = "mytable"
+            prop1 = Int(primary=True)
+            prop2 = Unicode(lazy_group=group)
+            prop3 = Unicode(lazy_group=1)
+        self.assertTrue(Class.prop2.lazy_group is group)
+        self.assertEquals(Class.prop3.lazy_group, 1)
+
+    def test_lazy(self):
+        class Class(object):
+            __storm_table__ = "mytable"
+            prop1 = Int(primary=True)
+            prop2 = Unicode(lazy=True)
+            prop3 = Unicode(lazy=True)
+        self.assertTrue(isinstance(Class.prop2.lazy_group, LazyGroup))
+        self.assertTrue(Class.prop2.lazy_group is not Class.prop3.lazy_group)
+        # The "lazy" argument isn't handed to the variable.
+        self.assertTrue(isinstance(Class.prop2.variable_factory(),
+                                   UnicodeVariable))
+
+    def test_unique(self):
+        self.assertEquals(self.Class.prop2.unique, False)
+        class Class(object):
+            __storm_table__ = "mytable"
+            prop1 = Int(primary=True)
+            prop2 = Unicode(unique=True)
+        self.assertEquals(Class.prop2.unique, True)
+        # The "unique" argument isn't handed to the variable.
+        self.assertTrue(isinstance(Class.prop2.variable_factory(),
+                                   UnicodeVariable))
+
+    def test_indexed(self):
+        self.assertEquals(self.Class.prop2.indexed, False)
+        class Class(object):
+            __storm_table__ = "mytable"
+            prop1 = Int(primary=True)
+            prop2 = Unicode(indexed=True)
+        self.assertEquals(Class.prop2.indexed, True)
+        # The "indexed" argument isn't handed to the variable.
+        self.assertTrue(isinstance(Class.prop2.variable_factory(),
+                                   UnicodeVariable))
+
     def test_variable_factory(self):
         variable = self.Class.prop1.variable_factory()
         self.assertTrue(isinstance(variable, CustomVariable))
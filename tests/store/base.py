@@ -23,6 +23,7 @@
 from cStringIO import StringIO
 import decimal
 import gc
+import logging
 import operator
 from uuid import uuid4
 import weakref
@@ -41,7 +42,8 @@ from storm.exceptions import (
     ClosedError, ConnectionBlockedError, FeatureError, LostObjectError,
     NoStoreError, NotFlushedError, NotOneError, OrderLoopError, UnorderedError,
     WrongStoreError, DisconnectionError)
-from storm.cache import Cache
+from storm.cache import Cache, TwoQueueCache, MemoryCache, RowCache
+from storm.invalidation import ChangeSet, LocalInvalidationBus
 from storm.store import AutoReload, EmptyResultSet, Store, ResultSet
 from storm.tracer import debug
 
@@ -78,6 +80,47 @@ class Link(object):
     foo_id = Int()
     bar_id = Int()
 
+class LazyBar(object):
+    __storm_table__ = "bar"
+    id = Int(primary=True)
+    foo_id = Int()
+    title = Unicode(lazy=True)
+
+class LazyFooValue(object):
+    __storm_table__ = "foovalue"
+    id = Int(primary=True)
+    foo_id = Int(lazy_group=1)
+    value1 = Int(lazy_group=2)
+    value2 = Int(lazy_group=2)
+
+class UniqueTitleFoo(object):
+    __storm_table__ = "foo"
+    id = Int(primary=True)
+    title = Unicode(unique=True)
+
+class CachedFoo(object):
+    __storm_table__ = "foo"
+    __storm_cache_all__ = True
+    id = Int(primary=True)
+    title = Unicode()
+
+class TimedCachedFoo(object):
+    __storm_table__ = "foo"
+    __storm_cache_all__ = 60
+    id = Int(primary=True)
+    title = Unicode()
+
+class QuotaFoo(object):
+    __storm_table__ = "foo"
+    __storm_cache_quota__ = 1
+    id = Int(primary=True)
+    title = Unicode()
+
+class IndexedTitleFoo(object):
+    __storm_table__ = "foo"
+    id = Int(primary=True)
+    title = Unicode(indexed=True)
+
 class SelfRef(object):
     __storm_table__ = "selfref"
     id = Int(primary=True)
@@ -549,6 +592,372 @@ class StoreTest(object):
         foo = self.store.get(MyFoo, (u"Title 20", 10))
         self.assertEquals(foo, None)
 
+    def test_get_many(self):
+        foos = self.store.get_many(Foo, [30, 10, 40, 20])
+        self.assertEquals([foo and (foo.id, foo.title) for foo in foos],
+                          [(30, "Title 10"), (10, "Title 30"), None,
+                           (20, "Title 20")])
+        self.assertTrue(foos[1] is self.store.get(Foo, 10))
+
+    def test_get_many_empty(self):
+        self.assertEquals(self.store.get_many(Foo, []), [])
+
+    def test_get_many_with_duplicated_keys(self):
+        foos = self.store.get_many(Foo, [10, 10, 20])
+        self.assertTrue(foos[0] is foos[1])
+        self.assertEquals(foos[2].id, 20)
+
+    def test_get_many_queries_missing_objects_at_once(self):
+        foo = self.store.get(Foo, 10)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        foos = self.store.get_many(Foo, [10, 20, 30])
+        debug(False)
+
+        self.assertTrue(foos[0] is foo)
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+        self.assertFalse("foo.id = ?" in stream.getvalue())
+
+    def test_get_many_from_cache(self):
+        foos = [self.store.get(Foo, id) for id in (10, 20)]
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(self.store.get_many(Foo, [20, 10]),
+                          [foos[1], foos[0]])
+        debug(False)
+
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_get_many_with_composed_key(self):
+        links = self.store.get_many(Link, [(10, 200), (30, 100), (20, 100)])
+        self.assertEquals([link and (link.foo_id, link.bar_id)
+                           for link in links],
+                          [(10, 200), None, (20, 100)])
+
+    def test_get_many_in_chunks(self):
+        self.store._batch_parameters = 2
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        foos = self.store.get_many(Foo, [10, 20, 30])
+        debug(False)
+
+        self.assertEquals([foo.id for foo in foos], [10, 20, 30])
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def create_negative_cache_store(self):
+        store = Store(self.database, negative_cache=True)
+        self.stores.append(store)
+        return store
+
+    def test_get_negative_cache(self):
+        store = self.create_negative_cache_store()
+        self.assertEquals(store.get(Foo, 40), None)
+        # Bypass the store, so that it doesn't notice the new row.
+        store._connection.execute("INSERT INTO foo VALUES (40, 'Title 40')")
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(store.get(Foo, 40), None)
+        debug(False)
+
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_get_without_negative_cache(self):
+        self.assertEquals(self.store.get(Foo, 40), None)
+        self.store._connection.execute(
+            "INSERT INTO foo VALUES (40, 'Title 40')")
+        self.assertEquals(self.store.get(Foo, 40).title, "Title 40")
+
+    def test_get_negative_cache_forgets_added_object(self):
+        store = self.create_negative_cache_store()
+        self.assertEquals(store.get(Foo, 40), None)
+        foo = Foo()
+        foo.id = 40
+        store.add(foo)
+        self.assertTrue(store.get(Foo, 40) is foo)
+
+    def test_get_negative_cache_forgets_object_with_changed_key(self):
+        store = self.create_negative_cache_store()
+        self.assertEquals(store.get(Foo, 40), None)
+        foo = store.get(Foo, 10)
+        foo.id = 40
+        self.assertTrue(store.get(Foo, 40) is foo)
+
+    def test_get_negative_cache_cleared_on_invalidate(self):
+        store = self.create_negative_cache_store()
+        self.assertEquals(store.get(Foo, 40), None)
+        store._connection.execute("INSERT INTO foo VALUES (40, 'Title 40')")
+        store.invalidate()
+        self.assertEquals(store.get(Foo, 40).title, "Title 40")
+
+    def test_get_negative_cache_cleared_on_rollback(self):
+        store = self.create_negative_cache_store()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.rollback()
+        store._connection.execute("INSERT INTO foo VALUES (40, 'Title 40')")
+        self.assertEquals(store.get(Foo, 40).title, "Title 40")
+
+    def test_get_negative_cache_cleared_on_execute(self):
+        store = self.create_negative_cache_store()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.execute("INSERT INTO foo VALUES (40, 'Title 40')")
+        self.assertEquals(store.get(Foo, 40).title, "Title 40")
+
+    def test_get_many_negative_cache(self):
+        store = self.create_negative_cache_store()
+        self.assertEquals(store.get_many(Foo, [40, 10]),
+                          [None, store.get(Foo, 10)])
+        store._connection.execute("INSERT INTO foo VALUES (40, 'Title 40')")
+        self.assertEquals(store.get(Foo, 40), None)
+
+    def test_get_many_from_cached_table(self):
+        self.store.get(CachedFoo, 10)
+        self.assertEquals(
+            self.count_selects(self.store.get_many, CachedFoo, [20, 40, 30]),
+            0)
+        self.assertEquals(
+            [foo and foo.id
+             for foo in self.store.get_many(CachedFoo, [20, 40, 30])],
+            [20, None, 30])
+
+    def test_get_many_from_row_cache(self):
+        row_cache = RowCache()
+        store1 = Store(self.database, row_cache=row_cache)
+        store2 = Store(self.database, row_cache=row_cache)
+        self.stores.extend([store1, store2])
+        store1.get_many(Foo, [10, 20])
+        self.assertEquals(self.count_selects(store2.get_many, Foo, [10, 20]),
+                          0)
+        self.assertEquals([foo.title for foo in store2.get_many(Foo, [10, 20])],
+                          ["Title 30", "Title 20"])
+
+    def test_get_many_stats(self):
+        store = Store(self.database, negative_cache=True)
+        self.stores.append(store)
+        store.get_many(Foo, [10, 40])
+        store.get_many(Foo, [10, 40, 20])
+        stats = store.get_stats()
+        self.assertEquals(stats["get_hits"], 1)
+        self.assertEquals(stats["get_misses"], 3)
+        self.assertEquals(stats["negative_hits"], 1)
+
+    def test_get_unique(self):
+        foo = self.store.get(UniqueTitleFoo.title, u"Title 20")
+        self.assertEquals(foo.id, 20)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertTrue(self.store.get(UniqueTitleFoo.title, u"Title 20")
+                        is foo)
+        debug(False)
+
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_get_unique_loaded_object(self):
+        foo = self.store.get(UniqueTitleFoo, 10)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertTrue(self.store.get(UniqueTitleFoo.title, u"Title 30")
+                        is foo)
+        debug(False)
+
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_get_unique_missing(self):
+        self.assertEquals(self.store.get(UniqueTitleFoo.title, u"Title 40"),
+                          None)
+
+    def test_get_unique_changed(self):
+        foo = self.store.get(UniqueTitleFoo.title, u"Title 20")
+        foo.title = u"Title 40"
+        self.assertEquals(self.store.get(UniqueTitleFoo.title, u"Title 20"),
+                          None)
+        self.assertTrue(self.store.get(UniqueTitleFoo.title, u"Title 40")
+                        is foo)
+
+    def test_get_unique_added(self):
+        foo = UniqueTitleFoo()
+        foo.title = u"Title 40"
+        self.store.add(foo)
+        self.store.flush()
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertTrue(self.store.get(UniqueTitleFoo.title, u"Title 40")
+                        is foo)
+        debug(False)
+
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_get_unique_removed(self):
+        foo = self.store.get(UniqueTitleFoo.title, u"Title 20")
+        self.store.remove(foo)
+        self.assertEquals(self.store.get(UniqueTitleFoo.title, u"Title 20"),
+                          None)
+
+    def test_get_unique_invalidated(self):
+        foo = self.store.get(UniqueTitleFoo.title, u"Title 20")
+        self.store.invalidate()
+        self.store.execute("UPDATE foo SET title='Title 40' WHERE id=20")
+        self.assertEquals(self.store.get(UniqueTitleFoo.title, u"Title 20"),
+                          None)
+        self.assertTrue(self.store.get(UniqueTitleFoo.title, u"Title 40")
+                        is foo)
+
+    def test_get_unique_with_non_unique_property(self):
+        self.assertRaises(FeatureError, self.store.get, Foo.title,
+                          u"Title 20")
+
+    def count_selects(self, function, *args):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        try:
+            function(*args)
+        finally:
+            debug(False)
+        return stream.getvalue().count("SELECT")
+
+    def test_cache_all_find(self):
+        self.assertEquals(self.count_selects(list, self.store.find(CachedFoo)),
+                          1)
+
+        def find():
+            result = self.store.find(CachedFoo, CachedFoo.id > 10)
+            self.assertEquals(
+                [foo.id for foo in result.order_by(Desc(CachedFoo.title))],
+                [20, 30])
+            self.assertEquals(result.count(), 2)
+            self.assertEquals(result.is_empty(), False)
+            self.assertEquals(result.order_by(CachedFoo.id)[1:].one().id, 30)
+            self.assertEquals(result.order_by(CachedFoo.id).first().id, 20)
+            self.assertEquals(result.order_by(CachedFoo.id).last().id, 30)
+            self.assertRaises(NotOneError, result.one)
+            result = self.store.find(CachedFoo, title=u"Title 40")
+            self.assertEquals(result.any(), None)
+            self.assertEquals(result.count(), 0)
+            self.assertEquals(self.store.get(CachedFoo, 10).title, "Title 30")
+            self.assertEquals(self.store.get(CachedFoo, 40), None)
+        self.assertEquals(self.count_selects(find), 0)
+
+    def test_cache_all_find_with_unsupported_expression(self):
+        list(self.store.find(CachedFoo))
+        result = self.store.find(CachedFoo, CachedFoo.title.like(u"%20"))
+        self.assertEquals(self.count_selects(list, result), 1)
+        self.assertEquals([foo.id for foo in result], [20])
+
+    def test_cache_all_find_with_other_class(self):
+        list(self.store.find(CachedFoo))
+        result = self.store.find(CachedFoo, CachedFoo.id == Bar.foo_id,
+                                 Bar.id == 200)
+        self.assertEquals(self.count_selects(list, result), 1)
+        self.assertEquals([foo.id for foo in result], [20])
+
+    def test_cache_all_find_with_added_and_removed_objects(self):
+        foo = CachedFoo()
+        foo.id = 40
+        foo.title = u"Title 40"
+        self.store.add(foo)
+        self.store.remove(self.store.get(CachedFoo, 10))
+        result = self.store.find(CachedFoo).order_by(CachedFoo.id)
+        self.assertEquals([foo.id for foo in result], [20, 30, 40])
+        self.store.remove(foo)
+        self.store.flush()
+        self.assertEquals([foo.id for foo in result], [20, 30])
+
+    def test_cache_all_find_with_changed_object(self):
+        foo = self.store.get(CachedFoo, 20)
+        foo.title = u"Title 40"
+        result = self.store.find(CachedFoo, title=u"Title 40")
+        self.assertEquals(result.one(), foo)
+
+    def test_cache_all_keeps_objects_alive(self):
+        list(self.store.find(CachedFoo))
+        self.get_cache(self.store).clear()
+        gc.collect()
+        self.assertEquals(self.count_selects(self.store.get, CachedFoo, 20),
+                          0)
+
+    def test_cache_all_reloaded_in_new_transaction(self):
+        list(self.store.find(CachedFoo))
+        self.store.commit()
+        self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
+        result = self.store.find(CachedFoo, title=u"New Title")
+        self.assertEquals(self.count_selects(list, result), 1)
+        self.assertEquals([foo.id for foo in result], [20])
+
+    def test_cache_all_reloaded_after_execute(self):
+        list(self.store.find(CachedFoo))
+        self.store.execute("DELETE FROM foo WHERE id=20")
+        self.assertEquals(self.store.find(CachedFoo).count(), 2)
+
+    def test_cache_all_reloaded_after_result_set_remove(self):
+        list(self.store.find(CachedFoo))
+        self.store.find(CachedFoo, id=20).remove()
+        self.assertEquals(self.store.find(CachedFoo).count(), 2)
+
+    def test_cache_all_with_seconds_kept_across_commits(self):
+        list(self.store.find(TimedCachedFoo))
+        self.store.commit()
+        self.assertEquals(
+            self.count_selects(list, self.store.find(TimedCachedFoo)), 0)
+        foo = self.store.get(TimedCachedFoo, 20)
+        self.assertFalse(get_obj_info(foo).get("invalidated"))
+        self.assertEquals(self.count_selects(getattr, foo, "title"), 0)
+
+    def test_cache_all_with_seconds_expires(self):
+        list(self.store.find(TimedCachedFoo))
+        self.store._cached_tables[TimedCachedFoo].expires = 0
+        self.assertEquals(
+            self.count_selects(list, self.store.find(TimedCachedFoo)), 1)
+
+    def test_cache_all_with_seconds_kept_across_rollbacks(self):
+        list(self.store.find(TimedCachedFoo))
+        self.store.rollback()
+        self.assertEquals(
+            self.count_selects(list, self.store.find(TimedCachedFoo)), 0)
+
+    def test_cache_all_with_seconds_dropped_on_rollback_if_changed(self):
+        foo = self.store.find(TimedCachedFoo, id=20).one()
+        foo.title = u"New Title"
+        self.store.rollback()
+        self.assertEquals(
+            self.count_selects(list, self.store.find(TimedCachedFoo)), 1)
+        self.assertEquals(foo.title, u"Title 20")
+
+    def test_cache_all_with_seconds_dropped_on_rollback_if_written(self):
+        foo = self.store.find(TimedCachedFoo, id=20).one()
+        foo.title = u"New Title"
+        self.store.flush()
+        self.store.rollback()
+        self.assertEquals(
+            self.count_selects(list, self.store.find(TimedCachedFoo)), 1)
+        self.assertEquals(foo.title, u"Title 20")
+
+    def test_cache_all_with_seconds_kept_after_execute(self):
+        list(self.store.find(TimedCachedFoo))
+        self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
+        self.assertEquals(
+            self.count_selects(list, self.store.find(TimedCachedFoo)), 0)
+
+    def test_cache_all_kept_after_select_execute(self):
+        list(self.store.find(CachedFoo))
+        self.store.execute("SELECT title FROM foo WHERE id=20")
+        self.store.execute(Select(Foo.title, Foo.id == 20))
+        self.assertEquals(
+            self.count_selects(list, self.store.find(CachedFoo)), 0)
+
     def test_of(self):
         foo = self.store.get(Foo, 10)
         self.assertEquals(Store.of(foo), self.store)
@@ -1183,6 +1592,114 @@ class StoreTest(object):
         self.store.invalidate(foo)
         self.assertEquals(self.store.find(Foo).cached(), [foo])
 
+    def test_find_cached_only_touches_objects_of_class(self):
+        foo = self.store.get(Foo, 20)
+        bar = self.store.get(Bar, 200)
+        self.store.invalidate()
+        self.assertEquals(self.store.find(Foo).cached(), [foo])
+        self.assertTrue(get_obj_info(foo).get("invalidated"))
+        self.assertFalse(get_obj_info(bar).get("invalidated"))
+
+    def test_find_cached_after_remove(self):
+        foo = self.store.get(Foo, 20)
+        self.store.remove(foo)
+        self.store.flush()
+        self.assertEquals(self.store.find(Foo).cached(), [])
+
+    def test_find_cached_with_changed_primary_key(self):
+        foo = self.store.get(Foo, 20)
+        foo.id = 40
+        self.store.flush()
+        self.assertEquals(self.store.find(Foo).cached(), [foo])
+
+    def test_find_cached_indexed(self):
+        foo1, foo2, foo3 = self.store.find(IndexedTitleFoo).order_by(
+            IndexedTitleFoo.id)
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(result.cached(), [foo2])
+        result = self.store.find(IndexedTitleFoo,
+                                 IndexedTitleFoo.title == u"Title 10",
+                                 IndexedTitleFoo.id == 30)
+        self.assertEquals(result.cached(), [foo3])
+        result = self.store.find(IndexedTitleFoo, title=u"Title 40")
+        self.assertEquals(result.cached(), [])
+
+    def test_find_cached_indexed_only_touches_matching_objects(self):
+        foo1, foo2, foo3 = self.store.find(IndexedTitleFoo)
+        obj_info = get_obj_info(foo1)
+        obj_info.variables[IndexedTitleFoo.id].set(AutoReload)
+        result = self.store.find(IndexedTitleFoo, IndexedTitleFoo.id > 0,
+                                 title=foo2.title)
+        self.assertEquals(result.cached(), [foo2])
+        self.assertEquals(obj_info.variables[IndexedTitleFoo.id].get_lazy(),
+                          AutoReload)
+
+    def test_find_cached_indexed_after_change(self):
+        foo = self.store.get(IndexedTitleFoo, 20)
+        foo.title = u"New Title"
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(result.cached(), [])
+        result = self.store.find(IndexedTitleFoo, title=u"New Title")
+        self.assertEquals(result.cached(), [foo])
+        self.store.flush()
+        self.assertEquals(result.cached(), [foo])
+
+    def test_find_cached_indexed_autoreload(self):
+        foo = self.store.get(IndexedTitleFoo, 20)
+        self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
+        self.store.autoreload(foo)
+        result = self.store.find(IndexedTitleFoo, title=u"New Title")
+        self.assertEquals(result.cached(), [foo])
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(result.cached(), [])
+
+    def test_find_cached_indexed_invalidate_all(self):
+        foo = self.store.get(IndexedTitleFoo, 20)
+        result = self.store.find(IndexedTitleFoo, title=u"New Title")
+        self.assertEquals(result.cached(), [])
+        self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
+        self.store.invalidate()
+        # The object is looked up by its last known value until touched.
+        self.assertEquals(result.cached(), [])
+        foo.id
+        self.assertEquals(result.cached(), [foo])
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(result.cached(), [])
+
+    def test_find_cached_indexed_invalidate_all_by_last_known_value(self):
+        foo = self.store.get(IndexedTitleFoo, 20)
+        self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
+        self.store.invalidate()
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(result.cached(), [])
+        self.assertEquals(foo.title, u"New Title")
+
+    def test_find_cached_indexed_after_commit_leaves_others_alone(self):
+        foo1 = self.store.get(IndexedTitleFoo, 10)
+        foo2 = self.store.get(IndexedTitleFoo, 20)
+        foo3 = self.store.get(IndexedTitleFoo, 30)
+        self.store.commit()
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(self.count_selects(result.cached), 1)
+        self.assertEquals(result.cached(), [foo2])
+        for foo in (foo1, foo3):
+            self.assertEquals(get_obj_info(foo).get("invalidated"), None)
+
+    def test_find_cached_indexed_after_remove(self):
+        foo = self.store.get(IndexedTitleFoo, 20)
+        self.store.remove(foo)
+        self.store.flush()
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(result.cached(), [])
+
+    def test_find_cached_indexed_after_reset(self):
+        foo = self.store.get(IndexedTitleFoo, 20)
+        self.store.reset()
+        result = self.store.find(IndexedTitleFoo, title=u"Title 20")
+        self.assertEquals(result.cached(), [])
+        foo = self.store.get(IndexedTitleFoo, 20)
+        self.assertEquals(result.cached(), [foo])
+
     def test_find_cached_invalidated_and_deleted(self):
         foo = self.store.get(Foo, 20)
         self.store.execute("DELETE FROM foo WHERE id=20")
@@ -1239,6 +1756,97 @@ class StoreTest(object):
                           (300, u"Title 100"),
                          ])
 
+    def test_find_prefetch(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        bars = list(self.store.find(Bar).order_by(Bar.id).prefetch(Bar.foo))
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        self.assertEquals([bar.foo.id for bar in bars], [10, 20, 30])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_find_prefetch_with_name(self):
+        bars = list(self.store.find(Bar).prefetch("foo"))
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(sorted(bar.foo.id for bar in bars), [10, 20, 30])
+        debug(False)
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_find_prefetch_with_path(self):
+        class MyLink(Link):
+            bar = Reference(Link.bar_id, Bar.id)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        links = list(self.store.find(MyLink).prefetch("bar.foo"))
+        self.assertEquals(stream.getvalue().count("SELECT"), 3)
+        self.assertEquals(sorted((link.bar.id, link.bar.foo.id)
+                                 for link in links),
+                          [(100, 10), (100, 10), (200, 20), (200, 20),
+                           (300, 30), (300, 30)])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 3)
+
+    def test_find_prefetch_with_none_key(self):
+        bar = self.store.get(Bar, 100)
+        bar.foo_id = None
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        bars = list(self.store.find(Bar).order_by(Bar.id).prefetch(Bar.foo))
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        self.assertEquals([bar.foo and bar.foo.id for bar in bars],
+                          [None, 20, 30])
+
+    def test_find_prefetch_on_remote(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        foos = list(self.store.find(FooRef).order_by(FooRef.id)
+                    .prefetch(FooRef.bar))
+        self.assertEquals([foo.bar.id for foo in foos], [100, 200, 300])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_find_prefetch_with_tuple(self):
+        result = self.store.find((Bar, Foo), Bar.foo_id == Foo.id)
+        result.prefetch(Bar.foo)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        items = list(result)
+        self.assertEquals(sorted(bar.foo.id for bar, foo in items),
+                          [10, 20, 30])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_find_prefetch_with_name_and_tuple(self):
+        result = self.store.find((Bar, Foo), Bar.foo_id == Foo.id)
+        self.assertRaises(FeatureError, result.prefetch, "foo")
+
+    def test_find_prefetch_with_one(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        bar = self.store.find(Bar, id=200).prefetch(Bar.foo).one()
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        self.assertEquals(bar.foo.id, 20)
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
     def test_find_tuple(self):
         bar = self.store.get(Bar, 200)
         bar.foo_id = None
@@ -4101,6 +4709,126 @@ class StoreTest(object):
         self.assertEquals(type(bar1.id), int)
         self.assertEquals(type(bar2.id), int)
 
+    def test_reference_set_prefetch(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        foos = list(self.store.find(FooRefSetOrderID).order_by(Foo.id)
+                    .prefetch(FooRefSetOrderID.bars))
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        self.assertEquals([[bar.id for bar in foo.bars] for foo in foos],
+                          [[100], [200], [300]])
+        self.assertEquals([foo.bars.count() for foo in foos], [1, 1, 1])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_reference_set_prefetch_without_remotes(self):
+        self.store.get(Bar, 200).foo_id = None
+        foo = self.store.find(FooRefSet, id=20).prefetch("bars").one()
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(list(foo.bars), [])
+        debug(False)
+
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_reference_set_prefetch_dropped_on_remote_change(self):
+        foo = self.store.find(FooRefSet, id=20).prefetch("bars").one()
+        bar = self.store.get(Bar, 200)
+        self.assertEquals(list(foo.bars), [bar])
+
+        bar.foo_id = 10
+        self.assertEquals(list(foo.bars), [])
+
+    def test_reference_set_prefetch_dropped_on_local_change(self):
+        foo = self.store.find(FooRefSet, id=20).prefetch("bars").one()
+        self.store.execute("UPDATE bar SET foo_id=10 WHERE id=200")
+        foo.title = u"New title"
+        self.assertEquals(list(foo.bars), [])
+
+    def test_reference_set_prefetch_dropped_on_add(self):
+        foo = self.store.find(FooRefSetOrderID, id=20).prefetch("bars").one()
+        bar = self.store.get(Bar, 100)
+        foo.bars.add(bar)
+        self.assertEquals([bar.id for bar in foo.bars], [100, 200])
+
+    def test_reference_set_prefetch_dropped_on_invalidate(self):
+        foo = self.store.find(FooRefSet, id=20).prefetch("bars").one()
+        self.store.execute("UPDATE bar SET foo_id=10 WHERE id=200")
+        self.store.invalidate()
+        self.assertEquals(list(foo.bars), [])
+
+    def test_reference_set_prefetch_dropped_on_remote_added(self):
+        foo = self.store.find(FooRefSetOrderID, id=10).prefetch("bars").one()
+        self.assertEquals([bar.id for bar in foo.bars], [100])
+        bar = Bar()
+        bar.id = 400
+        bar.foo_id = 10
+        self.store.add(bar)
+        self.assertEquals([bar.id for bar in foo.bars], [100, 400])
+        self.assertEquals(foo.bars.count(), 2)
+
+    def test_reference_set_prefetch_dropped_on_remote_moved_in(self):
+        foo = self.store.find(FooRefSetOrderID, id=10).prefetch("bars").one()
+        self.assertEquals([bar.id for bar in foo.bars], [100])
+        self.store.get(Bar, 200).foo_id = 10
+        self.assertEquals([bar.id for bar in foo.bars], [100, 200])
+        self.assertEquals(foo.bars.count(), 2)
+
+    def test_reference_set_prefetch_kept_on_other_remote_change(self):
+        foo = self.store.find(FooRefSetOrderID, id=10).prefetch("bars").one()
+        self.store.get(Bar, 200).title = u"New title"
+        self.store.execute("UPDATE bar SET foo_id=10 WHERE id=300")
+        self.assertEquals([bar.id for bar in foo.bars], [100])
+
+    def test_indirect_reference_set_prefetch(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        foos = list(self.store.find(FooIndRefSetOrderID).order_by(Foo.id)
+                    .prefetch("bars"))
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        self.assertEquals([[bar.id for bar in foo.bars] for foo in foos],
+                          [[100, 200, 300], [100, 200], [300]])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_indirect_reference_set_prefetch_with_path(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        foos = list(self.store.find(FooIndRefSet).prefetch("bars.foo"))
+        self.assertEquals(sorted((bar.id, bar.foo.id)
+                                 for foo in foos for bar in foo.bars),
+                          [(100, 10), (100, 10), (200, 20), (200, 20),
+                           (300, 30), (300, 30)])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 3)
+
+    def test_indirect_reference_set_prefetch_dropped_on_remove(self):
+        foo = self.store.find(FooIndRefSetOrderID, id=20).prefetch("bars").one()
+        foo.bars.remove(self.store.get(Bar, 100))
+        self.assertEquals([bar.id for bar in foo.bars], [200])
+
+    def test_indirect_reference_set_prefetch_dropped_on_link_removal(self):
+        foo = self.store.find(FooIndRefSetOrderID, id=20).prefetch("bars").one()
+        self.store.remove(self.store.get(Link, (20, 100)))
+        self.assertEquals([bar.id for bar in foo.bars], [200])
+
+    def test_indirect_reference_set_prefetch_dropped_on_link_added(self):
+        foo = self.store.find(FooIndRefSetOrderID, id=30).prefetch("bars").one()
+        self.assertEquals([bar.id for bar in foo.bars], [300])
+        link = Link()
+        link.foo_id = 30
+        link.bar_id = 100
+        self.store.add(link)
+        self.assertEquals([bar.id for bar in foo.bars], [100, 300])
+
     def test_indirect_reference_set_find(self):
         foo = self.store.get(FooIndRefSet, 20)
 
@@ -4542,17 +5270,113 @@ class StoreTest(object):
         self.assertTrue(foo1.id < foo3.id)
         self.assertTrue(foo3.id < foo5.id)
 
-    def test_variable_filter_on_load(self):
-        foo = self.store.get(FooVariable, 20)
-        self.assertEquals(foo.title, "to_py(from_db(Title 20))")
+    def test_flush_order_loop_reports_objects(self):
+        foo1 = self.store.add(Foo())
+        foo2 = self.store.add(Foo())
+        foo3 = self.store.add(Foo())
+        foo4 = self.store.add(Foo())
 
-    def test_variable_filter_on_update(self):
-        foo = self.store.get(FooVariable, 20)
-        foo.title = u"Title 20"
+        self.store.add_flush_order(foo4, foo1)
+        self.store.add_flush_order(foo1, foo2)
+        self.store.add_flush_order(foo2, foo3)
+        self.store.add_flush_order(foo3, foo1)
 
-        self.store.flush()
+        try:
+            self.store.flush()
+        except OrderLoopError, error:
+            self.assertEquals(error.objects, [foo1, foo2, foo3])
+            self.assertTrue(repr(foo2) in str(error))
+            self.assertFalse(repr(foo4) in str(error))
+        else:
+            self.fail("OrderLoopError not raised")
 
-        self.assertEquals(self.get_items(), [
+        # Objects outside of the loop were flushed.
+        self.assertTrue(foo4.id is not None)
+
+    def test_flush_order_long_chain(self):
+        foos = []
+        for i in range(500):
+            foo = Foo()
+            foo.title = u"Object %d" % i
+            foos.append(self.store.add(foo))
+        # Flush them in the reverse order of addition.
+        for before, after in zip(foos[1:], foos[:-1]):
+            self.store.add_flush_order(before, after)
+
+        self.store.flush()
+
+        for before, after in zip(foos[1:], foos[:-1]):
+            self.assertTrue(before.id < after.id)
+
+    def test_flush_object(self):
+        foo1 = self.store.get(Foo, 10)
+        foo2 = self.store.get(Foo, 20)
+        foo1.title = u"New Title 10"
+        foo2.title = u"New Title 20"
+
+        self.store.flush(foo1)
+
+        self.assertEquals(self.get_items(), [(10, "New Title 10"),
+                                             (20, "Title 20"),
+                                             (30, "Title 10")])
+        self.store.flush()
+        self.assertEquals(self.get_items(), [(10, "New Title 10"),
+                                             (20, "New Title 20"),
+                                             (30, "Title 10")])
+
+    def test_flush_object_flushes_predecessors(self):
+        foo1 = self.store.add(Foo())
+        foo2 = self.store.add(Foo())
+        foo3 = self.store.add(Foo())
+        foo4 = self.store.add(Foo())
+        self.store.add_flush_order(foo1, foo2)
+        self.store.add_flush_order(foo2, foo3)
+
+        self.store.flush(foo3)
+
+        obj_infos = [get_obj_info(foo) for foo in (foo1, foo2, foo3, foo4)]
+        self.assertEquals(["pending" in obj_info for obj_info in obj_infos],
+                          [False, False, False, True])
+        self.assertTrue(foo1.id < foo2.id < foo3.id)
+
+    def test_flush_object_with_reference_flushes_remote(self):
+        foo = self.store.add(Foo())
+        bar = self.store.add(Bar())
+        other = self.store.add(Foo())
+        bar.foo = foo
+
+        self.store.flush(bar)
+
+        self.assertTrue("pending" in get_obj_info(other))
+        self.assertEquals(bar.foo_id, foo.id)
+        self.assertEquals(self.store.find(Bar, foo_id=foo.id).one(), bar)
+
+    def test_flush_object_from_other_store(self):
+        foo = Foo()
+        self.assertRaises(WrongStoreError, self.store.flush, foo)
+
+    def test_resolve_lazy_value_flushes_only_object(self):
+        foo1 = self.store.get(Foo, 10)
+        foo2 = self.store.get(Foo, 20)
+        foo1.title = u"New Title 10"
+        foo2.title = SQL("'New Title 20'")
+
+        self.assertEquals(foo2.title, "New Title 20")
+        self.assertEquals(self.get_items(), [(10, "Title 30"),
+                                             (20, "New Title 20"),
+                                             (30, "Title 10")])
+
+    def test_variable_filter_on_load(self):
+        foo = self.store.get(FooVariable, 20)
+        self.assertEquals(foo.title, "to_py(from_db(Title 20))")
+
+    def test_variable_filter_on_update(self):
+        foo = self.store.get(FooVariable, 20)
+        foo.title = u"Title 20"
+
+        self.store.flush()
+
+        self.assertEquals(self.get_items(), [
                           (10, "Title 30"),
                           (20, "to_db(from_py(Title 20))"),
                           (30, "Title 10"),
@@ -5259,6 +6083,87 @@ class StoreTest(object):
         self.assertEquals(obj_info.variables[Foo.id].get_lazy(), None)
         self.assertEquals(obj_info.variables[Foo.title].get_lazy(), AutoReload)
 
+    def test_lazy_column_not_loaded(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        bar = self.store.find(LazyBar, id=100).one()
+        debug(False)
+
+        self.assertFalse("title" in stream.getvalue())
+        self.assertEquals(
+            get_obj_info(bar).variables[LazyBar.title].get_lazy(), AutoReload)
+
+    def test_lazy_column_loaded_when_touched(self):
+        bar = self.store.get(LazyBar, 100)
+        self.assertEquals(bar.foo_id, 10)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(bar.title, "Title 300")
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+        self.assertFalse("foo_id" in stream.getvalue())
+
+    def test_lazy_group_loaded_when_touched(self):
+        value = self.store.get(LazyFooValue, 1)
+        obj_info = get_obj_info(value)
+
+        self.assertEquals(value.value1, 2)
+
+        self.assertEquals(
+            obj_info.variables[LazyFooValue.value2].get_lazy(), None)
+        self.assertEquals(
+            obj_info.variables[LazyFooValue.foo_id].get_lazy(), AutoReload)
+        self.assertEquals(value.value2, 1)
+        self.assertEquals(value.foo_id, 10)
+
+    def test_lazy_column_not_loaded_with_others(self):
+        value = self.store.get(LazyFooValue, 1)
+        obj_info = get_obj_info(value)
+        self.assertEquals(value.foo_id, 10)
+        self.store.autoreload(value)
+
+        self.assertEquals(value.value1, 2)
+        self.assertEquals(
+            obj_info.variables[LazyFooValue.value2].get_lazy(), None)
+        self.assertEquals(
+            obj_info.variables[LazyFooValue.foo_id].get_lazy(), AutoReload)
+
+    def test_lazy_column_set_without_loading(self):
+        bar = self.store.get(LazyBar, 100)
+        bar.title = u"New Title"
+        self.store.flush()
+        result = self.store.execute("SELECT title FROM bar WHERE id=100")
+        self.assertEquals(result.get_one(), ("New Title",))
+
+    def test_lazy_column_on_insert(self):
+        bar = LazyBar()
+        bar.id = 400
+        bar.title = u"Title 400"
+        self.store.add(bar)
+        self.store.flush()
+        self.store.invalidate()
+        self.assertEquals(self.store.get(LazyBar, 400).title, "Title 400")
+
+    def test_lazy_column_reload(self):
+        bar = self.store.get(LazyBar, 100)
+        bar.title = u"New Title"
+        self.store.reload(bar)
+        self.assertEquals(bar.title, "Title 300")
+        self.store.flush()
+        result = self.store.execute("SELECT title FROM bar WHERE id=100")
+        self.assertEquals(result.get_one(), ("Title 300",))
+
+    def test_lazy_column_in_tuple_find(self):
+        result = self.store.find((LazyBar, Foo), LazyBar.foo_id == Foo.id,
+                                 LazyBar.id == 200)
+        bar, foo = result.one()
+        self.assertEquals(foo.title, "Title 20")
+        self.assertEquals(bar.title, "Title 200")
+
     def test_autoreload_all_objects(self):
         foo = self.store.get(Foo, 20)
         self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
@@ -5291,6 +6196,92 @@ class StoreTest(object):
         self.assertEquals(lazy_value, AutoReload)
         self.assertEquals(foo.title, u"Default Title")
 
+    def test_autoreload_siblings(self):
+        foos = list(self.store.find(Foo).order_by(Foo.id))
+        self.store.execute("UPDATE foo SET title='New Title'")
+        self.store.autoreload()
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals([foo.title for foo in foos], ["New Title"] * 3)
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_autoreload_siblings_leaves_lazy_groups_unloaded(self):
+        bars = list(self.store.find(LazyBar).order_by(LazyBar.id))
+
+        self.assertEquals(self.count_selects(getattr, bars[0], "title"), 1)
+        self.assertEquals(bars[0].title, "Title 300")
+        for bar in bars[1:]:
+            lazy_value = get_obj_info(bar).variables[LazyBar.title].get_lazy()
+            self.assertEquals(lazy_value, AutoReload)
+
+    def test_autoreload_siblings_loads_only_eager_columns(self):
+        bars = list(self.store.find(LazyBar).order_by(LazyBar.id))
+        self.store.autoreload()
+
+        self.assertEquals(self.count_selects(getattr, bars[0], "title"), 2)
+        for bar in bars[1:]:
+            variables = get_obj_info(bar).variables
+            self.assertNotEquals(variables[LazyBar.foo_id].get_lazy(),
+                                 AutoReload)
+            self.assertEquals(variables[LazyBar.title].get_lazy(), AutoReload)
+
+    def test_autoreload_siblings_with_get_many(self):
+        foos = self.store.get_many(Foo, [10, 20, 30])
+        self.store.execute("UPDATE foo SET title='New Title'")
+        self.store.invalidate()
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals([foo.title for foo in foos], ["New Title"] * 3)
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_autoreload_siblings_with_chunks(self):
+        foos = list(self.store.find(Foo).order_by(Foo.id))
+        self.store.autoreload()
+        self.store._batch_parameters = 2
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        foos[0].title
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        for foo in foos:
+            lazy_value = get_obj_info(foo).variables[Foo.title].get_lazy()
+            self.assertNotEquals(lazy_value, AutoReload)
+
+    def test_autoreload_siblings_ignores_dirty_objects(self):
+        foo1, foo2, foo3 = self.store.find(Foo).order_by(Foo.id)
+        self.store.autoreload()
+        foo2.title = u"Changed Title"
+        self.store.execute("UPDATE foo SET title='New Title'")
+        self.assertEquals(foo1.title, "New Title")
+        self.assertEquals(foo2.title, "Changed Title")
+        self.assertEquals(foo3.title, "New Title")
+
+    def test_autoreload_siblings_ignores_lost_siblings(self):
+        foo1, foo2, foo3 = self.store.find(Foo).order_by(Foo.id)
+        self.store.autoreload()
+        self.store.execute("DELETE FROM foo WHERE id=20")
+        self.assertEquals(foo1.title, "Title 30")
+        lazy_value = get_obj_info(foo2).variables[Foo.title].get_lazy()
+        self.assertEquals(lazy_value, AutoReload)
+
+    def test_autoreload_siblings_with_lost_object(self):
+        foo1, foo2, foo3 = self.store.find(Foo).order_by(Foo.id)
+        self.store.autoreload()
+        self.store.execute("DELETE FROM foo WHERE id=10")
+        self.assertRaises(LostObjectError, getattr, foo1, "title")
+        self.assertEquals(foo2.title, "Title 20")
+
     def test_reference_break_on_local_diverged_doesnt_autoreload(self):
         foo = self.store.get(Foo, 10)
         self.store.autoreload(foo)
@@ -5416,6 +6407,657 @@ class StoreTest(object):
         self.store.invalidate()
         self.assertEquals(called, [True, True])
 
+    def test_invalidate_all_is_lazy(self):
+        foo = self.store.get(Foo, 20)
+        self.store.invalidate()
+        obj_info = get_obj_info(foo)
+        self.assertEquals(obj_info.get("invalidated"), None)
+        self.assertEquals(obj_info.variables[Foo.title].get_lazy(), None)
+
+        self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
+        self.assertEquals(foo.title, "New Title")
+
+    def test_invalidate_all_with_commit_is_lazy(self):
+        foo = self.store.get(Foo, 20)
+        self.store.commit()
+        self.store.execute("UPDATE foo SET title='New Title' WHERE id=20")
+        self.assertEquals(foo.title, "New Title")
+
+    def test_invalidate_all_then_get_validates(self):
+        foo = self.store.get(Foo, 20)
+        self.store.invalidate()
+        self.store.execute("DELETE FROM foo WHERE id=20")
+        self.assertEquals(self.store.get(Foo, 20), None)
+        self.assertRaises(LostObjectError, getattr, foo, "title")
+
+    def test_invalidate_all_then_set_keeps_value(self):
+        foo = self.store.get(Foo, 20)
+        self.store.invalidate()
+        foo.title = u"New Title"
+        self.store.flush()
+        self.assertEquals(self.store.execute("SELECT title FROM foo "
+                                             "WHERE id=20").get_one(),
+                          ("New Title",))
+
+    def test_invalidate_all_then_set_variable_keeps_value(self):
+        foo = self.store.get(Foo, 20)
+        self.store.invalidate()
+        get_obj_info(foo).variables[Foo.title].set(u"New Title")
+        self.assertEquals(foo.title, "New Title")
+
+    def test_invalidate_all_with_dirty_object(self):
+        foo = self.store.get(Foo, 20)
+        foo.title = u"New Title"
+        self.store.invalidate()
+        obj_info = get_obj_info(foo)
+        self.assertEquals(obj_info.get("invalidated"), True)
+        self.assertEquals(obj_info.variables[Foo.title].get_lazy(),
+                          AutoReload)
+
+    def test_rollback_discards_changes_lazily(self):
+        foo = self.store.get(Foo, 20)
+        foo.title = u"New Title"
+        self.store.rollback()
+        self.assertEquals(foo.title, "Title 20")
+
+    def test_invalidate_all_reference(self):
+        bar = self.store.get(Bar, 200)
+        self.assertEquals(bar.foo.id, 20)
+        self.store.invalidate()
+        self.store.execute("UPDATE bar SET foo_id=10 WHERE id=200")
+        self.assertEquals(bar.foo.id, 10)
+
+    def test_invalidated_hook_with_invalidate_all_is_lazy(self):
+        called = []
+        class MyFoo(Foo):
+            def __storm_invalidated__(self):
+                called.append(True)
+        foo = self.store.get(MyFoo, 20)
+        bar = self.store.get(Bar, 100)
+        self.store.invalidate()
+        self.assertEquals(called, [True])
+        self.assertEquals(get_obj_info(bar).get("invalidated"), None)
+
+    def test_revalidate(self):
+        foos = [self.store.get(Foo, id) for id in (10, 20, 30)]
+        self.store.invalidate()
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(self.store.revalidate(foos), [])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+        for foo in foos:
+            self.assertEquals(get_obj_info(foo).get("invalidated"), None)
+
+    def test_revalidate_lost_objects(self):
+        foos = [self.store.get(Foo, id) for id in (10, 20, 30)]
+        self.store.invalidate()
+        self.store.execute("DELETE FROM foo WHERE id=20")
+        self.assertEquals(self.store.revalidate(foos), [foos[1]])
+        self.assertEquals(get_obj_info(foos[1]).get("invalidated"), True)
+        self.assertRaises(LostObjectError, getattr, foos[1], "title")
+
+    def test_revalidate_ignores_valid_objects(self):
+        foos = [self.store.get(Foo, id) for id in (10, 20, 30)]
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(self.store.revalidate(foos), [])
+        debug(False)
+
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_revalidate_with_chunks(self):
+        foos = [self.store.get(Foo, id) for id in (10, 20, 30)]
+        self.store.invalidate()
+        self.store._batch_parameters = 2
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals(self.store.revalidate(foos), [])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_revalidate_object_in_other_store(self):
+        self.assertRaises(WrongStoreError, self.store.revalidate, [Foo()])
+
+    def create_validate_siblings_store(self):
+        store = Store(self.database, validate_siblings=True)
+        self.stores.append(store)
+        return store
+
+    def test_validate_siblings_with_get(self):
+        store = self.create_validate_siblings_store()
+        foos = [store.get(Foo, id) for id in (10, 20, 30)]
+        store.invalidate()
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertTrue(store.get(Foo, 10) is foos[0])
+        self.assertTrue(store.get(Foo, 20) is foos[1])
+        self.assertTrue(store.get(Foo, 30) is foos[2])
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_validate_siblings_with_get_lost_object(self):
+        store = self.create_validate_siblings_store()
+        foos = [store.get(Foo, id) for id in (10, 20, 30)]
+        store.invalidate()
+        store.execute("DELETE FROM foo WHERE id=20")
+        self.assertEquals(store.get(Foo, 20), None)
+        self.assertTrue(store.get(Foo, 10) is foos[0])
+
+    def test_validate_siblings_with_reference(self):
+        store = self.create_validate_siblings_store()
+        bars = [store.get(Bar, id) for id in (100, 200, 300)]
+        foos = [bar.foo for bar in bars]
+        # Only the foos are validated, not the bars.
+        for bar in bars:
+            store.invalidate(bar)
+        for foo in foos:
+            store.invalidate(foo)
+        for bar in bars:
+            store.reload(bar)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals([bar.foo for bar in bars], foos)
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_two_queue_cache_promotes_reloaded_objects(self):
+        for id in range(100, 110):
+            self.store.execute("INSERT INTO foo (id, title) VALUES (?, ?)",
+                               (id, u"Title %d" % id))
+        self.store.commit()
+        cache = TwoQueueCache(4)
+        store = Store(self.database, cache=cache)
+        self.stores.append(store)
+
+        # Objects loaded once are evicted by a scan, but their row is
+        # remembered, without keeping their object info alive.
+        obj_info_ref = weakref.ref(get_obj_info(store.get(Foo, 10)))
+        list(store.find(Foo, Foo.id >= 100, Foo.id < 104))
+        gc.collect()
+        self.assertEquals(obj_info_ref(), None)
+        self.assertEquals([obj_info.get_obj().id
+                           for obj_info in cache.get_cached()],
+                          [103, 102, 101, 100])
+
+        # Loading it again keeps it cached through further scans.
+        foo = store.get(Foo, 10)
+        list(store.find(Foo, Foo.id >= 104))
+        self.assertTrue(get_obj_info(foo) in cache.get_cached())
+
+    def test_memory_cache(self):
+        cache = MemoryCache()
+        store = Store(self.database, cache=cache)
+        self.stores.append(store)
+        foo = store.get(Foo, 10)
+        size = cache.get_size()
+        self.assertEquals(size, cache.estimate_size(get_obj_info(foo)))
+        cache.set_size(size * 2)
+        list(store.find(Foo).order_by(Foo.id))
+        self.assertEquals([obj_info.get_obj().id
+                           for obj_info in cache.get_cached()], [30, 20])
+
+    def get_cached_ids(self, store):
+        return [obj_info.get_obj().id
+                for obj_info in self.get_cache(store).get_cached()]
+
+    def test_cache_quota_from_class(self):
+        self.store.get(Foo, 10)
+        for id in [10, 20, 30]:
+            self.store.get(QuotaFoo, id)
+        gc.collect()
+        self.assertEquals(self.get_cached_ids(self.store), [10])
+        self.assertEquals(self.count_selects(self.store.get, Foo, 10), 0)
+        self.assertEquals(self.count_selects(self.store.get, QuotaFoo, 30), 0)
+        self.assertEquals(self.count_selects(self.store.get, QuotaFoo, 20), 1)
+
+    def test_cache_quota_from_store(self):
+        store = Store(self.database, cache=Cache(1),
+                      cache_quotas={Foo: 2, QuotaFoo: None})
+        self.stores.append(store)
+        for id in [10, 20, 30]:
+            store.get(QuotaFoo, id)
+        for id in [10, 20, 30]:
+            store.get(Foo, id)
+        gc.collect()
+        self.assertEquals(self.get_cached_ids(store), [30])
+        self.assertEquals(self.count_selects(store.get, QuotaFoo, 30), 0)
+        self.assertEquals(self.count_selects(store.get, Foo, 30), 0)
+        self.assertEquals(self.count_selects(store.get, Foo, 20), 0)
+        self.assertEquals(self.count_selects(store.get, Foo, 10), 1)
+
+    def test_cache_quota_cleared_on_invalidate(self):
+        self.store.get(QuotaFoo, 10)
+        self.store.invalidate()
+        gc.collect()
+        self.assertEquals(self.count_selects(self.store.get, QuotaFoo, 10), 1)
+
+    def test_pin(self):
+        store = Store(self.database, cache=Cache(0))
+        self.stores.append(store)
+        foo = store.get(Foo, 10)
+        store.pin(foo)
+        foo_ref = weakref.ref(foo)
+        del foo
+        gc.collect()
+        self.assertEquals(self.count_selects(store.get, Foo, 10), 0)
+        self.assertEquals(store.get_pinned(), [foo_ref()])
+
+        self.assertEquals(store.unpin(foo_ref()), True)
+        gc.collect()
+        self.assertEquals(foo_ref(), None)
+        self.assertEquals(store.get_pinned(), [])
+
+    def test_pin_kept_on_invalidate(self):
+        store = Store(self.database, cache=Cache(0))
+        self.stores.append(store)
+        foo = store.get(Foo, 10)
+        store.pin(foo)
+        foo_ref = weakref.ref(foo)
+        del foo
+        store.invalidate()
+        gc.collect()
+        self.assertTrue(store.get(Foo, 10) is foo_ref())
+
+    def test_pin_wrong_store(self):
+        foo = Foo()
+        self.assertRaises(WrongStoreError, self.store.pin, foo)
+
+    def test_unpin_not_pinned(self):
+        foo = self.store.get(Foo, 10)
+        self.assertEquals(self.store.unpin(foo), False)
+
+    def test_unpin_on_remove(self):
+        foo = self.store.get(Foo, 10)
+        self.store.pin(foo)
+        self.store.remove(foo)
+        self.store.flush()
+        self.assertEquals(self.store.get_pinned(), [])
+
+    def test_unpin_on_remove_before_flush(self):
+        foo = Foo()
+        foo.id = 40
+        self.store.add(foo)
+        self.store.pin(foo)
+        self.store.remove(foo)
+        self.assertEquals(self.store.get_pinned(), [])
+
+    def test_unpin_on_reset(self):
+        foo = self.store.get(Foo, 10)
+        self.store.pin(foo)
+        self.store.reset()
+        self.assertEquals(self.store.get_pinned(), [])
+
+    def test_get_stats(self):
+        store = Store(self.database, negative_cache=True)
+        self.stores.append(store)
+        foo = store.get(Foo, 10)
+        store.get(Foo, 10)
+        store.get(Foo, 40)
+        store.get(Foo, 40)
+        store.pin(foo)
+        self.assertEquals(store.get_stats(),
+                          {"alive": 1, "pinned": 1, "get_hits": 1,
+                           "get_misses": 2, "negative_hits": 1,
+                           "rebuilt": 0, "cache_size": 1,
+                           "cache_promotions": 1, "cache_insertions": 1,
+                           "cache_evictions": 0})
+
+    def test_get_stats_rebuilt(self):
+        store = Store(self.database, cache=Cache(0))
+        self.stores.append(store)
+        # Keep the object info alive while its object is deallocated.
+        obj_info = get_obj_info(store.get(Foo, 10))
+        gc.collect()
+        self.assertTrue(store.get(Foo, 10) is obj_info.get_obj())
+        self.assertEquals(store.get_stats()["rebuilt"], 1)
+
+    def test_get_stats_of_caches(self):
+        row_cache = RowCache()
+        store = Store(self.database, cache_quotas={QuotaFoo: 2},
+                      row_cache=row_cache)
+        self.stores.append(store)
+        store.get(Foo, 10)
+        store.get(QuotaFoo, 20)
+        store.get(QuotaFoo, 30)
+        stats = store.get_stats()
+        self.assertEquals(stats["cache_size"], 3)
+        self.assertEquals(stats["cache_insertions"], 3)
+        self.assertEquals(stats["row_cache_size"], 3)
+        self.assertEquals(stats["row_cache_misses"], 3)
+
+    def test_get_stats_ignores_caches_without_stats(self):
+        class StatlessCache(Cache):
+            get_stats = None
+        store = Store(self.database, cache=StatlessCache())
+        self.stores.append(store)
+        store.get(Foo, 10)
+        stats = store.get_stats()
+        self.assertEquals(stats["alive"], 1)
+        self.assertFalse("cache_size" in stats)
+
+    def create_row_cache_store(self, row_cache):
+        store = Store(self.database, row_cache=row_cache)
+        self.stores.append(store)
+        return store
+
+    def test_row_cache_get(self):
+        row_cache = RowCache()
+        store1 = self.create_row_cache_store(row_cache)
+        store2 = self.create_row_cache_store(row_cache)
+        self.assertEquals(self.count_selects(store1.get, Foo, 20), 1)
+        self.assertEquals(self.count_selects(store2.get, Foo, 20), 0)
+        foo = store2.get(Foo, 20)
+        self.assertEquals(foo.title, "Title 20")
+        self.assertEquals(Store.of(foo), store2)
+
+    def test_row_cache_filled_by_find(self):
+        row_cache = RowCache()
+        store1 = self.create_row_cache_store(row_cache)
+        store2 = self.create_row_cache_store(row_cache)
+        list(store1.find(Foo))
+        self.assertEquals(self.count_selects(store2.get, Foo, 20), 0)
+
+    def test_row_cache_not_used_for_written_class(self):
+        row_cache = RowCache()
+        store1 = self.create_row_cache_store(row_cache)
+        store2 = self.create_row_cache_store(row_cache)
+        # Objects kept alive have their rows added when they're reloaded.
+        foo10 = store1.get(Foo, 10)
+        foo20 = store1.get(Foo, 20)
+        store1.commit()
+
+        foo = store2.get(Foo, 20)
+        foo.title = u"New Title"
+        store2.flush()
+        self.assertEquals(row_cache.get(Foo, (10,)), None)
+        self.assertEquals(self.count_selects(store2.get, Foo, 10), 1)
+        self.assertEquals(row_cache.get(Foo, (10,)), None)
+
+        store2.commit()
+        self.assertEquals(self.count_selects(store1.get, Foo, 20), 1)
+        self.assertEquals(foo20.title, "New Title")
+        self.assertEquals(self.count_selects(store2.get, Foo, 20), 0)
+
+    def test_row_cache_not_used_for_table_written_through_other_class(self):
+        row_cache = RowCache()
+        store1 = self.create_row_cache_store(row_cache)
+        store2 = self.create_row_cache_store(row_cache)
+        store1.get(Foo, 20)
+        store1.commit()
+
+        store2.get(UniqueTitleFoo, 20).title = u"Changed"
+        store2.flush()
+        self.assertEquals(row_cache.get(Foo, (20,)), None)
+        store2.commit()
+
+        store1.reset()
+        self.assertEquals(store1.get(Foo, 20).title, "Changed")
+
+    def test_row_cache_filled_by_reloading_alive_objects(self):
+        row_cache = RowCache()
+        store = self.create_row_cache_store(row_cache)
+        foo = store.get(Foo, 20)
+        row_cache.clear()
+        store.invalidate(foo)
+        store.find(Foo, id=20).one()
+        self.assertEquals(row_cache.get(Foo, (20,))[1], "Title 20")
+
+    def test_row_cache_dropped_on_remove(self):
+        row_cache = RowCache()
+        store1 = self.create_row_cache_store(row_cache)
+        store2 = self.create_row_cache_store(row_cache)
+        store1.get(Foo, 20)
+        store1.commit()
+        store2.find(Foo, id=20).remove()
+        store2.commit()
+        self.assertEquals(store1.get(Foo, 20), None)
+
+    def test_row_cache_after_rollback(self):
+        row_cache = RowCache()
+        store = self.create_row_cache_store(row_cache)
+        foo = store.get(Foo, 20)
+        foo.title = u"New Title"
+        store.flush()
+        store.rollback()
+        store.get(Foo, 10)
+        self.assertEquals(row_cache.get(Foo, (10,))[1], u"Title 30")
+
+    def get_committed_changes(self, store):
+        change_sets = []
+        def changes_committed(store, change_set):
+            change_sets.append(change_set)
+        store._event.hook("changes-committed", changes_committed)
+        return change_sets
+
+    def test_changes_committed(self):
+        store = self.create_invalidation_bus_store(LocalInvalidationBus())
+        change_sets = self.get_committed_changes(store)
+        foo = Foo()
+        foo.id = 40
+        foo.title = u"Title 40"
+        store.add(foo)
+        store.get(Foo, 20).title = u"New Title"
+        store.remove(store.get(Foo, 30))
+        store.commit()
+        self.assertEquals(len(change_sets), 1)
+        change_set = change_sets[0]
+        self.assertEquals(change_set.inserted, set([("foo", (40,))]))
+        self.assertEquals(change_set.updated, set([("foo", (20,))]))
+        self.assertEquals(change_set.deleted, set([("foo", (30,))]))
+        self.assertEquals(change_set.tables, set())
+        self.assertEquals(change_set.store, store)
+
+    def test_changes_committed_with_changed_primary_key(self):
+        store = self.create_invalidation_bus_store(LocalInvalidationBus())
+        change_sets = self.get_committed_changes(store)
+        store.get(Foo, 20).id = 40
+        store.commit()
+        self.assertEquals(change_sets[0].updated,
+                          set([("foo", (20,)), ("foo", (40,))]))
+
+    def test_changes_committed_merged(self):
+        store = self.create_invalidation_bus_store(LocalInvalidationBus())
+        change_sets = self.get_committed_changes(store)
+        foo = Foo()
+        foo.id = 40
+        store.add(foo)
+        store.flush()
+        foo.title = u"Title 40"
+        store.flush()
+        store.remove(store.get(Foo, 20))
+        store.flush()
+        foo = Foo()
+        foo.id = 20
+        store.add(foo)
+        store.commit()
+        self.assertEquals(change_sets[0].inserted, set([("foo", (40,))]))
+        self.assertEquals(change_sets[0].updated, set([("foo", (20,))]))
+        self.assertEquals(change_sets[0].deleted, set())
+
+    def test_changes_committed_not_emitted_without_changes(self):
+        store = self.create_invalidation_bus_store(LocalInvalidationBus())
+        change_sets = self.get_committed_changes(store)
+        foo = Foo()
+        foo.id = 40
+        store.add(foo)
+        store.flush()
+        store.remove(foo)
+        store.commit()
+        self.assertEquals(change_sets, [])
+
+    def test_changes_committed_with_result_set(self):
+        store = self.create_invalidation_bus_store(LocalInvalidationBus())
+        change_sets = self.get_committed_changes(store)
+        store.find(Foo, id=20).set(title=u"New Title")
+        store.find(Bar, id=100).remove()
+        store.commit()
+        self.assertEquals(change_sets[0].tables, set(["foo", "bar"]))
+
+    def test_changes_forgotten_on_rollback(self):
+        store = self.create_invalidation_bus_store(LocalInvalidationBus())
+        change_sets = self.get_committed_changes(store)
+        store.get(Foo, 20).title = u"New Title"
+        store.flush()
+        store.rollback()
+        store.commit()
+        self.assertEquals(change_sets, [])
+
+    def test_changes_not_tracked_without_row_cache_or_bus(self):
+        change_sets = self.get_committed_changes(self.store)
+        self.store.get(Foo, 20).title = u"New Title"
+        self.store.find(Bar, id=100).remove()
+        self.store.commit()
+        self.assertEquals(change_sets, [])
+
+    def test_changes_not_tracked_for_unchanged_objects(self):
+        store = self.create_invalidation_bus_store(LocalInvalidationBus())
+        change_sets = self.get_committed_changes(store)
+        foo = store.get(Foo, 20)
+        foo.title = u"New Title"
+        foo.title = u"Title 20"
+        store.commit()
+        self.assertEquals(change_sets, [])
+
+    def create_invalidation_bus_store(self, invalidation_bus, row_cache=None):
+        store = Store(self.database, row_cache=row_cache,
+                      invalidation_bus=invalidation_bus)
+        self.stores.append(store)
+        return store
+
+    def test_invalidation_bus_drops_cached_table(self):
+        bus = LocalInvalidationBus()
+        store1 = self.create_invalidation_bus_store(bus)
+        store2 = self.create_invalidation_bus_store(bus)
+        foo = store1.get(TimedCachedFoo, 20)
+        store1.commit()
+        store2.get(TimedCachedFoo, 20).title = u"New Title"
+        store2.commit()
+        self.assertEquals(foo.title, "Title 20")
+        store1.rollback()
+        self.assertEquals(foo.title, "New Title")
+
+    def test_invalidation_bus_drops_cached_table_of_other_class(self):
+        bus = LocalInvalidationBus()
+        store1 = self.create_invalidation_bus_store(bus)
+        store2 = self.create_invalidation_bus_store(bus)
+        foo = store1.get(TimedCachedFoo, 20)
+        store1.commit()
+        store2.get(Foo, 20).title = u"New Title"
+        store2.commit()
+        store1.rollback()
+        self.assertEquals(foo.title, "New Title")
+
+    def test_invalidation_bus_drops_cached_table_by_class(self):
+        bus = LocalInvalidationBus()
+        store1 = self.create_invalidation_bus_store(bus)
+        store2 = self.create_invalidation_bus_store(bus)
+        foo = store1.get(TimedCachedFoo, 20)
+        store1.commit()
+        store2.find(TimedCachedFoo, id=20).set(title=u"New Title")
+        store2.commit()
+        store1.commit()
+        self.assertEquals(foo.title, "New Title")
+
+    def test_invalidation_bus_drops_row_cache_entries(self):
+        bus = LocalInvalidationBus()
+        row_cache = RowCache()
+        store1 = self.create_invalidation_bus_store(bus, row_cache)
+        store2 = self.create_invalidation_bus_store(bus)
+        store1.get(Foo, 10)
+        store1.get(Foo, 20)
+        store1.commit()
+        store2.get(Foo, 20).title = u"New Title"
+        store2.commit()
+        store1.commit()
+        self.assertEquals(row_cache.get(Foo, (20,)), None)
+        self.assertNotEquals(row_cache.get(Foo, (10,)), None)
+        self.assertEquals(store1.get(Foo, 20).title, "New Title")
+
+    def test_invalidation_bus_ignores_own_changes(self):
+        bus = LocalInvalidationBus()
+        store = self.create_invalidation_bus_store(bus)
+        foo = store.get(TimedCachedFoo, 20)
+        foo.title = u"New Title"
+        store.commit()
+        self.assertEquals(self.count_selects(getattr, foo, "title"), 0)
+
+    def capture_log(self):
+        stream = StringIO()
+        handler = logging.StreamHandler(stream)
+        logger = logging.getLogger("storm")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return stream
+
+    def break_invalidation_bus(self, bus, method_name):
+        def broken(*args):
+            raise IOError("Bus is down")
+        setattr(bus, method_name, broken)
+
+    def test_invalidation_bus_publish_error(self):
+        bus = LocalInvalidationBus()
+        row_cache = RowCache()
+        store = self.create_invalidation_bus_store(bus, row_cache)
+        log = self.capture_log()
+        self.break_invalidation_bus(bus, "publish")
+        store.get(Bar, 100)
+        foo = store.get(TimedCachedFoo, 20)
+        foo.title = u"New Title"
+        store.commit()
+        self.assertIn("Bus is down", log.getvalue())
+        self.assertEquals(row_cache.get(Bar, (100,)), None)
+        self.assertEquals(
+            self.count_selects(list, store.find(TimedCachedFoo)), 1)
+        store.rollback()
+        self.assertEquals(foo.title, "New Title")
+
+    def test_invalidation_bus_poll_error(self):
+        bus = LocalInvalidationBus()
+        row_cache = RowCache()
+        store = self.create_invalidation_bus_store(bus, row_cache)
+        log = self.capture_log()
+        list(store.find(TimedCachedFoo))
+        store.get(Bar, 100)
+        self.break_invalidation_bus(bus, "poll")
+        store.rollback()
+        self.assertIn("Bus is down", log.getvalue())
+        self.assertEquals(row_cache.get(Bar, (100,)), None)
+        self.assertEquals(
+            self.count_selects(list, store.find(TimedCachedFoo)), 1)
+
+    def test_invalidation_bus_lost_changes(self):
+        bus = LocalInvalidationBus()
+        row_cache = RowCache()
+        store = self.create_invalidation_bus_store(bus, row_cache)
+        list(store.find(TimedCachedFoo))
+        store.get(Bar, 100)
+        bus.publish(ChangeSet(lost=True))
+        store.commit()
+        self.assertEquals(row_cache.get(Bar, (100,)), None)
+        self.assertEquals(
+            self.count_selects(list, store.find(TimedCachedFoo)), 1)
+
+    def test_invalidation_bus_unsubscribed_on_close(self):
+        bus = LocalInvalidationBus()
+        store = Store(self.database, invalidation_bus=bus)
+        store.close()
+        self.assertEquals(bus._subscribers, [])
+
     def test_reset_recreates_objects(self):
         """
         After resetting the store, all queries return fresh objects, even if
@@ -5892,6 +7534,235 @@ class StoreTest(object):
         for i in range(len(foos)-1):
             self.assertTrue(foos[i].id < foos[i+1].id)
 
+    def test_flush_inserts_objects_with_known_keys_at_once(self):
+        """
+        Added objects of the same class with values for the same columns
+        are inserted with a single multi-row statement when their primary
+        keys are already known.
+        """
+        foos = []
+        for id in (40, 50, 60):
+            foo = Foo()
+            foo.id = id
+            foo.title = u"Title %d" % id
+            foos.append(self.store.add(foo))
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("INSERT"), 1)
+        self.assertEquals(self.get_items()[3:], [(40, "Title 40"),
+                                                 (50, "Title 50"),
+                                                 (60, "Title 60")])
+        for foo in foos:
+            self.assertEquals(self.store.get(Foo, foo.id), foo)
+            self.assertFalse(get_obj_info(foo).variables[Foo.id].has_changed())
+
+    def test_flush_inserts_objects_at_once_failure_and_rollback(self):
+        """
+        Objects which weren't inserted because a multi-row INSERT failed
+        are detached from the store by rollback(), as if they were never
+        flushed, and may be added again.
+        """
+        foos = []
+        for id in (40, 10, 50):
+            foo = Foo()
+            foo.id = id
+            foo.title = u"Title %d" % id
+            foos.append(self.store.add(foo))
+
+        # Foo 10 already exists.
+        self.assertRaises(Exception, self.store.flush)
+        self.store.rollback()
+
+        for foo in foos:
+            self.assertEquals(Store.of(foo), None)
+
+        foos[2].id = 60
+        self.store.add(foos[2])
+        self.store.commit()
+
+        self.assertEquals(self.store.execute("SELECT title FROM foo "
+                                             "WHERE id=60").get_all(),
+                          [("Title 50",)])
+
+    def test_flush_inserts_objects_with_known_keys_at_once_only(self):
+        """
+        Objects without a known primary key are inserted one at a time,
+        around those inserted together.
+        """
+        foos = []
+        for id in (40, 50, None, 60, 70):
+            foo = Foo()
+            if id is not None:
+                foo.id = id
+            foo.title = u"Title %s" % id
+            foos.append(self.store.add(foo))
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("INSERT"), 3)
+        self.assertEquals(self.store.get(Foo, foos[2].id).title, "Title None")
+        for foo in foos:
+            self.assertEquals(self.store.get(Foo, foo.id), foo)
+
+    def test_flush_inserts_objects_with_different_columns_separately(self):
+        foo1 = Foo()
+        foo1.id = 40
+        foo1.title = u"Title 40"
+        foo2 = Foo()
+        foo2.id = 50
+        self.store.add(foo1)
+        self.store.add(foo2)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("INSERT"), 2)
+        self.assertEquals(foo2.title, "Default Title")
+
+    def test_flush_batched_inserts_respect_flush_order(self):
+        class MyFoo(Foo):
+            flushed = []
+            def __storm_flushed__(self):
+                self.flushed.append(self.id)
+
+        foos = []
+        for id in (40, 50, 60):
+            foo = MyFoo()
+            foo.id = id
+            foo.title = u"Title %d" % id
+            foos.append(self.store.add(foo))
+        self.store.add_flush_order(foos[0], foos[1])
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("INSERT"), 2)
+        self.assertEquals(MyFoo.flushed, [40, 60, 50])
+
+    def test_flush_removes_objects_at_once(self):
+        """
+        Removed objects of the same class are deleted with a single
+        statement, and each of them stops being tracked by the store.
+        """
+        class MyFoo(Foo):
+            flushed = []
+            def __storm_flushed__(self):
+                self.flushed.append(self.id)
+
+        foos = list(self.store.find(MyFoo).order_by(MyFoo.id))
+        for foo in foos:
+            self.store.remove(foo)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("DELETE"), 1)
+        self.assertEquals(self.get_items(), [])
+        self.assertEquals(MyFoo.flushed, [10, 20, 30])
+        for foo in foos:
+            self.assertEquals(Store.of(foo), None)
+            self.assertEquals(self.store.get(MyFoo, foo.id), None)
+
+    def test_flush_removes_objects_with_composed_key_at_once(self):
+        links = list(self.store.find(Link, foo_id=10))
+        for link in links:
+            self.store.remove(link)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("DELETE"), 1)
+        self.assertEquals(
+            sorted(self.store.find(Link).values(Link.foo_id, Link.bar_id)),
+            [(20, 100), (20, 200), (30, 300)])
+
+    def test_flush_removes_objects_of_different_classes_separately(self):
+        foo1 = self.store.get(Foo, 10)
+        bar = self.store.get(Bar, 100)
+        foo2 = self.store.get(Foo, 20)
+        self.store.remove(foo1)
+        self.store.remove(bar)
+        self.store.remove(foo2)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("DELETE"), 3)
+        self.assertEquals(self.get_items(), [(30, "Title 10")])
+
+    def test_flush_updates_objects_with_same_changes_at_once(self):
+        foos = [self.store.get(Foo, id) for id in (10, 20, 30)]
+        for foo in foos:
+            foo.title = u"New %d" % foo.id
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("UPDATE"), 1)
+        self.assertEquals(stream.getvalue().count("EXECUTE MANY"), 1)
+        self.assertEquals(self.get_items(), [(10, "New 10"),
+                                             (20, "New 20"),
+                                             (30, "New 30")])
+
+    def test_flush_updates_objects_with_different_changes_separately(self):
+        bar1 = self.store.get(Bar, 100)
+        bar2 = self.store.get(Bar, 200)
+        bar1.title = u"New Title"
+        bar2.foo_id = 30
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("UPDATE"), 2)
+        self.assertEquals(stream.getvalue().count("EXECUTE MANY"), 0)
+        result = self.store.execute("SELECT id, foo_id, title FROM bar "
+                                    "WHERE id IN (100, 200) ORDER BY id")
+        self.assertEquals(list(result), [(100, 10, "New Title"),
+                                         (200, 30, "Title 200")])
+
+    def test_flush_updates_objects_at_once_with_changed_primary_key(self):
+        foo1 = self.store.get(Foo, 10)
+        foo2 = self.store.get(Foo, 20)
+        foo1.id = 40
+        foo2.id = 50
+        self.store.flush()
+
+        self.assertEquals(self.get_items(), [(30, "Title 10"),
+                                             (40, "Title 30"),
+                                             (50, "Title 20")])
+        self.assertTrue(self.store.get(Foo, 40) is foo1)
+        self.assertTrue(self.store.get(Foo, 50) is foo2)
+
     def test_update_order_is_preserved_when_possible(self):
         class MyFoo(Foo):
             sequence = 0
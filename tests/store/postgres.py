@@ -18,12 +18,14 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+from cStringIO import StringIO
 import os
 import gc
 
 from storm.database import create_database
 from storm.properties import Enum, Int, List
 from storm.info import get_obj_info
+from storm.tracer import debug
 
 from tests.store.base import StoreTest, EmptyResultSetTest, Foo
 from tests.helper import TestHelper
@@ -190,6 +192,29 @@ class PostgresStoreTest(TestHelper, StoreTest):
         self.store.flush()
         self.assertEquals(foo2.id-foo1.id, 1)
 
+    def test_flush_inserts_objects_with_unknown_keys_separately(self):
+        """
+        Objects relying on the database to generate their primary key
+        are inserted one at a time, retrieving the key with RETURNING,
+        so that each object gets the key of its own row.
+        """
+        foos = [self.store.add(Foo()) for i in range(3)]
+        for i, foo in enumerate(foos):
+            foo.title = u"Title %d" % i
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.store.flush()
+        debug(False)
+
+        self.assertEquals(stream.getvalue().count("INSERT"), 3)
+        for i, foo in enumerate(foos):
+            self.assertEquals(foo.title, u"Title %d" % i)
+            self.assertEquals(self.store.find(Foo, id=foo.id).one(), foo)
+        self.assertEquals(foos[1].id - foos[0].id, 1)
+        self.assertEquals(foos[2].id - foos[1].id, 1)
+
     def test_list_unnecessary_update(self):
         """
         Flushing an object with a list variable doesn't create an unnecessary
@@ -18,10 +18,11 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+from storm.cache import RowCache
 from storm.databases.sqlite import SQLite
 from storm.uri import URI
 
-from tests.store.base import StoreTest, EmptyResultSetTest
+from tests.store.base import StoreTest, EmptyResultSetTest, Foo
 from tests.helper import TestHelper, MakePath
 
 
@@ -70,6 +71,21 @@ class SQLiteStoreTest(TestHelper, StoreTest):
     def drop_tables(self):
         pass
 
+    def test_row_cache_not_filled_from_older_transaction(self):
+        # In WAL mode, readers keep their snapshot while others commit.
+        connection = self.database.raw_connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.close()
+        row_cache = RowCache()
+        store1 = self.create_row_cache_store(row_cache)
+        store2 = self.create_row_cache_store(row_cache)
+        store3 = self.create_row_cache_store(row_cache)
+        self.assertEquals(store1.get(Foo, 20).title, "Title 20")
+        store2.get(Foo, 20).title = u"New Title"
+        store2.commit()
+        self.assertEquals(store1.find(Foo, id=20).one().title, "Title 20")
+        self.assertEquals(store3.get(Foo, 20).title, "New Title")
+
 
 class SQLiteEmptyResultSetTest(TestHelper, EmptyResultSetTest):
 
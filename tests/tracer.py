@@ -209,6 +209,21 @@ class DebugTracerTest(TestHelper):
         self.tracer.connection_raw_execute_success(connection, raw_cursor,
                                                    statement, params)
 
+    def test_connection_raw_execute_many(self):
+        self.stream.write(
+            "[04:05:06.000007] EXECUTE MANY: 'STATEMENT', "
+            "[('PARAM',), (1,)]\n")
+        self.stream.flush()
+        self.mocker.replay()
+
+        connection = "CONNECTION"
+        raw_cursor = "RAW_CURSOR"
+        statement = "STATEMENT"
+        params_list = [[self.variable], [1]]
+
+        self.tracer.connection_raw_execute_many(connection, raw_cursor,
+                                                statement, params_list)
+
 
 class TimeoutTracerTestBase(TestHelper):
 
@@ -384,6 +399,13 @@ class BaseStatementTracerTest(TestCase):
         tracer.connection_raw_execute('foo', 'bar', 'baz ? %s', ())
         self.assertEqual([('foo', 'bar', 'baz ? %s')], tracer.calls)
 
+    def test_execute_many_not_expanded(self):
+        """Statements executed many times are logged once, unexpanded."""
+        tracer = self.LoggingBaseStatementTracer()
+        tracer.connection_raw_execute_many(
+            'foo', 'bar', 'baz ?', [(1,), (2,)])
+        self.assertEqual([('foo', 'bar', 'baz ?')], tracer.calls)
+
     def test_params_substituted_pyformat(self):
         tracer = self.LoggingBaseStatementTracer()
         conn = StubConnection()